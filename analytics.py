@@ -0,0 +1,97 @@
+"""گزارش فروش ادمین (/stats).
+
+گزارش فقط از جدول sales_daily خوانده می‌شود که update_transaction_status آن را هم‌زمان با تغییر
+وضعیت هر تراکنش به‌روز می‌کند، پس هزینه /stats به تعداد تراکنش‌ها بستگی ندارد. نمودارها با
+matplotlib در یک ProcessPoolExecutor جداگانه رسم می‌شوند تا رسم چند صد میلی‌ثانیه‌ای آن‌ها نه حلقه
+رویداد و نه ترد پایگاه داده را معطل کند.
+"""
+import asyncio
+import io
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import catalog
+import config
+import database as db
+
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: پروسه رسم ترد‌ها و اتصال‌های SQLite پروسه ربات را به ارث نمی‌برد
+        _pool = ProcessPoolExecutor(max_workers=config.CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def render_charts(days, revenue_series, stock):
+    """در پروسه رسم اجرا می‌شود و PNG را برمی‌گرداند.
+
+    days: لیست روزها، revenue_series: {برچسب محصول: لیست درآمد هر روز}، stock: لیست (برچسب، تعداد لینک آزاد).
+    برچسب‌ها لاتین‌اند چون matplotlib متن فارسی را بدون اتصال حروف رسم می‌کند.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    figure, (revenue_axes, stock_axes) = plt.subplots(2, 1, figsize=(9, 8))
+    bottom = [0] * len(days)
+    for label, values in revenue_series.items():
+        revenue_axes.bar(days, values, bottom=bottom, label=label)
+        bottom = [total + value for total, value in zip(bottom, values)]
+    revenue_axes.set_title("Daily revenue (Toman)")
+    revenue_axes.tick_params(axis="x", labelrotation=60, labelsize=7)
+    if revenue_series:
+        revenue_axes.legend(fontsize=8)
+
+    stock_axes.bar([label for label, _ in stock], [count for _, count in stock], color="tab:green")
+    stock_axes.set_title("Unused links in bank")
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=100)
+    plt.close(figure)
+    return buffer.getvalue()
+
+async def build_report(days=None):
+    """(متن خلاصه، PNG نمودارها) برای days روز اخیر."""
+    days = days or config.STATS_DEFAULT_DAYS
+    first_day = date.today() - timedelta(days=days - 1)
+    day_labels = [(first_day + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+    rows = await db.run(db.get_sales_daily, day_labels[0])
+    stock_rows = await db.run(db.get_link_bank_status)
+
+    position = {day: i for i, day in enumerate(day_labels)}
+    revenue = defaultdict(lambda: [0] * days)
+    totals = defaultdict(lambda: [0, 0, 0])   # product_id -> [approved, revenue, rejected]
+    for day, product_id, approved_count, day_revenue, rejected_count in rows:
+        if day in position:
+            revenue[product_id][position[day]] += day_revenue
+        total = totals[product_id]
+        total[0] += approved_count
+        total[1] += day_revenue
+        total[2] += rejected_count
+
+    def name(product_id):
+        details = catalog.get_product_details(product_id)
+        return details[0] if details else f"#{product_id}"
+
+    text = f"📈 **گزارش فروش {days} روز اخیر**\n\n"
+    for product_id, (approved_count, product_revenue, rejected_count) in sorted(totals.items()):
+        text += f"🔹 `#{product_id}` {name(product_id)}: {approved_count} فروش | {product_revenue:,} تومان | {rejected_count} رد\n"
+    if not totals:
+        text += "در این بازه تراکنش تایید یا ردشده‌ای وجود ندارد.\n"
+    text += f"\n💰 جمع درآمد: **{sum(total[1] for total in totals.values()):,} تومان**"
+
+    stock = [(f"#{catalog.get_product_id_by_name(product_name) or product_name}", count) for product_name, count in stock_rows]
+    revenue_series = {f"#{product_id}": values for product_id, values in sorted(revenue.items())}
+    loop = asyncio.get_running_loop()
+    chart = await loop.run_in_executor(_get_pool(), render_charts, [day[5:] for day in day_labels], revenue_series, stock)
+    return text, chart
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
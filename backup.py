@@ -0,0 +1,65 @@
+"""بکاپ آنلاین، سازگار و فشرده از پایگاه داده.
+
+کپی با API بکاپ خود SQLite در یک مرحله گرفته می‌شود؛ در حالت WAL این کپی فقط یک تراکنش خواندن است
+و نوشتن‌های ربات در طول بکاپ متوقف نمی‌شوند. کپی و فشرده‌سازی روی یک ترد جدا (نه ترد پایگاه داده و
+نه حلقه رویداد) انجام می‌شود و فقط BACKUP_RETENTION فایل آخر نگه داشته می‌شود.
+"""
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+
+import config
+import database as db
+import outbox
+
+logger = logging.getLogger(__name__)
+
+_lock = asyncio.Lock()
+
+def create_backup():
+    """یک بکاپ فشرده می‌سازد و مسیر فایل .db.gz را برمی‌گرداند؛ این تابع blocking است."""
+    os.makedirs(config.BACKUP_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    raw_path = os.path.join(config.BACKUP_DIR, f"backup_{timestamp}.db")
+    source = sqlite3.connect(db.DATABASE_NAME)
+    target = sqlite3.connect(raw_path)
+    try:
+        # بکاپ چندمرحله‌ای با هر نوشتن اتصال دیگری بین مراحل از اول شروع می‌شود و زیر بار نوشتن ممکن
+        # است هرگز تمام نشود؛ یک مرحله روی snapshot تراکنش خواندن انجام می‌شود
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    gz_path = raw_path + ".gz"
+    with open(raw_path, "rb") as raw_file, gzip.open(gz_path, "wb", compresslevel=6) as gz_file:
+        shutil.copyfileobj(raw_file, gz_file, 1024 * 1024)
+    os.remove(raw_path)
+    _apply_retention()
+    return gz_path
+
+def _apply_retention():
+    backups = sorted(glob.glob(os.path.join(config.BACKUP_DIR, "backup_*.db.gz")))
+    for old_backup in backups[:-config.BACKUP_RETENTION]:
+        os.remove(old_backup)
+
+async def send_backup(bot):
+    """بکاپ را می‌سازد و به کانال مدیریت می‌فرستد؛ بکاپ‌های هم‌زمان پشت سر هم اجرا می‌شوند."""
+    async with _lock:
+        path = await asyncio.to_thread(create_backup)
+        filename = os.path.basename(path)
+        with open(path, "rb") as backup_file:
+            await outbox.send(bot.send_document, chat_id=config.ADMIN_CHANNEL_ID, document=backup_file, filename=filename, caption=f"Backup\n{filename}",
+                              read_timeout=120, write_timeout=120, priority=outbox.BULK)
+        return path
+
+async def backup_job(context):
+    try:
+        await send_backup(context.bot)
+    except Exception:
+        logger.exception("Scheduled backup failed")
@@ -0,0 +1,115 @@
+"""مسیریابی callback_data دکمه‌ها با یک trie پیشوندی.
+
+به‌جای چند CallbackQueryHandler که هر کدام با re.match روی callback_data امتحان می‌شوند، هر گروه
+از مسیرها (مثلا همه دکمه‌های یک وضعیت مکالمه) در یک CallbackRouter ثبت می‌شود. الگوها بخش‌های
+جداشده با «_» هستند و بخش‌های {name:int} یا {name} پارامترند:
+
+    router = CallbackRouter({"product_{product_id:int}": select_product, "back_to_home": go_home})
+
+یافتن مسیر یک پیمایش دیکشنری به تعداد بخش‌های callback_data است و مقدار پارامترها به‌صورت
+آرگومان کلیدی به هندلر داده می‌شود: select_product(update, context, product_id=3).
+در هر گره بخش ثابت بر پارامتر مقدم است و برگشت به عقب انجام نمی‌شود.
+"""
+import re
+
+from telegram import Update
+from telegram._utils.defaultvalue import DEFAULT_TRUE
+from telegram.ext import BaseHandler
+
+
+def _to_int(token):
+    # isdigit رقم‌هایی مثل «²» را هم قبول می‌کند که int آن‌ها را نمی‌پذیرد؛ callback_data از کلاینت می‌آید
+    return int(token) if token.isascii() and token.isdecimal() else None
+
+
+def _to_str(token):
+    return token or None
+
+
+_CONVERTERS = {"int": _to_int, "str": _to_str}
+
+# «_» های داخل {...} (مثل {product_id:int}) جداکننده نیستند
+_PATTERN_SEPARATOR = re.compile(r"_(?![^{]*\})")
+
+
+class _Node:
+    __slots__ = ("children", "param", "callback")
+
+    def __init__(self):
+        self.children = {}
+        self.param = None      # (name, converter, _Node)
+        self.callback = None
+
+
+class CallbackRouter:
+    def __init__(self, routes=None):
+        self._root = _Node()
+        self.patterns = []
+        for pattern, callback in (routes or {}).items():
+            self.add(pattern, callback)
+
+    def add(self, pattern, callback):
+        node = self._root
+        for token in _PATTERN_SEPARATOR.split(pattern):
+            if token.startswith("{") and token.endswith("}"):
+                name, _, kind = token[1:-1].partition(":")
+                converter = _CONVERTERS[kind or "str"]
+                if node.param is None:
+                    node.param = (name, converter, _Node())
+                elif node.param[:2] != (name, converter):
+                    raise ValueError(f"conflicting parameter {token!r} in callback route {pattern!r}")
+                node = node.param[2]
+            else:
+                node = node.children.setdefault(token, _Node())
+        if node.callback is not None:
+            raise ValueError(f"duplicate callback route {pattern!r}")
+        node.callback = callback
+        self.patterns.append(pattern)
+
+    def resolve(self, data):
+        """(callback, kwargs) مسیر منطبق با data یا None."""
+        node = self._root
+        kwargs = {}
+        for token in data.split("_"):
+            child = node.children.get(token)
+            if child is None:
+                if node.param is None:
+                    return None
+                name, converter, child = node.param
+                value = converter(token)
+                if value is None:
+                    return None
+                kwargs[name] = value
+            node = child
+        if node.callback is None:
+            return None
+        return node.callback, kwargs
+
+
+class CallbackRouteHandler(BaseHandler):
+    """هندلر PTB که یک CallbackRouter را جایگزین چند CallbackQueryHandler می‌کند؛ در ConversationHandler هم قابل استفاده است."""
+
+    __slots__ = ("router",)
+
+    def __init__(self, routes, block=DEFAULT_TRUE):
+        self.router = routes if isinstance(routes, CallbackRouter) else CallbackRouter(routes)
+        super().__init__(self._unrouted, block=block)
+
+    @staticmethod
+    async def _unrouted(update, context):
+        raise RuntimeError("CallbackRouteHandler callbacks are resolved in check_update")
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or update.callback_query is None:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+        return self.router.resolve(data)
+
+    async def handle_update(self, update, application, check_result, context):
+        callback, kwargs = check_result
+        return await callback(update, context, **kwargs)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}[routes={self.router.patterns}]"
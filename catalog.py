@@ -0,0 +1,64 @@
+"""کش درون‌حافظه‌ای کاتالوگ محصولات.
+
+محصولات یک بار از پایگاه داده خوانده می‌شوند و کیبوردها و متن‌های ثابت فرآیند خرید
+از همان ابتدا ساخته می‌شوند؛ پس از هر تغییر در جدول products باید reload صدا زده شود.
+"""
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import database as db
+
+_products = []          # [(id, name, price)]
+_details = {}           # id -> (name, price, description)
+_ids_by_name = {}       # name -> id
+_products_keyboard = None
+_link_products_keyboard = None
+_product_views = {}     # id -> (text, reply_markup)
+
+def _product_view(name, price):
+    text = f"شما «{name}» را انتخاب کردید.\n💰 قیمت: {price:,} تومان\n\nبرای ادامه دکمه‌ای را انتخاب کنید."
+    keyboard = [
+        [InlineKeyboardButton("✅ ادامه و پرداخت", callback_data='confirm_payment_info')],
+        [InlineKeyboardButton("🎁 اعمال کد تخفیف", callback_data='apply_discount_code')],
+        [InlineKeyboardButton("⬅️ بازگشت به داشبورد", callback_data="cancel_purchase")]
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+def load():
+    """کاتالوگ را به‌صورت هم‌زمان (sync) بارگذاری می‌کند؛ در استارت‌آپ یا روی ترد پایگاه داده صدا زده شود."""
+    global _products, _details, _ids_by_name, _products_keyboard, _link_products_keyboard, _product_views
+    rows = db.get_all_products()
+    products = [(product_id, name, price) for product_id, name, price, _ in rows]
+    details = {product_id: (name, price, description) for product_id, name, price, description in rows}
+
+    keyboard = [[InlineKeyboardButton(f"{name} - {price:,} تومان", callback_data=f"product_{product_id}")] for product_id, name, price in products]
+    keyboard.append([InlineKeyboardButton("⬅️ بازگشت به داشبورد", callback_data="cancel_purchase")])
+    link_keyboard = [[InlineKeyboardButton(name, callback_data=f"linkprod_{product_id}")] for product_id, name, _ in products]
+    link_keyboard.append([InlineKeyboardButton("لغو", callback_data="cancel_addlink")])
+
+    # جایگزینی یکجا تا هندلرهای در حال اجرا هیچ‌وقت کش نیمه‌کاره نبینند
+    _products = products
+    _details = details
+    _ids_by_name = {name: product_id for product_id, name, _ in products}
+    _products_keyboard = InlineKeyboardMarkup(keyboard)
+    _link_products_keyboard = InlineKeyboardMarkup(link_keyboard)
+    _product_views = {product_id: _product_view(name, price) for product_id, name, price in products}
+
+async def reload():
+    await db.run(load)
+
+def get_products():
+    return _products
+
+def get_product_details(product_id):
+    return _details.get(product_id)
+
+def get_product_id_by_name(product_name):
+    return _ids_by_name.get(product_name)
+
+def products_keyboard():
+    return _products_keyboard
+
+def link_products_keyboard():
+    return _link_products_keyboard
+
+def product_view(product_id):
+    return _product_views.get(product_id)
@@ -0,0 +1,348 @@
+"""حالت چند پروسه‌ای: N پروسه worker و یک پروسه نویسنده پایگاه داده.
+
+- پروسه اصلی فقط آپدیت‌ها را از تلگرام می‌گیرد (polling یا webhook) و هر آپدیت را بر اساس
+  شناسه کاربر (ordering_key) به یک worker ثابت می‌فرستد؛ پس وضعیت مکالمه و user_data هر کاربر
+  همیشه در یک پروسه می‌ماند و ترتیب آپدیت‌های او حفظ می‌شود.
+- هر worker یک Application کامل (build_application) اجرا می‌کند. خواندن‌ها روی اتصال محلی خود
+  worker انجام می‌شوند (WAL اجازه خواندن هم‌زمان می‌دهد) و توابع نویسنده database.py از طریق
+  db.run به پروسه نویسنده فرستاده می‌شوند.
+- پروسه نویسنده درخواست‌های همه worker ها را جمع می‌کند و هر دسته را در یک تراکنش و با یک commit
+  ثبت می‌کند (group commit)؛ هر درخواست savepoint خودش را دارد تا خطای یکی بقیه را خراب نکند.
+  پیام‌های events.py هم از همین مسیر به worker های دیگر می‌رسند.
+- کارهای دوره‌ای سراسری (بکاپ، انقضا و نگهداری تراکنش‌ها) فقط در worker شماره صفر زمان‌بندی
+  می‌شوند و سهمیه نرخ صف خروجی بین worker ها تقسیم می‌شود.
+"""
+import asyncio
+import inspect
+import itertools
+import logging
+import multiprocessing
+import pickle
+import signal
+import sqlite3
+import threading
+from multiprocessing.connection import wait
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import config
+import database as db
+import events
+from update_processor import ordering_key
+
+logger = logging.getLogger(__name__)
+
+
+# ==================================
+# === پروسه نویسنده ===
+# ==================================
+class GroupCommitConnection(sqlite3.Connection):
+    """در طول یک دسته، commit و rollback توابع database.py به savepoint همان درخواست محدود می‌شوند."""
+    batching = False
+
+    def commit(self):
+        if not self.batching:
+            super().commit()
+
+    def rollback(self):
+        if self.batching:
+            self.execute("ROLLBACK TO request")
+        else:
+            super().rollback()
+
+
+def _error(exc):
+    # استثناها باید pickle شوند؛ اگر نشد متن آن فرستاده می‌شود
+    try:
+        pickle.dumps(exc)
+        return exc
+    except Exception:
+        return RuntimeError(repr(exc))
+
+
+def _execute_batch(conn, batch):
+    """batch: لیست (conn, req_id, name, args, kwargs). خروجی: لیست (ok, value) به همان ترتیب."""
+    results = []
+    conn.execute("BEGIN")
+    conn.batching = True
+    try:
+        for _, _, name, args, kwargs in batch:
+            func = getattr(db, name, None)
+            if not getattr(func, "writes", False):
+                results.append((False, RuntimeError(f"{name} is not a database write function")))
+                continue
+            conn.execute("SAVEPOINT request")
+            try:
+                results.append((True, func(*args, **kwargs)))
+            except Exception as exc:
+                if not conn.in_transaction:
+                    # SQLite کل تراکنش را برگردانده؛ نتیجه درخواست‌های قبلی این دسته هم از دست رفته
+                    raise
+                conn.execute("ROLLBACK TO request")
+                results.append((False, _error(exc)))
+            conn.execute("RELEASE request")
+        conn.batching = False
+        conn.commit()
+    except Exception as exc:
+        conn.batching = False
+        if conn.in_transaction:
+            conn.rollback()
+        logger.exception("Write batch of %d requests failed", len(batch))
+        return [(False, _error(exc))] * len(batch)
+    return results
+
+
+def writer_main(connections, database_name):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(format="%(asctime)s - db-writer - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    db.DATABASE_NAME = database_name
+    db.CONNECTION_FACTORY = GroupCommitConnection
+    conn = db.get_connection()
+    open_connections = list(connections)
+
+    while open_connections:
+        batch = []
+        for ready in wait(open_connections):
+            try:
+                while len(batch) < config.WRITER_MAX_BATCH and ready.poll():
+                    message = ready.recv()
+                    if message[0] == "event":
+                        for other in open_connections:
+                            if other is not ready:
+                                _send(other, message)
+                    else:
+                        batch.append((ready, *message[1:]))
+            except (EOFError, OSError):
+                open_connections.remove(ready)
+        if not batch:
+            continue
+        for (target, req_id, *_), (ok, value) in zip(batch, _execute_batch(conn, batch)):
+            _send(target, ("result", req_id, ok, value))
+
+    db.close_connection()
+
+
+def _send(connection, message):
+    try:
+        connection.send(message)
+    except (EOFError, OSError):
+        # worker رفته است؛ wait در دور بعد EOF آن را می‌بیند
+        pass
+
+
+class WriterClient:
+    """سمت worker: فراخوانی توابع نویسنده روی پروسه نویسنده بدون بلاک کردن حلقه رویداد."""
+
+    def __init__(self, connection, loop):
+        self._connection = connection
+        self._loop = loop
+        self._pending = {}
+        self._ids = itertools.count()
+        self._reader = threading.Thread(target=self._read, name="writer-client", daemon=True)
+        self._reader.start()
+
+    async def call(self, name, args, kwargs):
+        if any(inspect.isgenerator(arg) for arg in args):
+            # generator ها (مثلا لینک‌های یک فایل) pickle نمی‌شوند و همین‌جا به لیست تبدیل می‌شوند
+            args = await asyncio.to_thread(lambda: tuple(list(arg) if inspect.isgenerator(arg) else arg for arg in args))
+        future = self._loop.create_future()
+        req_id = next(self._ids)
+        self._pending[req_id] = future
+        self._connection.send(("call", req_id, name, args, kwargs))
+        return await future
+
+    def publish(self, topic, payload):
+        self._connection.send(("event", topic, payload))
+
+    def _read(self):
+        while True:
+            try:
+                message = self._connection.recv()
+                self._loop.call_soon_threadsafe(self._dispatch, message)
+            except (EOFError, OSError):
+                break
+            except RuntimeError:
+                return    # حلقه رویداد worker بسته شده است
+        self._loop.call_soon_threadsafe(self._fail_pending)
+
+    def _dispatch(self, message):
+        if message[0] == "event":
+            events.deliver(message[1], message[2])
+            return
+        _, req_id, ok, value = message
+        future = self._pending.pop(req_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _fail_pending(self):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("db writer process is gone"))
+        self._pending.clear()
+
+
+# ==================================
+# === پروسه‌های worker ===
+# ==================================
+def worker_main(index, workers, updates, writer_connection, ready, database_name, token, request, settings):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    for name, value in (settings or {}).items():
+        setattr(config, name, value)
+    db.DATABASE_NAME = database_name
+    asyncio.run(_serve_worker(index, workers, updates, writer_connection, ready, token, request))
+    db.shutdown()
+
+
+async def _serve_worker(index, workers, updates, writer_connection, ready, token, request):
+    import catalog
+    import discounts
+    import main as bot_main
+    import metrics
+    import outbox
+    import purchases
+    import receipts
+
+    loop = asyncio.get_running_loop()
+    client = WriterClient(writer_connection, loop)
+    db.use_writer(client)
+    events.set_transport(client.publish)
+    events.subscribe("catalog", lambda payload: catalog.reload())
+    events.subscribe("discounts", lambda payload: discounts.invalidate())
+    events.subscribe("purchases", lambda user_ids: purchases.invalidate(*user_ids))
+    events.subscribe("receipt", receipts.add_remote)
+    # سقف‌های نرخ برای کل ربات است و بین worker ها تقسیم می‌شود؛ چت خصوصی هر کاربر فقط از یک worker پیام
+    # می‌گیرد ولی همه worker ها به ادمین اعلان می‌فرستند، پس سهمیه چت ادمین هم تقسیم می‌شود
+    outbox.set_rates(config.OUTBOX_GLOBAL_RATE / workers, config.OUTBOX_PRIVATE_CHAT_RATE, config.OUTBOX_GROUP_CHAT_RATE / workers,
+                     {config.ADMIN_TELEGRAM_ID: config.OUTBOX_PRIVATE_CHAT_RATE / workers})
+    if config.METRICS_PORT:
+        config.METRICS_PORT += index
+
+    await catalog.reload()
+    if request is not None:
+        request_class, request_kwargs = request
+        request = request_class(**request_kwargs)
+    application = bot_main.build_application(token, request=request, primary=index == 0)
+
+    def pump():
+        while True:
+            try:
+                data = updates.recv()
+            except EOFError:
+                data = None
+            if data is None:
+                return
+            loop.call_soon_threadsafe(application.update_queue.put_nowait, Update.de_json(data, application.bot))
+
+    async with application:
+        await application.start()
+        await metrics.start_server()
+        ready.set()
+        await asyncio.to_thread(pump)
+        # stop تا پردازش همه آپدیت‌های در صف صبر می‌کند
+        await application.stop()
+        await bot_main.on_stop(application)
+    await bot_main.on_shutdown(application)
+    # اتصال به نویسنده با خروج پروسه بسته می‌شود و نویسنده پس از بسته شدن همه اتصال‌ها خارج می‌شود
+
+
+# ==================================
+# === پروسه اصلی ===
+# ==================================
+class Cluster:
+    def __init__(self, workers, token=config.TOKEN, request=None, settings=None):
+        """request: (کلاس، kwargs) یک BaseRequest که در هر worker ساخته می‌شود (مثلا FakeTelegramRequest).
+        settings: مقادیری از config که در worker ها بازنویسی می‌شوند."""
+        self.workers = workers
+        self._token = token
+        self._request = request
+        self._settings = settings
+        self._senders = []
+        self._processes = []
+        self._writer = None
+
+    def start(self, timeout=120):
+        # spawn به‌جای fork: worker ها اتصال SQLite و ترد‌های پروسه اصلی را به ارث نمی‌برند
+        context = multiprocessing.get_context("spawn")
+        writer_ends, ready_events = [], []
+        for index in range(self.workers):
+            worker_end, writer_end = context.Pipe()
+            receiver, sender = context.Pipe(duplex=False)
+            ready = context.Event()
+            process = context.Process(target=worker_main, name=f"worker-{index}",
+                                      args=(index, self.workers, receiver, worker_end, ready, db.DATABASE_NAME,
+                                            self._token, self._request, self._settings))
+            writer_ends.append(writer_end)
+            ready_events.append(ready)
+            self._senders.append(sender)
+            self._processes.append((process, receiver, worker_end))
+
+        self._writer = context.Process(target=writer_main, name="db-writer", args=(writer_ends, db.DATABASE_NAME))
+        self._writer.start()
+        for process, receiver, worker_end in self._processes:
+            process.start()
+            receiver.close()
+            worker_end.close()
+        for writer_end in writer_ends:
+            writer_end.close()
+        for ready in ready_events:
+            if not ready.wait(timeout):
+                raise RuntimeError("worker did not start in time")
+
+    def dispatch(self, update):
+        # کلید (نوع، شناسه) است؛ شناسه کاربر یا چت تعیین می‌کند آپدیت به کدام worker برود
+        key = ordering_key(update)
+        self._senders[key[1] % self.workers if key is not None else 0].send(update.to_dict())
+
+    def stop(self):
+        """به worker ها اعلام پایان می‌کند و تا پردازش آپدیت‌های باقی‌مانده و خروج همه پروسه‌ها صبر می‌کند."""
+        for sender in self._senders:
+            sender.send(None)
+            sender.close()
+        for process, _, _ in self._processes:
+            process.join()
+        self._writer.join()
+
+
+async def _serve(workers):
+    import main as bot_main
+
+    loop = asyncio.get_running_loop()
+    cluster = Cluster(workers)
+    await asyncio.to_thread(cluster.start)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    update_queue = asyncio.Queue()
+    updater = Updater(Bot(config.TOKEN), update_queue)
+    async with updater:
+        if config.RUN_MODE == "webhook":
+            await updater.start_webhook(**bot_main.webhook_options())
+        else:
+            await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+        stopping = loop.create_task(stop.wait())
+        while not stop.is_set():
+            getting = loop.create_task(update_queue.get())
+            await asyncio.wait((getting, stopping), return_when=asyncio.FIRST_COMPLETED)
+            if getting.done():
+                cluster.dispatch(getting.result())
+            else:
+                getting.cancel()
+        await updater.stop()
+
+    while not update_queue.empty():
+        cluster.dispatch(update_queue.get_nowait())
+    await asyncio.to_thread(cluster.stop)
+
+
+def run(workers):
+    asyncio.run(_serve(workers))
@@ -1,4 +1,6 @@
+
 # config.py
+import os
 
 # توکن ربات تلگرام
 TOKEN = ""
@@ -14,4 +16,84 @@ ADMIN_CHANNEL_ID = -1002711688947
 BANK_CARD_INFO = {
     "card_number": "6104337540965306",
     "card_holder": "محمد امین صفوی زاده"
-}
\ No newline at end of file
+}
+
+# حالت اجرا: "polling" یا "webhook"؛ همه تنظیمات این بخش با متغیرهای محیطی قابل تغییرند
+RUN_MODE = os.getenv("BOT_RUN_MODE", "polling")
+# آدرس و پورتی که سرور وب‌هوک داخلی پشت reverse proxy روی آن گوش می‌دهد
+WEBHOOK_LISTEN = os.getenv("BOT_WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("BOT_WEBHOOK_PORT", "8443"))
+WEBHOOK_URL_PATH = os.getenv("BOT_WEBHOOK_URL_PATH", "albaloo-bot")
+# آدرس عمومی که به تلگرام معرفی می‌شود، مثلا https://bots.example.com/albaloo-bot
+WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL", "")
+# اگر خالی باشد، در هر بار اجرا یک توکن تصادفی ساخته می‌شود
+WEBHOOK_SECRET_TOKEN = os.getenv("BOT_WEBHOOK_SECRET_TOKEN", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("BOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# حداکثر تعداد آپدیت‌هایی که هم‌زمان پردازش می‌شوند؛ آپدیت‌های هر کاربر همیشه به ترتیب اجرا می‌شوند
+CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "16"))
+
+# فاصله (ثانیه) نوشتن دسته‌ای تغییرات نام و یوزرنیم کاربران
+PROFILE_FLUSH_INTERVAL = 60
+# تعداد کاربرانی که پروفایل ذخیره‌شده‌شان برای مقایسه در حافظه می‌ماند؛ بقیه در صورت نیاز از پایگاه داده خوانده می‌شوند
+PROFILE_CACHE_USERS = 50000
+
+# تعداد لینک‌های فایل /addlinks که در هر executemany درج می‌شوند (همه دسته‌ها در یک تراکنش)
+LINK_UPLOAD_CHUNK_SIZE = 1000
+
+# بکاپ خودکار پایگاه داده
+BACKUP_DIR = "backups"
+BACKUP_INTERVAL = 6 * 60 * 60    # ثانیه
+BACKUP_RETENTION = 28            # تعداد فایل‌های بکاپی که نگه داشته می‌شوند
+
+# مدت اعتبار (ثانیه) کش کدهای تخفیف قابل استفاده
+DISCOUNT_CACHE_TTL = 300
+
+# محدودیت‌های نرخ صف پیام‌های خروجی (پیام در ثانیه)
+OUTBOX_GLOBAL_RATE = 25
+OUTBOX_PRIVATE_CHAT_RATE = 1
+OUTBOX_GROUP_CHAT_RATE = 20 / 60
+OUTBOX_MAX_RETRIES = 3
+
+# انقضای لینک‌های کاربران
+EXPIRY_CHECK_INTERVAL = 60 * 60     # ثانیه
+EXPIRY_REMINDER_DAYS = 3            # چند روز قبل از انقضا یادآوری ارسال شود
+EXPIRY_BATCH_SIZE = 500
+EXPIRY_MAX_BATCHES_PER_RUN = 40
+
+# هر چند ثانیه وضعیت مکالمه‌ها و user_data/chat_data به‌صورت دسته‌ای در store.db نوشته شود
+PERSISTENCE_UPDATE_INTERVAL = 30
+
+# endpoint متریک‌ها به سبک Prometheus (http://METRICS_HOST:METRICS_PORT/metrics)؛ پورت 0 یعنی غیرفعال
+METRICS_HOST = os.getenv("BOT_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9464"))
+
+# حالت چند پروسه‌ای (cluster.py): تعداد پروسه‌های worker که آپدیت‌ها بر اساس شناسه کاربر بین آن‌ها
+# تقسیم می‌شوند؛ ۱ یعنی اجرای معمولی در یک پروسه
+WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# پروسه نویسنده حداکثر این تعداد درخواست نوشتن را با یک commit ثبت می‌کند
+WRITER_MAX_BATCH = 256
+
+# صفحه‌بندی «خریدهای من»: حداکثر تعداد لینک در هر صفحه و تعداد کاربرانی که صفحه‌های رندرشده‌شان در حافظه می‌ماند
+PURCHASES_PAGE_SIZE = 10
+PURCHASES_CACHE_USERS = 5000
+
+# گزارش فروش /stats: بازه پیش‌فرض (روز) و تعداد پروسه‌های رسم نمودار
+STATS_DEFAULT_DAYS = 30
+CHART_WORKERS = 1
+
+# تشخیص رسیدهای تکراری: حداکثر فاصله همینگ (از ۶۴ بیت) هر دو hash ادراکی برای «مشابه» بودن دو رسید
+RECEIPT_DHASH_THRESHOLD = 10
+RECEIPT_PHASH_THRESHOLD = 10
+RECEIPT_HASH_WORKERS = 1
+
+# حداکثر تعداد تراکنش‌هایی که /approveall در یک اجرا تایید می‌کند
+BULK_APPROVE_LIMIT = 500
+
+# چرخه عمر تراکنش‌ها (maintenance.py): pending هایی که این مدت رسیدی نگرفته‌اند منقضی می‌شوند و
+# تراکنش‌های تمام‌شده قدیمی‌تر از TRANSACTION_ARCHIVE_DAYS به transactions_archive منتقل می‌شوند
+MAINTENANCE_INTERVAL = 60 * 60     # ثانیه
+PENDING_TRANSACTION_TTL_HOURS = 48
+TRANSACTION_ARCHIVE_DAYS = 90
+MAINTENANCE_BATCH_SIZE = 1000
+MAINTENANCE_MAX_BATCHES_PER_RUN = 50
@@ -1,13 +1,93 @@
+import asyncio
+import functools
+import itertools
 import sqlite3
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 DATABASE_NAME = "store.db"
 
-def setup_database():
-    """جداول مورد نیاز را در پایگاه داده ایجاد و در صورت نیاز، محصولات اولیه را اضافه می‌کند."""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-
+# تنظیمات اتصال؛ WAL اجازه می‌دهد خواندن‌ها هم‌زمان با نوشتن انجام شوند و synchronous=NORMAL
+# در حالت WAL فقط در checkpoint ها fsync می‌کند.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = OFF",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",     # حدود ۱۶ مگابایت
+    "PRAGMA mmap_size = 134217728",   # ۱۲۸ مگابایت
+)
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+# تعداد شناسه لینک‌های آزادی که برای هر محصول از قبل خوانده و در حافظه نگه داشته می‌شود
+# (صفر یعنی غیرفعال). این صف فقط روی ترد پایگاه داده استفاده می‌شود.
+LINK_RESERVE_SIZE = 50
+_link_reserves = {}
+
+# وضعیت‌هایی که ادمین هنوز می‌تواند از آن‌ها تایید یا رد کند. expired هم هست چون موتور انقضا رسید
+# تراکنش‌های قدیمی‌تر از ثبت hash رسیدها را نمی‌شناسد و دکمه‌های رسید آن‌ها باید کار کنند
+REVIEWABLE_STATUSES = ('pending', 'submitted', 'expired')
+
+# تمام کارهای SQLite روی یک ترد اختصاصی انجام می‌شود تا حلقه رویداد ربات هیچ‌وقت منتظر دیسک نماند.
+# یک ترد تنها یعنی نوشتن‌ها هم پشت سر هم و بدون تداخل اجرا می‌شوند.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+# در حالت چند پروسه‌ای (cluster.py) توابع نویسنده به پروسه نویسنده فرستاده می‌شوند و خواندن‌ها
+# همچنان روی اتصال محلی همین پروسه انجام می‌شوند. پروسه نویسنده CONNECTION_FACTORY را عوض می‌کند.
+_writer = None
+CONNECTION_FACTORY = sqlite3.Connection
+
+def _writes(func):
+    """توابعی را که در پایگاه داده می‌نویسند علامت می‌زند."""
+    func.writes = True
+    return func
+
+def use_writer(client):
+    """client.call(name, args, kwargs) از این پس همه توابع نویسنده را اجرا می‌کند (None یعنی اجرای محلی)."""
+    global _writer
+    _writer = client
+
+async def run(func, *args, **kwargs):
+    """یکی از توابع همین ماژول را روی ترد پایگاه داده اجرا می‌کند و نتیجه را await می‌کند."""
+    if _writer is not None and getattr(func, "writes", False):
+        return await _writer.call(func.__name__, args, kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def get_connection():
+    """اتصال ماندگار ترد فعلی را برمی‌گرداند و در اولین استفاده آن را می‌سازد."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_NAME, cached_statements=STATEMENT_CACHE_SIZE, factory=CONNECTION_FACTORY)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+def shutdown():
+    """منتظر می‌ماند تا کارهای در صف پایگاه داده تمام شوند و اتصال و ترد آن را می‌بندد."""
+    _executor.submit(close_connection).result()
+    _executor.shutdown(wait=True)
+
+# ==================================
+# === مهاجرت‌های شِما ===
+# ==================================
+# هر مهاجرت یک تابع است که روی cursor اجرا می‌شود و باید idempotent باشد. شماره هر مهاجرت همان
+# جایگاه آن در لیست MIGRATIONS است و پس از اجرا در PRAGMA user_version ثبت می‌شود؛
+# مهاجرت جدید فقط به انتهای لیست اضافه شود.
+def _migration_initial_schema(cursor):
+    """جداول مورد نیاز را ایجاد و در صورت نیاز، محصولات اولیه را اضافه می‌کند."""
     # ایجاد جدول کاربران با تمام ستون‌های لازم
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -21,6 +101,13 @@ def setup_database():
     )
     """)
 
+    # پایگاه داده‌های قدیمی‌تر جدول کاربران را بدون ستون‌های معرفی ساخته‌اند
+    cursor.execute("PRAGMA table_info(users)")
+    user_columns = {row[1] for row in cursor.fetchall()}
+    for column, definition in (("referred_by_user_id", "INTEGER"), ("first_purchase_completed", "BOOLEAN DEFAULT 0"), ("referral_rewards_claimed", "INTEGER DEFAULT 0")):
+        if column not in user_columns:
+            cursor.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+
     # ایجاد سایر جداول
     cursor.execute("""CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, price INTEGER NOT NULL, description TEXT)""")
     cursor.execute("""CREATE TABLE IF NOT EXISTS transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, product_id INTEGER NOT NULL, product_name TEXT, price INTEGER, status TEXT NOT NULL, timestamp TEXT NOT NULL, FOREIGN KEY (user_id) REFERENCES users (user_id), FOREIGN KEY (product_id) REFERENCES products (id))""")
@@ -43,151 +130,630 @@ def setup_database():
         cursor.executemany("INSERT INTO products (name, price, description) VALUES (?, ?, ?)", default_plans)
         print(f"{len(default_plans)} پلن جدید با موفقیت اضافه شد.")
 
-    conn.commit()
-    conn.close()
+def _migration_hot_path_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_link_bank_unused ON link_bank (product_id, id) WHERE is_used = 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_referrer ON users (referred_by_user_id, first_purchase_completed)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_links_user ON user_links (user_id, is_active)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_support_tickets_message ON support_tickets (channel_message_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_status ON transactions (status)")
+
+def _migration_referral_counters(cursor):
+    cursor.execute("PRAGMA table_info(users)")
+    if "successful_referrals" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE users ADD COLUMN successful_referrals INTEGER NOT NULL DEFAULT 0")
+    # مقداردهی اولیه از روی داده‌های موجود
+    cursor.execute("""
+        UPDATE users SET successful_referrals = (
+            SELECT COUNT(*) FROM users AS referred
+            WHERE referred.referred_by_user_id = users.user_id AND referred.first_purchase_completed = 1
+        )
+    """)
+
+def _migration_link_expiry(cursor):
+    cursor.execute("PRAGMA table_info(user_links)")
+    if "reminder_sent" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE user_links ADD COLUMN reminder_sent BOOLEAN NOT NULL DEFAULT 0")
+    # ایندکس‌های جزئی فقط لینک‌های فعال را نگه می‌دارند تا اسکن بازه‌ای تاریخ انقضا کوچک بماند
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_links_expiry ON user_links (expiry_date) WHERE is_active = 1")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_links_reminder ON user_links (expiry_date) WHERE is_active = 1 AND reminder_sent = 0")
+
+def _migration_persistence(cursor):
+    # داده‌های user_data/chat_data/bot_data و وضعیت مکالمه‌ها به‌صورت pickle
+    cursor.execute("CREATE TABLE IF NOT EXISTS persistence_data (kind TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (kind, key)) WITHOUT ROWID")
+    cursor.execute("CREATE TABLE IF NOT EXISTS persistence_conversations (name TEXT NOT NULL, key TEXT NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key)) WITHOUT ROWID")
+
+def _migration_sales_daily(cursor):
+    # آمار فروش روزانه هر محصول (بر اساس روز ثبت تراکنش)؛ update_transaction_status آن را به‌روز نگه می‌دارد
+    cursor.execute("""CREATE TABLE IF NOT EXISTS sales_daily (day TEXT NOT NULL, product_id INTEGER NOT NULL, approved_count INTEGER NOT NULL DEFAULT 0, revenue INTEGER NOT NULL DEFAULT 0, rejected_count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (day, product_id)) WITHOUT ROWID""")
+    cursor.execute("DELETE FROM sales_daily")
+    cursor.execute("""
+        INSERT INTO sales_daily (day, product_id, approved_count, revenue, rejected_count)
+        SELECT substr(timestamp, 1, 10), product_id,
+               SUM(status = 'approved'), SUM(CASE WHEN status = 'approved' THEN price ELSE 0 END), SUM(status = 'rejected')
+        FROM transactions WHERE status IN ('approved', 'rejected')
+        GROUP BY substr(timestamp, 1, 10), product_id
+    """)
+
+def _migration_receipt_hashes(cursor):
+    # hash های ادراکی ۶۴ بیتی رسیدها (به‌صورت عدد صحیح علامت‌دار SQLite) برای receipts.py
+    cursor.execute("CREATE TABLE IF NOT EXISTS receipt_hashes (transaction_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, dhash INTEGER NOT NULL, phash INTEGER NOT NULL)")
+
+def _migration_transaction_lifecycle(cursor):
+    # تراکنش pending هر کاربر و محصول دوباره استفاده می‌شود؛ ایندکس انقضای pending ها در _migration_transaction_status_time است
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_pending_user ON transactions (user_id, product_id) WHERE status = 'pending'")
+    # تراکنش‌های قدیمی تمام‌شده به این جدول منتقل می‌شوند تا جدول transactions کوچک بماند
+    cursor.execute("CREATE TABLE IF NOT EXISTS transactions_archive (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, product_id INTEGER NOT NULL, product_name TEXT, price INTEGER, status TEXT NOT NULL, timestamp TEXT NOT NULL)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_archive_user ON transactions_archive (user_id)")
+
+def _migration_link_bank_used(cursor):
+    # لینک‌های واگذارشده با compact_link_bank به این جدول سرد منتقل می‌شوند (id همان id قبلی است)
+    cursor.execute("""CREATE TABLE IF NOT EXISTS link_bank_used (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, link TEXT NOT NULL UNIQUE, assigned_to_user_id INTEGER, assigned_transaction_id INTEGER, added_date TEXT NOT NULL, assigned_date TEXT)""")
+    # UNIQUE روی link فقط داخل هر جدول است؛ این trigger لینکی را که قبلا واگذار و منتقل شده دوباره
+    # به link_bank راه نمی‌دهد (RAISE(IGNORE) ردیف را مثل INSERT OR IGNORE بی‌صدا رد می‌کند)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS link_bank_unique_across_used BEFORE INSERT ON link_bank
+        WHEN EXISTS (SELECT 1 FROM link_bank_used WHERE link = NEW.link)
+        BEGIN SELECT RAISE(IGNORE); END
+    """)
+
+def _migration_submitted_receipts(cursor):
+    # تراکنش‌هایی که پیش از وضعیت submitted رسیدشان رسیده بود pending مانده‌اند؛ رسیدهایی که hash شان
+    # ثبت شده submitted می‌شوند تا /approveall آن‌ها را ببیند و موتور انقضا آن‌ها را expired نکند
+    cursor.execute("UPDATE transactions SET status = 'submitted' WHERE status = 'pending' AND id IN (SELECT transaction_id FROM receipt_hashes)")
+
+def _migration_transaction_status_time(cursor):
+    # انقضای pending ها و بایگانی تراکنش‌های تمام‌شده (status = ? AND timestamp < ?) بازه‌ای از همین ایندکس
+    # را می‌خوانند و با رسیدن به LIMIT متوقف می‌شوند. idx_transactions_status می‌ماند چون ترتیب id را
+    # برای ORDER BY id پرس‌وجوهای submitted (مثل /approveall) بدون مرتب‌سازی می‌دهد
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_status_time ON transactions (status, timestamp)")
+
+MIGRATIONS = [
+    _migration_initial_schema,
+    _migration_hot_path_indexes,
+    _migration_referral_counters,
+    _migration_link_expiry,
+    _migration_persistence,
+    _migration_sales_daily,
+    _migration_receipt_hashes,
+    _migration_transaction_lifecycle,
+    _migration_link_bank_used,
+    _migration_submitted_receipts,
+    _migration_transaction_status_time,
+]
 
+def setup_database():
+    """مهاجرت‌های اجرا نشده را به ترتیب و هر کدام در یک تراکنش اعمال می‌کند؛ اگر شِما به‌روز باشد هیچ DDL ای اجرا نمی‌شود."""
+    conn = get_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"مهاجرت شماره {number} ({migration.__name__}) اعمال شد.")
+    # compact_link_bank فضای آزادشده را با incremental_vacuum برمی‌گرداند که به auto_vacuum=INCREMENTAL
+    # نیاز دارد؛ تغییر آن برای پایگاه داده موجود یک VACUUM کامل (فقط یک بار) لازم دارد
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print("auto_vacuum پایگاه داده روی INCREMENTAL تنظیم شد.")
+
+@_writes
 def add_or_update_user(user_id, first_name, username):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     # ابتدا کاربر را با اطلاعات اولیه اضافه می‌کنیم یا در صورت وجود نادیده می‌گیریم
     cursor.execute("INSERT OR IGNORE INTO users (user_id, first_name, username) VALUES (?, ?, ?)", (user_id, first_name, username))
     # سپس اطلاعات او را در هر صورت آپدیت می‌کنیم
     cursor.execute("UPDATE users SET first_name = ?, username = ? WHERE user_id = ?", (first_name, username, user_id))
     conn.commit()
-    conn.close()
 
+def get_user_profile(user_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT first_name, username FROM users WHERE user_id = ?", (user_id,))
+    return cursor.fetchone()
+
+@_writes
+def upsert_user_profiles(profiles):
+    """profiles: لیست (user_id, first_name, username)؛ همه در یک تراکنش نوشته می‌شوند."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO users (user_id, first_name, username) VALUES (?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET first_name = excluded.first_name, username = excluded.username", profiles)
+    conn.commit()
+
+@_writes
 def update_user_referrer(user_id, referrer_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE users SET referred_by_user_id = ? WHERE user_id = ?", (referrer_id, user_id))
+    cursor.execute("UPDATE users SET referred_by_user_id = ? WHERE user_id = ? AND referred_by_user_id IS NULL RETURNING first_purchase_completed", (referrer_id, user_id))
+    rows = cursor.fetchall()
+    # اگر کاربر پیش از ثبت معرف خریدش را انجام داده باشد، از همین حالا دعوت موفق به حساب می‌آید
+    if rows and rows[0][0]:
+        cursor.execute("UPDATE users SET successful_referrals = successful_referrals + 1 WHERE user_id = ?", (referrer_id,))
     conn.commit()
-    conn.close()
 
 def get_user_info(user_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT referred_by_user_id, first_purchase_completed, referral_rewards_claimed FROM users WHERE user_id = ?", (user_id,))
     result = cursor.fetchone()
-    conn.close()
     return result
 
+@_writes
 def mark_first_purchase_complete(user_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE users SET first_purchase_completed = 1 WHERE user_id = ?", (user_id,))
+    # علامت خرید اول و شمارنده دعوت‌های موفق معرف در یک تراکنش به‌روز می‌شوند
+    cursor.execute("UPDATE users SET first_purchase_completed = 1 WHERE user_id = ? AND first_purchase_completed = 0 RETURNING referred_by_user_id", (user_id,))
+    rows = cursor.fetchall()
+    if rows and rows[0][0] is not None:
+        cursor.execute("UPDATE users SET successful_referrals = successful_referrals + 1 WHERE user_id = ?", (rows[0][0],))
     conn.commit()
-    conn.close()
 
 def count_successful_referrals(referrer_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users WHERE referred_by_user_id = ? AND first_purchase_completed = 1", (referrer_id,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    cursor.execute("SELECT successful_referrals FROM users WHERE user_id = ?", (referrer_id,))
+    result = cursor.fetchone()
+    return result[0] if result else 0
+
+@_writes
+def check_referral_counters(repair=False):
+    """شمارنده‌های successful_referrals را با شمارش واقعی مقایسه می‌کند.
+
+    خروجی لیست (user_id, مقدار ذخیره‌شده, مقدار واقعی) برای ردیف‌های ناسازگار است؛ با repair=True اصلاح هم می‌شوند.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT u.user_id, u.successful_referrals, COALESCE(actual.total, 0)
+        FROM users u LEFT JOIN (
+            SELECT referred_by_user_id AS referrer_id, COUNT(*) AS total FROM users
+            WHERE referred_by_user_id IS NOT NULL AND first_purchase_completed = 1
+            GROUP BY referred_by_user_id
+        ) AS actual ON actual.referrer_id = u.user_id
+        WHERE u.successful_referrals != COALESCE(actual.total, 0)
+    """)
+    mismatches = cursor.fetchall()
+    if repair and mismatches:
+        cursor.executemany("UPDATE users SET successful_referrals = ? WHERE user_id = ?", [(actual, user_id) for user_id, _, actual in mismatches])
+        conn.commit()
+    return mismatches
 
+@_writes
 def increment_rewards_claimed(user_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET referral_rewards_claimed = referral_rewards_claimed + 1 WHERE user_id = ?", (user_id,))
     conn.commit()
-    conn.close()
 
 def get_products():
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, name, price FROM products")
     products = cursor.fetchall()
-    conn.close()
     return products
 
+def get_all_products():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name, price, description FROM products ORDER BY id")
+    return cursor.fetchall()
+
 def get_product_details(product_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT name, price, description FROM products WHERE id = ?", (product_id,))
     product = cursor.fetchone()
-    conn.close()
     return product
 
 def get_product_id_by_name(product_name):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM products WHERE name = ?", (product_name,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
+@_writes
 def create_pending_transaction(user_id, product_id, product_name, price):
-    conn = sqlite3.connect(DATABASE_NAME)
+    """اگر کاربر برای همین محصول تراکنش pending دارد همان با قیمت و زمان جدید برگردانده می‌شود، وگرنه یک تراکنش جدید ساخته می‌شود."""
+    conn = get_connection()
     cursor = conn.cursor()
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("INSERT INTO transactions (user_id, product_id, product_name, price, status, timestamp) VALUES (?, ?, ?, ?, 'pending', ?)", (user_id, product_id, product_name, price, timestamp))
-    transaction_id = cursor.lastrowid
+    cursor.execute("""
+        UPDATE transactions SET product_name = ?, price = ?, timestamp = ?
+        WHERE id = (SELECT id FROM transactions WHERE user_id = ? AND product_id = ? AND status = 'pending' ORDER BY id DESC LIMIT 1)
+        RETURNING id
+    """, (product_name, price, timestamp, user_id, product_id))
+    rows = cursor.fetchall()
+    if rows:
+        transaction_id = rows[0][0]
+    else:
+        cursor.execute("INSERT INTO transactions (user_id, product_id, product_name, price, status, timestamp) VALUES (?, ?, ?, ?, 'pending', ?)", (user_id, product_id, product_name, price, timestamp))
+        transaction_id = cursor.lastrowid
     conn.commit()
-    conn.close()
     return transaction_id
 
+@_writes
+def expire_pending_transactions(before, limit):
+    """حداکثر limit تراکنش pending که زمانشان قبل از before است و رسیدی برایشان ثبت نشده را expired می‌کند و تعدادشان را برمی‌گرداند."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE transactions SET status = 'expired'
+        WHERE id IN (SELECT id FROM transactions WHERE status = 'pending' AND timestamp < ?
+                     AND NOT EXISTS (SELECT 1 FROM receipt_hashes WHERE transaction_id = transactions.id) LIMIT ?)
+    """, (before, limit))
+    count = cursor.rowcount
+    conn.commit()
+    return count
+
+@_writes
+def archive_transactions(before, limit):
+    """حداکثر limit تراکنش تمام‌شده (approved، rejected یا expired) قدیمی‌تر از before را به transactions_archive منتقل می‌کند.
+    انتقال هر دسته در یک تراکنش انجام می‌شود؛ خروجی تعداد ردیف‌های منتقل‌شده است."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    # بدون ORDER BY: هر وضعیت یک بازه از idx_transactions_status_time است و اسکن با رسیدن به limit تمام می‌شود
+    cursor.execute("SELECT id FROM transactions WHERE status IN ('approved', 'rejected', 'expired') AND timestamp < ? LIMIT ?", (before, limit))
+    ids = [(row[0],) for row in cursor.fetchall()]
+    if not ids:
+        return 0
+    try:
+        cursor.executemany("INSERT OR REPLACE INTO transactions_archive SELECT id, user_id, product_id, product_name, price, status, timestamp FROM transactions WHERE id = ?", ids)
+        cursor.executemany("DELETE FROM transactions WHERE id = ?", ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(ids)
+
 def get_transaction(transaction_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT user_id, product_name, price, product_id FROM transactions WHERE id = ?", (transaction_id,))
     result = cursor.fetchone()
-    conn.close()
     return result
 
-def update_transaction_status(transaction_id, status):
-    conn = sqlite3.connect(DATABASE_NAME)
+def get_transaction_status(transaction_id):
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE transactions SET status = ? WHERE id = ?", (status, transaction_id))
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT status FROM transactions WHERE id = ?", (transaction_id,))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+def count_submitted_transactions():
+    """تعداد تراکنش‌هایی که رسیدشان رسیده و منتظر بررسی‌اند، به تفکیک محصول: لیست (product_id, product_name, تعداد, کمترین id, بیشترین id)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT product_id, product_name, COUNT(*), MIN(id), MAX(id) FROM transactions WHERE status = 'submitted' GROUP BY product_id ORDER BY product_id")
+    return cursor.fetchall()
+
+def _apply_sales_change(cursor, day, product_id, price, status, sign):
+    """سهم یک تراکنش approved یا rejected را به ردیف sales_daily اضافه (sign=1) یا از آن کم (sign=-1) می‌کند."""
+    if status not in ('approved', 'rejected'):
+        return
+    approved = sign if status == 'approved' else 0
+    rejected = sign if status == 'rejected' else 0
+    cursor.execute("""
+        INSERT INTO sales_daily (day, product_id, approved_count, revenue, rejected_count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day, product_id) DO UPDATE SET approved_count = approved_count + excluded.approved_count,
+            revenue = revenue + excluded.revenue, rejected_count = rejected_count + excluded.rejected_count
+    """, (day, product_id, approved, approved * (price or 0), rejected))
+
+@_writes
+def update_transaction_status(transaction_id, status, from_statuses=None):
+    """وضعیت تراکنش و در همان تراکنش آمار sales_daily را به‌روز می‌کند؛ تکرار همان وضعیت آمار را تغییر نمی‌دهد.
+
+    با from_statuses تغییر فقط از همان وضعیت‌ها انجام می‌شود (مثلا رد کردن تراکنشی که هم‌زمان تایید
+    شده انجام نمی‌شود). خروجی True اگر وضعیت تغییر کرد.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status FROM transactions WHERE id = ?", (transaction_id,))
+    row = cursor.fetchone()
+    if row is None or row[0] == status or (from_statuses is not None and row[0] not in from_statuses):
+        return False
+    old_status = row[0]
+    try:
+        # شرط status = old_status تغییر را به همان وضعیتی که دیده شد مشروط می‌کند
+        cursor.execute("UPDATE transactions SET status = ? WHERE id = ? AND status = ? RETURNING substr(timestamp, 1, 10), product_id, price",
+                       (status, transaction_id, old_status))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return False
+        day, product_id, price = row
+        _apply_sales_change(cursor, day, product_id, price, old_status, -1)
+        _apply_sales_change(cursor, day, product_id, price, status, 1)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return True
+
+def get_sales_daily(since_day):
+    """ردیف‌های (day, product_id, approved_count, revenue, rejected_count) از روز since_day به بعد."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT day, product_id, approved_count, revenue, rejected_count FROM sales_daily WHERE day >= ? ORDER BY day, product_id", (since_day,))
+    return cursor.fetchall()
 
+@_writes
 def save_user_link(user_id, transaction_id, product_name, link, duration_days=30):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     purchase_date = datetime.now()
     expiry_date = purchase_date + timedelta(days=duration_days)
     cursor.execute("INSERT INTO user_links (user_id, transaction_id, product_name, link, purchase_date, expiry_date) VALUES (?, ?, ?, ?, ?, ?)",(user_id, transaction_id, product_name, link, purchase_date.strftime("%Y-%m-%d"), expiry_date.strftime("%Y-%m-%d")))
     conn.commit()
-    conn.close()
 
 def get_user_links(user_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, product_name, link, purchase_date FROM user_links WHERE user_id = ? AND is_active = 1",(user_id,))
     links = cursor.fetchall()
-    conn.close()
     return links
 
-def add_links_to_bank(product_id, links):
-    conn = sqlite3.connect(DATABASE_NAME)
+def get_user_links_page(user_id, after_id=None, before_id=None, limit=10):
+    """صفحه‌بندی keyset روی لینک‌های فعال کاربر به ترتیب id؛ ایندکس (user_id, is_active) ترتیب rowid را هم دارد.
+
+    با before_id نزدیک‌ترین لینک‌های قبل از آن (به ترتیب نزولی) و در غیر این صورت لینک‌های بعد از after_id برگردانده می‌شوند.
+    """
+    conn = get_connection()
     cursor = conn.cursor()
-    added_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    added_count = 0
-    for link in links:
-        try:
-            cursor.execute("INSERT INTO link_bank (product_id, link, added_date) VALUES (?, ?, ?)", (product_id, link, added_date))
-            added_count += 1
-        except sqlite3.IntegrityError: pass
+    if before_id is not None:
+        cursor.execute("SELECT id, product_name, link, purchase_date FROM user_links WHERE user_id = ? AND is_active = 1 AND id < ? ORDER BY id DESC LIMIT ?", (user_id, before_id, limit))
+    else:
+        cursor.execute("SELECT id, product_name, link, purchase_date FROM user_links WHERE user_id = ? AND is_active = 1 AND id > ? ORDER BY id LIMIT ?", (user_id, after_id or 0, limit))
+    return cursor.fetchall()
+
+@_writes
+def deactivate_expired_links(today, limit):
+    """حداکثر limit لینک فعال که تاریخ انقضایشان قبل از today است را غیرفعال می‌کند و (id, user_id, product_name) آن‌ها را برمی‌گرداند."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE user_links SET is_active = 0
+        WHERE id IN (SELECT id FROM user_links WHERE is_active = 1 AND expiry_date < ? ORDER BY expiry_date LIMIT ?)
+        RETURNING id, user_id, product_name
+    """, (today, limit))
+    rows = cursor.fetchall()
     conn.commit()
-    conn.close()
-    return added_count
+    return rows
+
+@_writes
+def claim_expiry_reminders(until_date, limit):
+    """لینک‌های فعالی که تا until_date منقضی می‌شوند و هنوز یادآوری نگرفته‌اند را علامت می‌زند و (user_id, product_name, expiry_date) آن‌ها را برمی‌گرداند."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE user_links SET reminder_sent = 1
+        WHERE id IN (SELECT id FROM user_links WHERE is_active = 1 AND reminder_sent = 0 AND expiry_date <= ? ORDER BY expiry_date LIMIT ?)
+        RETURNING user_id, product_name, expiry_date
+    """, (until_date, limit))
+    rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+@_writes
+def add_links_to_bank(product_id, links, chunk_size=1000):
+    """links می‌تواند هر iterable ای باشد (مثلا یک generator روی فایل)؛ لینک‌ها به‌صورت دسته‌ای و همه
+    در یک تراکنش با INSERT OR IGNORE درج می‌شوند. خروجی: (تعداد اضافه‌شده، تعداد تکراری)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    added_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    submitted = 0
+    changes_before = conn.total_changes
+    try:
+        for chunk in _chunks(links, chunk_size):
+            cursor.executemany("INSERT OR IGNORE INTO link_bank (product_id, link, added_date) VALUES (?, ?, ?)", [(product_id, link, added_date) for link in chunk])
+            submitted += len(chunk)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    added_count = conn.total_changes - changes_before
+    return added_count, submitted - added_count
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def _claim_link(cursor, where, params, user_id, transaction_id):
+    # ادعای لینک در یک دستور UPDATE ... RETURNING انجام می‌شود؛ شرط is_used = 0 تضمین می‌کند
+    # که یک لینک هرگز دو بار واگذار نشود، حتی اگر دو تأیید هم‌زمان برسند.
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute(f"UPDATE link_bank SET is_used = 1, assigned_to_user_id = ?, assigned_transaction_id = ?, assigned_date = ? WHERE {where} AND is_used = 0 RETURNING link", (user_id, transaction_id, timestamp, *params))
+    rows = cursor.fetchall()
+    return rows[0][0] if rows else None
 
+@_writes
 def fetch_and_assign_link(product_id, user_id, transaction_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, link FROM link_bank WHERE product_id = ? AND is_used = 0 LIMIT 1", (product_id,))
-    result = cursor.fetchone()
-    if result:
-        link_id, link = result
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute("UPDATE link_bank SET is_used = 1, assigned_to_user_id = ?, assigned_transaction_id = ?, assigned_date = ? WHERE id = ?", (user_id, transaction_id, timestamp, link_id))
+    link = _assign_link(cursor, product_id, user_id, transaction_id)
+    conn.commit()
+    return link
+
+def _assign_link(cursor, product_id, user_id, transaction_id):
+    if LINK_RESERVE_SIZE:
+        link = None
+        reserve = _link_reserves.get(product_id)
+        while link is None:
+            if not reserve:
+                cursor.execute("SELECT id FROM link_bank WHERE product_id = ? AND is_used = 0 ORDER BY id LIMIT ?", (product_id, LINK_RESERVE_SIZE))
+                reserve = deque(row[0] for row in cursor.fetchall())
+                _link_reserves[product_id] = reserve
+                if not reserve:
+                    break
+            link = _claim_link(cursor, "id = ?", (reserve.popleft(),), user_id, transaction_id)
+    else:
+        link = _claim_link(cursor, "id = (SELECT id FROM link_bank WHERE product_id = ? AND is_used = 0 LIMIT 1)", (product_id,), user_id, transaction_id)
+    return link
+
+@_writes
+def approve_transaction(transaction_id, duration_days=30):
+    """تایید تکی یک تراکنش pending، submitted یا expired (REVIEWABLE_STATUSES) در یک تراکنش پایگاه داده: تغییر وضعیت، واگذاری لینک، آمار sales_daily و user_links.
+
+    تغییر وضعیت شرطی است، پس از دو تایید هم‌زمان (یا تایید هم‌زمان با /approveall) فقط یکی لینک می‌گیرد.
+    خروجی: None اگر تراکنش وجود ندارد یا قابل تایید نیست، وگرنه (user_id, product_name, product_id, link)؛
+    link برابر None یعنی موجودی بانک تمام شده و وضعیت تراکنش تغییری نکرده است.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE transactions SET status = 'approved' WHERE id = ? AND status IN (?, ?, ?)
+            RETURNING user_id, product_name, product_id, price, substr(timestamp, 1, 10)
+        """, (transaction_id, *REVIEWABLE_STATUSES))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        user_id, product_name, product_id, price, day = row
+        link = _assign_link(cursor, product_id, user_id, transaction_id)
+        if link is None:
+            conn.rollback()
+            return user_id, product_name, product_id, None
+        _apply_sales_change(cursor, day, product_id, price, 'approved', 1)
+        purchase_date = datetime.now()
+        expiry_date = purchase_date + timedelta(days=duration_days)
+        cursor.execute("INSERT INTO user_links (user_id, transaction_id, product_name, link, purchase_date, expiry_date) VALUES (?, ?, ?, ?, ?, ?)",
+                       (user_id, transaction_id, product_name, link, purchase_date.strftime("%Y-%m-%d"), expiry_date.strftime("%Y-%m-%d")))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return user_id, product_name, product_id, link
+
+def _take_links(cursor, product_id, owners, timestamp):
+    """owners: لیست (user_id, transaction_id)؛ به هر کدام یک لینک آزاد (به ترتیب id) داده می‌شود تا جایی که موجودی برسد.
+    فقط داخل یک تراکنش روی ترد (یا پروسه) نویسنده صدا زده شود. خروجی: لیست لینک‌ها به ترتیب owners."""
+    cursor.execute("SELECT id, link FROM link_bank WHERE product_id = ? AND is_used = 0 ORDER BY id LIMIT ?", (product_id, len(owners)))
+    rows = cursor.fetchall()
+    cursor.executemany("UPDATE link_bank SET is_used = 1, assigned_to_user_id = ?, assigned_transaction_id = ?, assigned_date = ? WHERE id = ?",
+                       [(user_id, transaction_id, timestamp, link_id) for (user_id, transaction_id), (link_id, _) in zip(owners, rows)])
+    # شناسه‌های رزرو این محصول ممکن است همین حالا واگذار شده باشند
+    _link_reserves.pop(product_id, None)
+    return [link for _, link in rows]
+
+@_writes
+def approve_transactions_bulk(product_id=None, id_range=None, limit=500, reward_product_id=None, reward_label=None, duration_days=30):
+    """تراکنش‌های submitted (با فیلتر اختیاری محصول یا بازه id) را در یک تراکنش تایید می‌کند.
+
+    برای هر کدام لینک واگذار، وضعیت و آمار sales_daily به‌روز و user_links ثبت می‌شود؛ خرید اول خریداران و
+    هدیه‌های معرفی (از محصول reward_product_id) هم در همان تراکنش اعمال می‌شوند. تراکنش‌هایی که لینک
+    کافی برایشان نبود submitted می‌مانند. خروجی: دیکشنری approved [(transaction_id, user_id, product_name, link)]،
+    rewards [(referrer_id, link)]، missing_links {product_name: تعداد} و missing_rewards [referrer_id].
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    where, params = "status = 'submitted'", []
+    if product_id is not None:
+        where += " AND product_id = ?"
+        params.append(product_id)
+    if id_range is not None:
+        where += " AND id BETWEEN ? AND ?"
+        params.extend(id_range)
+    now = datetime.now()
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    purchase_date = now.strftime("%Y-%m-%d")
+    expiry_date = (now + timedelta(days=duration_days)).strftime("%Y-%m-%d")
+    result = {"approved": [], "rewards": [], "missing_links": Counter(), "missing_rewards": []}
+    try:
+        # ردیف‌ها با همان UPDATE شرطی برداشته می‌شوند تا تایید تکی هم‌زمان از اتصال دیگری آن‌ها را دوباره تایید نکند
+        cursor.execute(f"""
+            UPDATE transactions SET status = 'approved' WHERE id IN (SELECT id FROM transactions WHERE {where} ORDER BY id LIMIT ?)
+            RETURNING id, user_id, product_id, product_name, price, substr(timestamp, 1, 10)
+        """, (*params, limit))
+        by_product = defaultdict(list)
+        for row in sorted(cursor.fetchall()):
+            by_product[row[2]].append(row)
+
+        user_links = []
+        for rows_product_id, rows in by_product.items():
+            links = _take_links(cursor, rows_product_id, [(user_id, transaction_id) for transaction_id, user_id, *_ in rows], timestamp)
+            for (transaction_id, user_id, _, product_name, price, day), link in zip(rows, links):
+                _apply_sales_change(cursor, day, rows_product_id, price, 'approved', 1)
+                user_links.append((user_id, transaction_id, product_name, link, purchase_date, expiry_date))
+                result["approved"].append((transaction_id, user_id, product_name, link))
+            if len(links) < len(rows):
+                result["missing_links"][rows[0][3]] += len(rows) - len(links)
+                cursor.executemany("UPDATE transactions SET status = 'submitted' WHERE id = ?", [(row[0],) for row in rows[len(links):]])
+
+        # خرید اول خریداران دعوت‌شده و شمارنده دعوت معرف‌ها، مثل مسیر تایید تکی؛ خریدار بدون معرف علامت
+        # نمی‌خورد تا اگر بعدا معرف ثبت کرد، update_user_referrer این خرید قبلی را به حساب معرف نگذارد
+        referrers = Counter()
+        for user_id in dict.fromkeys(user_id for _, user_id, _, _ in result["approved"]):
+            cursor.execute("UPDATE users SET first_purchase_completed = 1 WHERE user_id = ? AND first_purchase_completed = 0 AND referred_by_user_id IS NOT NULL RETURNING referred_by_user_id", (user_id,))
+            rows = cursor.fetchall()
+            if rows:
+                referrers[rows[0][0]] += 1
+        for referrer_id, count in referrers.items():
+            cursor.execute("UPDATE users SET successful_referrals = successful_referrals + ? WHERE user_id = ? RETURNING successful_referrals, referral_rewards_claimed", (count, referrer_id))
+            rows = cursor.fetchall()
+            owed = rows[0][0] // 5 - rows[0][1] if rows else 0
+            if owed <= 0 or reward_product_id is None:
+                continue
+            links = _take_links(cursor, reward_product_id, [(referrer_id, 0)] * owed, timestamp)
+            for link in links:
+                user_links.append((referrer_id, 0, reward_label, link, purchase_date, expiry_date))
+                result["rewards"].append((referrer_id, link))
+            if links:
+                cursor.execute("UPDATE users SET referral_rewards_claimed = referral_rewards_claimed + ? WHERE user_id = ?", (len(links), referrer_id))
+            if len(links) < owed:
+                result["missing_rewards"].append(referrer_id)
+
+        cursor.executemany("INSERT INTO user_links (user_id, transaction_id, product_name, link, purchase_date, expiry_date) VALUES (?, ?, ?, ?, ?, ?)", user_links)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    result["missing_links"] = dict(result["missing_links"])
+    return result
+
+@_writes
+def compact_link_bank(limit):
+    """حداکثر limit لینک واگذارشده را در یک تراکنش از link_bank به link_bank_used منتقل می‌کند و تعدادشان را برمی‌گرداند."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM link_bank WHERE is_used = 1 LIMIT ?", (limit,))
+    ids = [(row[0],) for row in cursor.fetchall()]
+    if not ids:
+        return 0
+    try:
+        cursor.executemany("INSERT INTO link_bank_used SELECT id, product_id, link, assigned_to_user_id, assigned_transaction_id, added_date, assigned_date FROM link_bank WHERE id = ?", ids)
+        cursor.executemany("DELETE FROM link_bank WHERE id = ?", ids)
         conn.commit()
-    conn.close()
-    return result[1] if result else None
+    except Exception:
+        conn.rollback()
+        raise
+    return len(ids)
+
+@_writes
+def incremental_vacuum(pages=None):
+    """صفحه‌های آزاد فایل پایگاه داده را (همه یا حداکثر pages صفحه) به سیستم‌عامل برمی‌گرداند و تعداد صفحه‌های آزاد باقی‌مانده را برمی‌گرداند."""
+    conn = get_connection()
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    target = 0 if pages is None else max(0, free - pages)
+    # ماژول sqlite3 دستوری را که ستونی برنمی‌گرداند فقط یک بار step می‌کند و هر step این pragma
+    # یک صفحه آزاد می‌کند؛ executescript هم تراکنش جاری (مثلا دسته پروسه نویسنده) را commit می‌کند
+    while free > target:
+        conn.execute("PRAGMA incremental_vacuum")
+        free -= 1
+    conn.commit()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
 
 def get_link_bank_status():
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT p.name, COUNT(lb.id) FROM products p
@@ -195,62 +761,104 @@ def get_link_bank_status():
         GROUP BY p.name ORDER BY p.id
     """)
     status = cursor.fetchall()
-    conn.close()
     return status
 
+@_writes
 def create_discount_code(code_text, discount_type, value, max_uses=1, expiry_date=None):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO discount_codes (code_text, discount_type, value, max_uses, expiry_date, is_active) VALUES (?, ?, ?, ?, ?, 1)", (code_text.upper(), discount_type, value, max_uses, expiry_date))
         conn.commit()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         return False
-    finally:
-        conn.close()
 
+@_writes
 def validate_and_apply_code(code_text):
-    conn = sqlite3.connect(DATABASE_NAME)
+    """کد را در یک دستور شرطی مصرف می‌کند: فقط اگر فعال، منقضی‌نشده و دارای ظرفیت باشد یک واحد به مصرف آن اضافه می‌شود.
+    بنابراین استفاده‌های هم‌زمان هرگز از max_uses بیشتر نمی‌شوند."""
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, discount_type, value, max_uses, current_uses, expiry_date FROM discount_codes WHERE code_text = ? AND is_active = 1", (code_text.upper(),))
-    result = cursor.fetchone()
-    if not result:
-        conn.close(); return None
-
-    code_id, discount_type, value, max_uses, current_uses, expiry_date = result
-
-    if expiry_date and datetime.strptime(expiry_date, "%Y-%m-%d").date() < datetime.now().date():
-        conn.close(); return None
-
-    if current_uses >= max_uses:
-        conn.close(); return None
-
-    cursor.execute("UPDATE discount_codes SET current_uses = current_uses + 1 WHERE id = ?", (code_id,))
+    today = datetime.now().strftime("%Y-%m-%d")
+    cursor.execute("""
+        UPDATE discount_codes SET current_uses = current_uses + 1
+        WHERE code_text = ? AND is_active = 1 AND current_uses < max_uses AND (expiry_date IS NULL OR expiry_date >= ?)
+        RETURNING discount_type, value, current_uses
+    """, (code_text.upper(), today))
+    rows = cursor.fetchall()
     conn.commit()
-    conn.close()
+    if not rows:
+        return None
+    discount_type, value, current_uses = rows[0]
+    return {"type": discount_type, "value": value, "current_uses": current_uses}
 
-    return {"type": discount_type, "value": value}
+def get_redeemable_codes():
+    conn = get_connection()
+    cursor = conn.cursor()
+    today = datetime.now().strftime("%Y-%m-%d")
+    cursor.execute("SELECT code_text, discount_type, value, max_uses, current_uses, expiry_date FROM discount_codes WHERE is_active = 1 AND current_uses < max_uses AND (expiry_date IS NULL OR expiry_date >= ?)", (today,))
+    return cursor.fetchall()
 
 def list_all_codes():
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT code_text, discount_type, value, current_uses, max_uses, expiry_date FROM discount_codes WHERE is_active = 1")
     codes = cursor.fetchall()
-    conn.close()
     return codes
 
+def get_persisted_data(kind, key):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT data FROM persistence_data WHERE kind = ? AND key = ?", (kind, key))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+def get_persisted_conversations(name):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT key, state FROM persistence_conversations WHERE name = ?", (name,))
+    return cursor.fetchall()
+
+@_writes
+def save_persistence_batch(data_rows, conversation_rows):
+    """data_rows: لیست (kind, key, data) و conversation_rows: لیست (name, key, state)؛ مقدار None یعنی حذف. همه در یک تراکنش."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("INSERT INTO persistence_data (kind, key, data) VALUES (?, ?, ?) ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data", [row for row in data_rows if row[2] is not None])
+        cursor.executemany("DELETE FROM persistence_data WHERE kind = ? AND key = ?", [row[:2] for row in data_rows if row[2] is None])
+        cursor.executemany("INSERT INTO persistence_conversations (name, key, state) VALUES (?, ?, ?) ON CONFLICT (name, key) DO UPDATE SET state = excluded.state", [row for row in conversation_rows if row[2] is not None])
+        cursor.executemany("DELETE FROM persistence_conversations WHERE name = ? AND key = ?", [row[:2] for row in conversation_rows if row[2] is None])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+@_writes
+def save_receipt_hash(transaction_id, user_id, dhash, phash):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR REPLACE INTO receipt_hashes (transaction_id, user_id, dhash, phash) VALUES (?, ?, ?, ?)", (transaction_id, user_id, dhash, phash))
+    conn.commit()
+
+def get_receipt_hashes():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT transaction_id, user_id, dhash, phash FROM receipt_hashes ORDER BY transaction_id")
+    return cursor.fetchall()
+
+@_writes
 def create_support_ticket(user_id, channel_message_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO support_tickets (user_id, channel_message_id) VALUES (?, ?)", (user_id, channel_message_id))
     conn.commit()
-    conn.close()
 
 def get_user_from_ticket(channel_message_id):
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT user_id FROM support_tickets WHERE channel_message_id = ?", (channel_message_id,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
\ No newline at end of file
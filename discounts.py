@@ -0,0 +1,48 @@
+"""کش درون‌حافظه‌ای کدهای تخفیف قابل استفاده.
+
+کش شامل همه کدهایی است که هنوز فعال، منقضی‌نشده و دارای ظرفیت‌اند؛ هر کدی که در آن نباشد
+(ناشناخته، تمام‌شده یا منقضی) بدون رفتن به پایگاه داده رد می‌شود، پس حدس زدن کد یا اشتباه
+تایپی هیچ باری روی پایگاه داده ندارد. مصرف واقعی همچنان با دستور شرطی
+validate_and_apply_code انجام می‌شود. کش هر DISCOUNT_CACHE_TTL ثانیه و پس از ساخت کد جدید
+دوباره خوانده می‌شود.
+"""
+import time
+from datetime import datetime
+
+import config
+import database as db
+
+_codes = {}          # code_text -> [discount_type, value, max_uses, current_uses, expiry_date]
+_loaded_at = None
+
+async def _ensure_loaded():
+    global _codes, _loaded_at
+    if _loaded_at is not None and time.monotonic() - _loaded_at < config.DISCOUNT_CACHE_TTL:
+        return
+    rows = await db.run(db.get_redeemable_codes)
+    _codes = {code_text: [discount_type, value, max_uses, current_uses, expiry_date] for code_text, discount_type, value, max_uses, current_uses, expiry_date in rows}
+    _loaded_at = time.monotonic()
+
+def invalidate():
+    global _loaded_at
+    _loaded_at = None
+
+async def redeem(code_text):
+    """مثل db.validate_and_apply_code خروجی {"type", "value"} یا None می‌دهد."""
+    await _ensure_loaded()
+    code_text = code_text.strip().upper()
+    entry = _codes.get(code_text)
+    if entry is None:
+        return None
+    discount_type, value, max_uses, current_uses, expiry_date = entry
+    if current_uses >= max_uses or (expiry_date and expiry_date < datetime.now().strftime("%Y-%m-%d")):
+        _codes.pop(code_text, None)
+        return None
+
+    discount = await db.run(db.validate_and_apply_code, code_text)
+    if discount is None:
+        # در پایگاه داده تمام یا غیرفعال شده؛ تا بارگذاری بعدی دیگر به پایگاه داده نمی‌رسد
+        _codes.pop(code_text, None)
+        return None
+    entry[3] = discount["current_uses"]
+    return {"type": discount["type"], "value": discount["value"]}
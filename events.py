@@ -0,0 +1,46 @@
+"""اعلان تغییر کش‌های درون‌حافظه‌ای بین پروسه‌های worker.
+
+در حالت تک‌پروسه‌ای publish کاری نمی‌کند. در حالت چند پروسه‌ای (cluster.py) پیام از طریق پروسه
+نویسنده به همه worker های دیگر می‌رسد و آنجا callback های subscribe شده اجرا می‌شوند؛
+پروسه‌ای که publish می‌کند خودش مسئول به‌روز کردن کش خودش است.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_subscribers = defaultdict(list)
+_transport = None
+
+
+def set_transport(send):
+    """send(topic, payload) پیام را به پروسه‌های دیگر می‌رساند."""
+    global _transport
+    _transport = send
+
+
+def subscribe(topic, callback):
+    """callback(payload) می‌تواند تابع معمولی یا coroutine function باشد."""
+    _subscribers[topic].append(callback)
+
+
+def publish(topic, payload=None):
+    if _transport is not None:
+        _transport(topic, payload)
+
+
+def deliver(topic, payload):
+    """روی حلقه رویداد پروسه گیرنده صدا زده می‌شود."""
+    for callback in _subscribers.get(topic, ()):
+        try:
+            result = callback(payload)
+            if asyncio.iscoroutine(result):
+                asyncio.get_running_loop().create_task(result).add_done_callback(_log_failure)
+        except Exception:
+            logger.exception("Event subscriber for %s failed", topic)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Event subscriber failed", exc_info=task.exception())
@@ -0,0 +1,59 @@
+"""موتور غیرفعال‌سازی لینک‌های منقضی و یادآوری تمدید.
+
+هر EXPIRY_CHECK_INTERVAL ثانیه یک job اجرا می‌شود که با اسکن بازه‌ای روی ایندکس‌های جزئی
+expiry_date، لینک‌های منقضی را دسته‌دسته غیرفعال می‌کند و برای لینک‌هایی که تا
+EXPIRY_REMINDER_DAYS روز دیگر منقضی می‌شوند یک بار یادآوری می‌فرستد. یادآوری‌ها با اولویت
+BULK از صف خروجی ارسال می‌شوند تا محدودیت نرخ تلگرام رعایت شود و پیام‌های خرید معطل نمانند.
+"""
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+
+import config
+import database as db
+import events
+import outbox
+import purchases
+
+logger = logging.getLogger(__name__)
+
+async def deactivate_expired():
+    """لینک‌های منقضی را غیرفعال می‌کند و تعدادشان را برمی‌گرداند."""
+    today = date.today().strftime("%Y-%m-%d")
+    total = 0
+    for _ in range(config.EXPIRY_MAX_BATCHES_PER_RUN):
+        rows = await db.run(db.deactivate_expired_links, today, config.EXPIRY_BATCH_SIZE)
+        total += len(rows)
+        if rows:
+            user_ids = list({user_id for _, user_id, _ in rows})
+            purchases.invalidate(*user_ids)
+            events.publish("purchases", user_ids)
+        if len(rows) < config.EXPIRY_BATCH_SIZE:
+            break
+    return total
+
+async def send_reminders(bot):
+    """یادآوری تمدید را برای لینک‌هایی که به‌زودی منقضی می‌شوند در صف می‌گذارد و تعداد پیام‌ها را برمی‌گرداند."""
+    until_date = (date.today() + timedelta(days=config.EXPIRY_REMINDER_DAYS)).strftime("%Y-%m-%d")
+    # هر کاربر برای همه سرویس‌های رو به انقضایش فقط یک پیام می‌گیرد
+    by_user = defaultdict(list)
+    for _ in range(config.EXPIRY_MAX_BATCHES_PER_RUN):
+        rows = await db.run(db.claim_expiry_reminders, until_date, config.EXPIRY_BATCH_SIZE)
+        for user_id, product_name, expiry_date in rows:
+            by_user[user_id].append((product_name, expiry_date))
+        if len(rows) < config.EXPIRY_BATCH_SIZE:
+            break
+    for user_id, services in by_user.items():
+        lines = "\n".join(f"🔸 {product_name} (انقضا: {expiry_date})" for product_name, expiry_date in services)
+        text = f"⏰ **یادآوری تمدید سرویس**\n\nسرویس‌های زیر به‌زودی منقضی می‌شوند:\n{lines}\n\nبرای تمدید از منوی «🛍 خرید سرویس جدید» اقدام کنید."
+        outbox.post(bot.send_message, chat_id=user_id, text=text, parse_mode='Markdown', priority=outbox.BULK)
+    return len(by_user)
+
+async def expiry_job(context):
+    try:
+        deactivated = await deactivate_expired()
+        reminded = await send_reminders(context.bot)
+        if deactivated or reminded:
+            logger.info("Expiry run: %d links deactivated, %d reminders queued", deactivated, reminded)
+    except Exception:
+        logger.exception("Expiry run failed")
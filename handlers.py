@@ -1,8 +1,12 @@
 import re
+import os
+import csv
+import asyncio
+import logging
 import random
 import string
+import tempfile
 from enum import Enum
-from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes,
@@ -13,7 +17,19 @@ from telegram.ext import (
     filters,
 )
 import database as db
+import analytics
+import backup
+import catalog
 import config
+import discounts
+import events
+import metrics
+import outbox
+import profiles
+import purchases
+import receipts
+
+logger = logging.getLogger(__name__)
 
 # تعریف وضعیت‌های مکالمه
 class State(Enum):
@@ -22,12 +38,20 @@ class State(Enum):
     AWAITING_LINK_PRODUCT_CHOICE, AWAITING_LINKS_TO_ADD = range(20, 22)
     AWAITING_SUPPORT_MESSAGE = 30
 
+# محصولی که به ازای هر ۵ دعوت موفق هدیه داده می‌شود
+REFERRAL_REWARD_PRODUCT = "سرویس ۳۰ گیگ ۱ ماهه"
+
+async def _reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text, **kwargs):
+    # پاسخ‌ها هم از صف خروجی عبور می‌کنند؛ پاسخ‌های ادمین اولویت کمتری از پاسخ کاربران دارند
+    priority = outbox.ADMIN if update.effective_user and update.effective_user.id == config.ADMIN_TELEGRAM_ID else outbox.USER
+    return await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text=text, priority=priority, **kwargs)
+
 # ==================================
 # === بخش صفحه اصلی و کاربر ===
 # ==================================
 async def show_home_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db.add_or_update_user(user.id, user.first_name, user.username)
+    await profiles.touch(user)
     text = f"سلام {user.first_name} عزیز! 👋\nبه ربات فروش آلبالو خوش آمدید."
     keyboard = [
         [InlineKeyboardButton("🛍 خرید سرویس جدید", callback_data="go_to_purchase")],
@@ -43,44 +67,37 @@ async def show_home_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.answer()
         await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     else:
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await _reply(update, context, text, reply_markup=reply_markup, parse_mode='Markdown')
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db.add_or_update_user(user.id, user.first_name, user.username)
+    await profiles.touch(user)
 
     if context.args and context.args[0].startswith('ref_'):
         referrer_id = context.args[0].split('_')[1]
         if str(user.id) != referrer_id:
-            existing_user_info = db.get_user_info(user.id)
+            existing_user_info = await db.run(db.get_user_info, user.id)
             if existing_user_info and existing_user_info[0] is None:
-                db.update_user_referrer(user.id, int(referrer_id))
+                await db.run(db.update_user_referrer, user.id, int(referrer_id))
                 try:
-                    await context.bot.send_message(chat_id=int(referrer_id), text=f"🎉 یک کاربر جدید ({user.first_name}) با لینک شما وارد ربات شد!")
+                    await outbox.send(context.bot.send_message, chat_id=int(referrer_id), text=f"🎉 یک کاربر جدید ({user.first_name}) با لینک شما وارد ربات شد!")
                 except Exception as e:
                     print(f"Failed to notify referrer {referrer_id}: {e}")
 
     await show_home_menu(update, context)
 
-async def my_purchases_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def my_purchases_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, direction=None, cursor=None):
     query = update.callback_query
     await query.answer()
-    user_links = db.get_user_links(update.effective_user.id)
-    if not user_links:
-        text = "شما تاکنون هیچ خرید فعالی نداشته‌اید."
-    else:
-        text = "📄 **لیست سرویس‌های فعال شما:**\n\n"
-        for _, _, product_name, link, purchase_date in enumerate(user_links, 1):
-            text += f"🔹 **{product_name}** (خرید: {purchase_date})\n`{link}`\n\n"
-    keyboard = [[InlineKeyboardButton("⬅️ بازگشت به داشبورد", callback_data="back_to_home")]]
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown', disable_web_page_preview=True)
+    text, reply_markup = await purchases.page(update.effective_user.id, direction, cursor)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown', disable_web_page_preview=True)
 
 async def referral_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user_id = update.effective_user.id
     referral_link = f"https://t.me/{context.bot.username}?start=ref_{user_id}"
-    successful_refs = db.count_successful_referrals(user_id)
+    successful_refs = await db.run(db.count_successful_referrals, user_id)
 
     text = (
         "💌 **دوستان خود را دعوت کنید و سرویس رایگان هدیه بگیرید!**\n\n"
@@ -98,32 +115,25 @@ async def referral_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start_purchase_flow(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    products = db.get_products()
-    if not products:
+    if not catalog.get_products():
         await query.edit_message_text("در حال حاضر محصولی برای فروش وجود ندارد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ بازگشت", callback_data="back_to_home")]]))
         return ConversationHandler.END
-    keyboard = [[InlineKeyboardButton(f"{name} - {price:,} تومان", callback_data=f"product_{product_id}")] for product_id, name, price in products]
-    keyboard.append([InlineKeyboardButton("⬅️ بازگشت به داشبورد", callback_data="cancel_purchase")])
-    await query.edit_message_text("لطفاً سرویس مورد نظر خود را انتخاب کنید:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.edit_message_text("لطفاً سرویس مورد نظر خود را انتخاب کنید:", reply_markup=catalog.products_keyboard())
     return State.SELECTING_PRODUCT
 
-async def select_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def select_product(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id: int) -> int:
     query = update.callback_query
     await query.answer()
-    product_id = int(query.data.split('_')[1])
-    product = db.get_product_details(product_id)
+    product = catalog.get_product_details(product_id)
+    if not product:
+        # محصول از کاتالوگ حذف شده؛ فهرست به‌روز را دوباره نشان می‌دهیم
+        return await start_purchase_flow(update, context)
     context.user_data.pop('final_price', None)
     context.user_data.pop('discount_code', None)
     context.user_data['selected_product_id'] = product_id
     context.user_data['selected_product'] = product
-    name, price, description = product
-    text = f"شما «{name}» را انتخاب کردید.\n💰 قیمت: {price:,} تومان\n\nبرای ادامه دکمه‌ای را انتخاب کنید."
-    keyboard = [
-        [InlineKeyboardButton("✅ ادامه و پرداخت", callback_data='confirm_payment_info')],
-        [InlineKeyboardButton("🎁 اعمال کد تخفیف", callback_data='apply_discount_code')],
-        [InlineKeyboardButton("⬅️ بازگشت به داشبورد", callback_data="cancel_purchase")]
-    ]
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    text, reply_markup = catalog.product_view(product_id)
+    await query.edit_message_text(text, reply_markup=reply_markup)
     return State.CONFIRMING_PURCHASE
 
 async def prompt_for_discount_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -139,10 +149,10 @@ async def process_discount_code(update: Update, context: ContextTypes.DEFAULT_TY
     product_name, price, _ = context.user_data['selected_product']
 
     if context.user_data.get('discount_code'):
-        await update.message.reply_text("شما قبلاً یک کد تخفیف اعمال کرده‌اید.")
+        await _reply(update, context, "شما قبلاً یک کد تخفیف اعمال کرده‌اید.")
         return State.CONFIRMING_PURCHASE
 
-    discount = db.validate_and_apply_code(code_text)
+    discount = await discounts.redeem(code_text)
 
     if discount:
         new_price = 0
@@ -153,7 +163,7 @@ async def process_discount_code(update: Update, context: ContextTypes.DEFAULT_TY
 
         if new_price < 0: new_price = 0
         context.user_data['final_price'] = new_price
-        context.user_data['discount_code'] = code_text.upper()
+        context.user_data['discount_code'] = code_text.strip().upper()
 
         text = (f"✅ کد تخفیف با موفقیت اعمال شد!\n\n"
                 f"قیمت اصلی: ~~{price:,} تومان~~\n"
@@ -163,10 +173,10 @@ async def process_discount_code(update: Update, context: ContextTypes.DEFAULT_TY
             [InlineKeyboardButton("✅ بله، ادامه و پرداخت", callback_data='confirm_payment_info')],
             [InlineKeyboardButton("⬅️ بازگشت", callback_data=f"product_{context.user_data['selected_product_id']}")]
         ]
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        await _reply(update, context, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
         return State.CONFIRMING_PURCHASE
     else:
-        await update.message.reply_text("❌ کد تخفیف نامعتبر یا منقضی شده است. لطفاً دوباره تلاش کنید.")
+        await _reply(update, context, "❌ کد تخفیف نامعتبر یا منقضی شده است. لطفاً دوباره تلاش کنید.")
         return State.AWAITING_DISCOUNT_CODE
 
 async def show_payment_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -177,7 +187,7 @@ async def show_payment_info(update: Update, context: ContextTypes.DEFAULT_TYPE)
     product_name, original_price, _ = context.user_data['selected_product']
     final_price = context.user_data.get('final_price', original_price)
 
-    transaction_id = db.create_pending_transaction(user_id, product_id, product_name, final_price)
+    transaction_id = await db.run(db.create_pending_transaction, user_id, product_id, product_name, final_price)
     context.user_data['transaction_id'] = transaction_id
 
     text = (f"✅ **مرحله پرداخت برای «{product_name}»**\n\n"
@@ -195,30 +205,43 @@ async def handle_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     transaction_id = context.user_data.get('transaction_id')
     if not transaction_id:
-        await update.message.reply_text("خطا: شناسه خرید یافت نشد. لطفاً فرآیند را از ابتدا شروع کنید.")
+        await _reply(update, context, "خطا: شناسه خرید یافت نشد. لطفاً فرآیند را از ابتدا شروع کنید.")
         return ConversationHandler.END
 
-    transaction_info = db.get_transaction(transaction_id)
+    transaction_info = await db.run(db.get_transaction, transaction_id)
     if not transaction_info:
-        await update.message.reply_text("خطا: اطلاعات تراکنش یافت نشد.")
+        await _reply(update, context, "خطا: اطلاعات تراکنش یافت نشد.")
+        return ConversationHandler.END
+
+    # submitted یعنی رسید رسیده و تراکنش منتظر بررسی ادمین است (برای /approveall)؛ رسید دوباره همان submitted می‌ماند
+    # رسید دیرهنگام تراکنش expired شده هم دوباره به صف بررسی می‌رود
+    if not await db.run(db.update_transaction_status, transaction_id, 'submitted', ('pending', 'expired')) \
+            and await db.run(db.get_transaction_status, transaction_id) != 'submitted':
+        await _reply(update, context, "این خرید قبلاً بررسی شده است. برای خرید جدید فرآیند را از ابتدا شروع کنید.")
         return ConversationHandler.END
 
     _, product_name, price, _ = transaction_info
+    similar = await receipts.check_and_record(context.bot, update.message.photo, transaction_id, user.id)
+    warning = ""
+    if similar:
+        warning = "⚠️ **رسید مشابه قبلا ثبت شده:** " + "، ".join(f"خرید `{other_id}` (کاربر `{other_user}`)" for other_id, other_user, _, _ in similar) + "\n\n"
     caption = (f"🔔 **درخواست جدید**\n\n"
                f"👤 کاربر: {user.first_name} (@{user.username or 'ندارد'})\n"
                f"🆔 آیدی کاربر: `{user.id}`\n"
                f"🛍️ محصول: **{product_name}** ({price:,} تومان)\n"
                f" شناسه خرید: `{transaction_id}`\n\n"
+               f"{warning}"
                f" وضعیت: ⏳ در انتظار بررسی")
     keyboard = [[InlineKeyboardButton("✅ تایید خودکار", callback_data=f"admin_approve_{transaction_id}"),
                  InlineKeyboardButton("❌ رد کردن", callback_data=f"admin_reject_{transaction_id}")]]
-    await context.bot.send_photo(chat_id=config.ADMIN_CHANNEL_ID, photo=update.message.photo[-1].file_id, caption=caption, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
-    await update.message.reply_text("✅ رسید شما با موفقیت ثبت شد. لطفاً منتظر تایید مدیر بمانید...")
-    await context.bot.send_message(chat_id=config.ADMIN_TELEGRAM_ID, text=f"یک درخواست جدید با شناسه {transaction_id} در کانال مدیریت ثبت شد.")
+    # سهمیه کانال ۲۰ پیام در دقیقه است؛ هندلر منتظر ارسال نمی‌ماند تا جای اجرای آپدیت‌ها را نگه ندارد
+    outbox.post(context.bot.send_photo, chat_id=config.ADMIN_CHANNEL_ID, photo=update.message.photo[-1].file_id, caption=caption, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard), priority=outbox.ADMIN)
+    await _reply(update, context, "✅ رسید شما با موفقیت ثبت شد. لطفاً منتظر تایید مدیر بمانید...")
+    outbox.post(context.bot.send_message, chat_id=config.ADMIN_TELEGRAM_ID, text=f"یک درخواست جدید با شناسه {transaction_id} در کانال مدیریت ثبت شد.", priority=outbox.ADMIN)
     return ConversationHandler.END
 
 async def invalid_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("لطفاً فقط **عکس رسید پرداخت** را ارسال کنید.")
+    await _reply(update, context, "لطفاً فقط **عکس رسید پرداخت** را ارسال کنید.")
     return State.AWAITING_RECEIPT
 
 async def universal_cancel_and_go_home(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -245,12 +268,20 @@ async def forward_support_message(update: Update, context: ContextTypes.DEFAULT_
                      f"👤 **از طرف:** {user.first_name} (@{user.username or 'ندارد'})\n"
                      f"🆔 **آیدی کاربر:** `{user.id}`\n"
                      f"➖➖➖")
-    await context.bot.send_message(chat_id=config.ADMIN_CHANNEL_ID, text=ticket_header, parse_mode='Markdown')
-    forwarded_message = await update.message.forward(chat_id=config.ADMIN_CHANNEL_ID)
-    db.create_support_ticket(user.id, forwarded_message.message_id)
-    await update.message.reply_text("✅ پیام شما با موفقیت برای تیم پشتیبانی ارسال شد. لطفاً منتظر پاسخ بمانید.")
+    # ارسال به کانال در صف خروجی منتظر سهمیه کانال می‌ماند؛ تیکت پس از ارسال، بیرون از هندلر ثبت می‌شود
+    outbox.post(context.bot.send_message, chat_id=config.ADMIN_CHANNEL_ID, text=ticket_header, parse_mode='Markdown', priority=outbox.ADMIN)
+    forwarded = outbox.submit(context.bot.forward_message, chat_id=config.ADMIN_CHANNEL_ID, from_chat_id=update.effective_chat.id, message_id=update.message.message_id, priority=outbox.ADMIN)
+    context.application.create_task(_record_support_ticket(user.id, forwarded), update=update)
+    await _reply(update, context, "✅ پیام شما با موفقیت برای تیم پشتیبانی ارسال شد. لطفاً منتظر پاسخ بمانید.")
     return ConversationHandler.END
 
+async def _record_support_ticket(user_id, forwarded):
+    try:
+        message = await forwarded
+        await db.run(db.create_support_ticket, user_id, message.message_id)
+    except Exception:
+        logger.exception("Failed to forward support message of user %s", user_id)
+
 async def cancel_support(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await show_home_menu(update, context)
     return ConversationHandler.END
@@ -261,69 +292,113 @@ async def cancel_support(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.reply_to_message: return
     replied_message_id = update.message.reply_to_message.message_id
-    target_user_id = db.get_user_from_ticket(replied_message_id)
+    target_user_id = await db.run(db.get_user_from_ticket, replied_message_id)
     if target_user_id:
         admin_name = update.effective_user.first_name
         try:
-            await context.bot.copy_message(chat_id=target_user_id, from_chat_id=update.message.chat_id, message_id=update.message.message_id)
-            await context.bot.send_message(chat_id=target_user_id, text=f"💬 پاسخ جدید از طرف پشتیبانی ({admin_name}).")
-            await update.message.reply_text("✅ پاسخ شما با موفقیت برای کاربر ارسال شد.")
+            await outbox.send(context.bot.copy_message, chat_id=target_user_id, from_chat_id=update.message.chat_id, message_id=update.message.message_id)
+            await outbox.send(context.bot.send_message, chat_id=target_user_id, text=f"💬 پاسخ جدید از طرف پشتیبانی ({admin_name}).")
+            await _reply(update, context, "✅ پاسخ شما با موفقیت برای کاربر ارسال شد.")
         except Exception as e:
-            await update.message.reply_text(f"❌ ارسال پیام به کاربر ناموفق بود: {e}")
+            await _reply(update, context, f"❌ ارسال پیام به کاربر ناموفق بود: {e}")
 
-async def admin_approve_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def admin_approve_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, transaction_id: int):
     query = update.callback_query
     await query.answer()
-    transaction_id = query.data.split('_')[-1]
 
-    transaction_info = db.get_transaction(transaction_id)
-    if not transaction_info:
-        await query.edit_message_caption(caption="خطا: این تراکنش قبلاً پردازش شده یا نامعتبر است.")
+    result = await db.run(db.approve_transaction, transaction_id)
+    if result is None:
+        if await db.run(db.get_transaction_status, transaction_id) == 'approved':
+            # ممکن است ادمین دیگری یا /approveall آن را تایید کرده باشد
+            await query.edit_message_caption(caption=f"✅ تراکنش {transaction_id} قبلاً تایید شده است.", reply_markup=None)
+        else:
+            await query.edit_message_caption(caption="خطا: این تراکنش قبلاً پردازش شده یا نامعتبر است.")
         return
 
-    buyer_user_id, product_name, _, product_id = transaction_info
-    link = db.fetch_and_assign_link(product_id, buyer_user_id, transaction_id)
-
+    buyer_user_id, product_name, product_id, link = result
     if link:
-        db.update_transaction_status(transaction_id, 'approved')
-        db.save_user_link(buyer_user_id, transaction_id, product_name, link)
-        await context.bot.send_message(chat_id=buyer_user_id, text=f"✅ سرویس شما تایید و فعال شد!\n\nلینک اتصال:\n`{link}`", parse_mode='Markdown')
+        purchases.invalidate(buyer_user_id)
+        events.publish("purchases", [buyer_user_id])
+        outbox.post(context.bot.send_message, chat_id=buyer_user_id, text=f"✅ سرویس شما تایید و فعال شد!\n\nلینک اتصال:\n`{link}`", parse_mode='Markdown', priority=outbox.DELIVERY)
         final_caption = f"✅ **تایید و ارسال شد**\nمحصول: {product_name}\nشناسه: {transaction_id}\nتوسط: {update.effective_user.first_name}"
         await query.edit_message_caption(caption=final_caption, parse_mode='Markdown', reply_markup=None)
 
-        buyer_info = db.get_user_info(buyer_user_id)
+        buyer_info = await db.run(db.get_user_info, buyer_user_id)
         if buyer_info:
             referrer_id, first_purchase_done, _ = buyer_info
 
             if referrer_id and not first_purchase_done:
-                db.mark_first_purchase_complete(buyer_user_id)
-                successful_refs_count = db.count_successful_referrals(referrer_id)
-                referrer_info = db.get_user_info(referrer_id)
+                await db.run(db.mark_first_purchase_complete, buyer_user_id)
+                successful_refs_count = await db.run(db.count_successful_referrals, referrer_id)
+                referrer_info = await db.run(db.get_user_info, referrer_id)
                 rewards_claimed = referrer_info[2] if referrer_info else 0
 
                 if (successful_refs_count // 5) > rewards_claimed:
-                    reward_product_name = "سرویس ۳۰ گیگ ۱ ماهه"
-                    reward_product_id = db.get_product_id_by_name(reward_product_name)
+                    reward_product_name = REFERRAL_REWARD_PRODUCT
+                    reward_product_id = catalog.get_product_id_by_name(reward_product_name)
                     if reward_product_id:
-                        reward_link = db.fetch_and_assign_link(reward_product_id, referrer_id, 0)
+                        reward_link = await db.run(db.fetch_and_assign_link, reward_product_id, referrer_id, 0)
                         if reward_link:
-                            db.save_user_link(referrer_id, 0, f"هدیه زیرمجموعه - {reward_product_name}", reward_link)
-                            await context.bot.send_message(chat_id=referrer_id, text=(f"🎁 **شما یک سرویس هدیه دریافت کردید!**\n\nبه دلیل تکمیل خرید ۵ نفر از دوستانتان، یک «سرویس ۳۰ گیگ ۱ ماهه» به شما هدیه داده شد:\n`{reward_link}`"), parse_mode='Markdown')
-                            db.increment_rewards_claimed(referrer_id)
+                            await db.run(db.save_user_link, referrer_id, 0, f"هدیه زیرمجموعه - {reward_product_name}", reward_link)
+                            purchases.invalidate(referrer_id)
+                            events.publish("purchases", [referrer_id])
+                            outbox.post(context.bot.send_message, chat_id=referrer_id, priority=outbox.DELIVERY, text=(f"🎁 **شما یک سرویس هدیه دریافت کردید!**\n\nبه دلیل تکمیل خرید ۵ نفر از دوستانتان، یک «سرویس ۳۰ گیگ ۱ ماهه» به شما هدیه داده شد:\n`{reward_link}`"), parse_mode='Markdown')
+                            await db.run(db.increment_rewards_claimed, referrer_id)
                         else:
-                            await context.bot.send_message(chat_id=config.ADMIN_TELEGRAM_ID, text=f"⚠️ خطا: امکان تحویل هدیه به کاربر `{referrer_id}` وجود نداشت. موجودی بانک لینک برای سرویس ۳۰ گیگ تمام شده است.")
+                            outbox.post(context.bot.send_message, chat_id=config.ADMIN_TELEGRAM_ID, priority=outbox.ADMIN, text=f"⚠️ خطا: امکان تحویل هدیه به کاربر `{referrer_id}` وجود نداشت. موجودی بانک لینک برای سرویس ۳۰ گیگ تمام شده است.")
     else:
         await query.answer("⚠️ موجودی بانک لینک برای این محصول صفر است!", show_alert=True)
-        await context.bot.send_message(chat_id=update.effective_user.id, text=f"خطا: موجودی لینک برای «{product_name}» تمام شده. لطفاً با /addlinks شارژ کنید.")
+        outbox.post(context.bot.send_message, chat_id=update.effective_user.id, priority=outbox.ADMIN, text=f"خطا: موجودی لینک برای «{product_name}» تمام شده. لطفاً با /addlinks شارژ کنید.")
+
+async def bulk_approve_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    product_id = id_range = None
+    try:
+        if len(args) == 2 and args[0] == 'product':
+            product_id = int(args[1])
+        elif len(args) == 1 and '-' in args[0]:
+            first, last = (int(part) for part in args[0].split('-', 1))
+            id_range = (first, last)
+        elif args != ['all']:
+            raise ValueError()
+    except ValueError:
+        waiting = await db.run(db.count_submitted_transactions)
+        text = "فرمت: `/approveall all` یا `/approveall product 3` یا `/approveall 120-180`\n\n"
+        if waiting:
+            text += "⏳ **منتظر بررسی:**\n" + "".join(f"- محصول `{pid}` {name}: {count} رسید (شناسه {low} تا {high})\n" for pid, name, count, low, high in waiting)
+        else:
+            text += "هیچ رسیدی منتظر بررسی نیست."
+        await _reply(update, context, text, parse_mode='Markdown')
+        return
 
-async def admin_reject_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    result = await db.run(db.approve_transactions_bulk, product_id=product_id, id_range=id_range, limit=config.BULK_APPROVE_LIMIT,
+                          reward_product_id=catalog.get_product_id_by_name(REFERRAL_REWARD_PRODUCT), reward_label=f"هدیه زیرمجموعه - {REFERRAL_REWARD_PRODUCT}")
+    changed_users = list({user_id for _, user_id, _, _ in result["approved"]} | {referrer_id for referrer_id, _ in result["rewards"]})
+    if changed_users:
+        purchases.invalidate(*changed_users)
+        events.publish("purchases", changed_users)
+    # اعلان‌ها همه یکجا در صف خروجی قرار می‌گیرند و با رعایت محدودیت نرخ ارسال می‌شوند
+    for _, buyer_user_id, _, link in result["approved"]:
+        outbox.post(context.bot.send_message, chat_id=buyer_user_id, text=f"✅ سرویس شما تایید و فعال شد!\n\nلینک اتصال:\n`{link}`", parse_mode='Markdown', priority=outbox.DELIVERY)
+    for referrer_id, reward_link in result["rewards"]:
+        outbox.post(context.bot.send_message, chat_id=referrer_id, priority=outbox.DELIVERY, text=(f"🎁 **شما یک سرویس هدیه دریافت کردید!**\n\nبه دلیل تکمیل خرید ۵ نفر از دوستانتان، یک «{REFERRAL_REWARD_PRODUCT}» به شما هدیه داده شد:\n`{reward_link}`"), parse_mode='Markdown')
+
+    text = f"✅ {len(result['approved'])} تراکنش تایید و لینک‌ها در صف ارسال قرار گرفتند."
+    if result["rewards"]:
+        text += f"\n🎁 {len(result['rewards'])} هدیه معرفی ارسال شد."
+    for product_name, count in result["missing_links"].items():
+        text += f"\n⚠️ {count} تراکنش «{product_name}» به دلیل کمبود لینک تایید نشد؛ با /addlinks شارژ کنید."
+    if result["missing_rewards"]:
+        text += "\n⚠️ هدیه این کاربران به دلیل کمبود لینک تحویل نشد: " + "، ".join(f"`{referrer_id}`" for referrer_id in result["missing_rewards"])
+    await _reply(update, context, text, parse_mode='Markdown')
+
+async def admin_reject_start(update: Update, context: ContextTypes.DEFAULT_TYPE, transaction_id: int) -> int:
     query = update.callback_query
     await query.answer()
-    transaction_id = query.data.split('_')[-1]
     context.chat_data['channel_message_id'] = query.message.message_id
     context.chat_data['channel_id'] = query.message.chat_id
 
-    transaction_info = db.get_transaction(transaction_id)
+    transaction_info = await db.run(db.get_transaction, transaction_id)
     if not transaction_info:
         await query.edit_message_caption(caption="خطا: این تراکنش قبلاً پردازش شده است.")
         return ConversationHandler.END
@@ -332,7 +407,7 @@ async def admin_reject_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.chat_data['transaction_id'] = transaction_id
 
     await query.edit_message_caption(caption=f"⏳ در حال رد کردن شناسه {transaction_id}...\nلطفاً دلیل را در چت خصوصی ربات ارسال کنید.", reply_markup=None)
-    await context.bot.send_message(chat_id=update.effective_user.id, text=f"شما در حال رد کردن تراکنش `{transaction_id}` هستید. لطفاً دلیل را ارسال کنید یا با /cancel لغو کنید.")
+    await outbox.send(context.bot.send_message, chat_id=update.effective_user.id, priority=outbox.ADMIN, text=f"شما در حال رد کردن تراکنش `{transaction_id}` هستید. لطفاً دلیل را ارسال کنید یا با /cancel لغو کنید.")
     return State.AWAITING_REJECTION_REASON
 
 async def receive_rejection_reason(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -343,76 +418,151 @@ async def receive_rejection_reason(update: Update, context: ContextTypes.DEFAULT
     channel_id = context.chat_data.pop('channel_id')
     message_id = context.chat_data.pop('channel_message_id')
 
-    db.update_transaction_status(transaction_id, 'rejected')
+    if not await db.run(db.update_transaction_status, transaction_id, 'rejected', db.REVIEWABLE_STATUSES):
+        # در این فاصله ادمین دیگری یا /approveall آن را پردازش کرده است
+        status = await db.run(db.get_transaction_status, transaction_id)
+        await _reply(update, context, f"تراکنش `{transaction_id}` قبلاً پردازش شده است (وضعیت: {status}) و رد نشد.", parse_mode='Markdown')
+        return ConversationHandler.END
 
-    await context.bot.send_message(chat_id=target_user_id, text=f" متاسفانه پرداخت شما برای شناسه خرید `{transaction_id}` توسط مدیر رد شد.\n\n**دلیل:** {reason}", parse_mode='Markdown')
+    await outbox.send(context.bot.send_message, chat_id=target_user_id, text=f" متاسفانه پرداخت شما برای شناسه خرید `{transaction_id}` توسط مدیر رد شد.\n\n**دلیل:** {reason}", parse_mode='Markdown')
 
-    _, product_name, _, _ = db.get_transaction(transaction_id)
+    _, product_name, _, _ = await db.run(db.get_transaction, transaction_id)
     final_caption = f"❌ **رد شد**\nمحصول: {product_name}\nشناسه: {transaction_id}\nتوسط: {admin_user.first_name}\nدلیل: {reason}"
     await context.bot.edit_message_caption(chat_id=channel_id, message_id=message_id, caption=final_caption, parse_mode='Markdown')
-    await update.message.reply_text(f"پیام رد پرداخت برای کاربر `{target_user_id}` ارسال و وضعیت در کانال آپدیت شد.")
+    await _reply(update, context, f"پیام رد پرداخت برای کاربر `{target_user_id}` ارسال و وضعیت در کانال آپدیت شد.")
     return ConversationHandler.END
 
 async def add_links_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    products = db.get_products()
-    keyboard = [[InlineKeyboardButton(p[1], callback_data=f"linkprod_{p[0]}")] for p in products]
-    keyboard.append([InlineKeyboardButton("لغو", callback_data="cancel_addlink")])
-    await update.message.reply_text("لطفاً انتخاب کنید لینک‌ها برای کدام محصول هستند:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await _reply(update, context, "لطفاً انتخاب کنید لینک‌ها برای کدام محصول هستند:", reply_markup=catalog.link_products_keyboard())
     return State.AWAITING_LINK_PRODUCT_CHOICE
 
-async def add_links_product_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def add_links_product_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id: int) -> int:
     query = update.callback_query
     await query.answer()
-    product_id = int(query.data.split('_')[1])
     context.chat_data['product_id_for_links'] = product_id
-    await query.edit_message_text("عالی. حالا لیست لینک‌ها را ارسال کنید (هر لینک در یک خط جداگانه).")
+    await query.edit_message_text("عالی. حالا لیست لینک‌ها را ارسال کنید (هر لینک در یک خط جداگانه)، یا برای تعداد زیاد یک فایل .txt یا .csv بفرستید.")
     return State.AWAITING_LINKS_TO_ADD
 
+def _iter_links(rows, stats):
+    """از هر سطر (یا هر ردیف CSV) اولین مقداری که با http شروع شود را برمی‌گرداند و سطرهای نامعتبر را می‌شمارد."""
+    for row in rows:
+        cells = [row] if isinstance(row, str) else row
+        link = next((cell.strip() for cell in cells if cell.strip().startswith('http')), None)
+        if link:
+            yield link
+        elif any(cell.strip() for cell in cells):
+            stats['invalid'] += 1
+
+def _clean_links_file(path, is_csv, stats, clean_path):
+    """لینک‌های معتبر فایل را سطر به سطر در clean_path می‌نویسد و تعدادشان را برمی‌گرداند؛ روی یک ترد جدا اجرا می‌شود."""
+    count = 0
+    with open(path, encoding='utf-8-sig', errors='replace', newline='') as file, open(clean_path, 'w', encoding='utf-8') as clean:
+        for link in _iter_links(csv.reader(file) if is_csv else file, stats):
+            if '\n' in link or '\r' in link:
+                stats['invalid'] += 1
+                continue
+            clean.write(link + '\n')
+            count += 1
+    return count
+
+def _read_clean_links(path):
+    # فایل سطر به سطر خوانده می‌شود تا فایل‌های بزرگ کامل در حافظه بارگذاری نشوند
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            yield line.rstrip('\n')
+
+async def _finish_adding_links(update: Update, context: ContextTypes.DEFAULT_TYPE, added_count, duplicate_count, invalid_count) -> int:
+    await _reply(update, context, f"✅ {added_count} لینک جدید با موفقیت به بانک اضافه شد.\n"
+                                    f"♻️ تکراری: {duplicate_count}\n"
+                                    f"⚠️ نامعتبر: {invalid_count}")
+    context.chat_data.clear()
+    return ConversationHandler.END
+
 async def add_links_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     product_id = context.chat_data.get('product_id_for_links')
     if not product_id:
-        await update.message.reply_text("خطا! لطفاً فرآیند را از ابتدا با /addlinks شروع کنید.")
+        await _reply(update, context, "خطا! لطفاً فرآیند را از ابتدا با /addlinks شروع کنید.")
         return ConversationHandler.END
 
-    links = [line.strip() for line in update.message.text.split('\n') if line.strip().startswith('http')]
+    stats = {'invalid': 0}
+    links = list(_iter_links(update.message.text.split('\n'), stats))
 
     if not links:
-        await update.message.reply_text("هیچ لینک معتبری یافت نشد. لطفاً دوباره تلاش کنید یا با /cancel لغو کنید.")
+        await _reply(update, context, "هیچ لینک معتبری یافت نشد. لطفاً دوباره تلاش کنید یا با /cancel لغو کنید.")
         return State.AWAITING_LINKS_TO_ADD
 
-    added_count = db.add_links_to_bank(product_id, links)
-    await update.message.reply_text(f"✅ {added_count} لینک جدید با موفقیت به بانک اضافه شد.")
-    context.chat_data.clear()
-    return ConversationHandler.END
+    added_count, duplicate_count = await db.run(db.add_links_to_bank, product_id, links)
+    return await _finish_adding_links(update, context, added_count, duplicate_count, stats['invalid'])
+
+async def add_links_document_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    product_id = context.chat_data.get('product_id_for_links')
+    if not product_id:
+        await _reply(update, context, "خطا! لطفاً فرآیند را از ابتدا با /addlinks شروع کنید.")
+        return ConversationHandler.END
+
+    document = update.message.document
+    await _reply(update, context, "⏳ در حال دریافت و پردازش فایل...")
+    stats = {'invalid': 0}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "links")
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        is_csv = (document.file_name or '').lower().endswith('.csv')
+        # تجزیه و اعتبارسنجی فایل روی ترد دیگری انجام می‌شود؛ ترد پایگاه داده فقط لینک‌های آماده را از فایل
+        # تمیزشده می‌خواند و همه را در یک تراکنش درج می‌کند
+        clean_path = os.path.join(tmp_dir, "clean")
+        added_count = duplicate_count = 0
+        if await asyncio.to_thread(_clean_links_file, path, is_csv, stats, clean_path):
+            added_count, duplicate_count = await db.run(db.add_links_to_bank, product_id, _read_clean_links(clean_path), config.LINK_UPLOAD_CHUNK_SIZE)
+
+    if added_count + duplicate_count == 0:
+        await _reply(update, context, "هیچ لینک معتبری در فایل یافت نشد. لطفاً دوباره تلاش کنید یا با /cancel لغو کنید.")
+        return State.AWAITING_LINKS_TO_ADD
+    return await _finish_adding_links(update, context, added_count, duplicate_count, stats['invalid'])
 
 async def cancel_addlink_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.chat_data.clear()
     if update.callback_query:
         await update.callback_query.edit_message_text("عملیات افزودن لینک لغو شد.")
     else:
-        await update.message.reply_text("عملیات افزودن لینک لغو شد.")
+        await _reply(update, context, "عملیات افزودن لینک لغو شد.")
     return ConversationHandler.END
 
 async def link_status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    status = db.get_link_bank_status()
+    status = await db.run(db.get_link_bank_status)
     if not status:
         text = "بانک لینک خالی است."
     else:
         text = "📊 **وضعیت موجودی بانک لینک:**\n\n"
         for product_name, count in status:
             text += f"🔹 **{product_name}**: {count} لینک باقی‌مانده\n"
-    await update.message.reply_text(text, parse_mode='Markdown')
+    await _reply(update, context, text, parse_mode='Markdown')
+
+async def reload_catalog_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await catalog.reload()
+    events.publish("catalog")
+    await _reply(update, context, f"✅ کاتالوگ محصولات دوباره بارگذاری شد ({len(catalog.get_products())} محصول).")
+
+async def check_referrals_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    repair = bool(context.args) and context.args[0] == 'fix'
+    mismatches = await db.run(db.check_referral_counters, repair)
+    if not mismatches:
+        await _reply(update, context, "✅ شمارنده‌های دعوت موفق با داده‌ها سازگار هستند.")
+        return
+    text = f"⚠️ {len(mismatches)} شمارنده ناسازگار" + (" پیدا و اصلاح شد:\n\n" if repair else " پیدا شد (برای اصلاح: `/checkreferrals fix`):\n\n")
+    for user_id, stored, actual in mismatches[:30]:
+        text += f"- `{user_id}`: {stored} ← {actual}\n"
+    await _reply(update, context, text, parse_mode='Markdown')
 
 async def backup_database_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id != config.ADMIN_TELEGRAM_ID: return
-    await update.message.reply_text("در حال آماده‌سازی فایل بکاپ...")
+    await _reply(update, context, "در حال آماده‌سازی فایل بکاپ...")
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        await context.bot.send_document(chat_id=config.ADMIN_CHANNEL_ID, document=open("store.db", "rb"), filename=f"backup_{timestamp}.db", caption=f"Backup\n{timestamp}")
-        await update.message.reply_text("✅ بکاپ دیتابیس با موفقیت به کانال مدیریت ارسال شد.")
+        await backup.send_backup(context.bot)
+        await _reply(update, context, "✅ بکاپ دیتابیس با موفقیت به کانال مدیریت ارسال شد.")
     except Exception as e:
-        await update.message.reply_text(f"❌ خطایی در هنگام ارسال فایل بکاپ رخ داد: {e}")
+        await _reply(update, context, f"❌ خطایی در هنگام ارسال فایل بکاپ رخ داد: {e}")
 
 async def add_code_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -421,28 +571,58 @@ async def add_code_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         code, type, value, uses = parts[1], parts[2], int(parts[3]), int(parts[4])
         expiry = parts[5] if len(parts) > 5 else None
         if type not in ['percent', 'fixed']:
-            await update.message.reply_text("نوع تخفیف باید 'percent' یا 'fixed' باشد.")
+            await _reply(update, context, "نوع تخفیف باید 'percent' یا 'fixed' باشد.")
             return
-        if db.create_discount_code(code, type, value, uses, expiry):
-            await update.message.reply_text(f"کد تخفیف {code.upper()} با موفقیت ساخته شد.")
+        if await db.run(db.create_discount_code, code, type, value, uses, expiry):
+            discounts.invalidate()
+            events.publish("discounts")
+            await _reply(update, context, f"کد تخفیف {code.upper()} با موفقیت ساخته شد.")
         else:
-            await update.message.reply_text("این کد از قبل وجود دارد.")
+            await _reply(update, context, "این کد از قبل وجود دارد.")
     except (IndexError, ValueError):
-        await update.message.reply_text("فرمت دستور اشتباه است.\nمثال: `/addcode CODE1 percent 10 50 2025-12-31`", parse_mode='Markdown')
+        await _reply(update, context, "فرمت دستور اشتباه است.\nمثال: `/addcode CODE1 percent 10 50 2025-12-31`", parse_mode='Markdown')
 
 async def list_codes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    codes = db.list_all_codes()
+    codes = await db.run(db.list_all_codes)
     if not codes:
-        await update.message.reply_text("هیچ کد تخفیف فعالی وجود ندارد.")
+        await _reply(update, context, "هیچ کد تخفیف فعالی وجود ندارد.")
         return
     text = "📜 **لیست کدهای تخفیف فعال:**\n\n"
     for code, type, value, used, total, expiry in codes:
         val_str = f"{value}%" if type == 'percent' else f"{value:,} تومان"
         expiry_str = f" | انقضا: {expiry}" if expiry else ""
         text += f"- `{code}` | {val_str} | {used}/{total}{expiry_str}\n"
-    await update.message.reply_text(text, parse_mode='Markdown')
+    await _reply(update, context, text, parse_mode='Markdown')
+
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = "⏱ **کندترین هندلرها** (p95 / میانگین، ms):\n"
+    for name, count, avg_ms, p95_ms, errors in metrics.top("handler"):
+        text += f"- `{name}`: {p95_ms:g} / {avg_ms:.1f} | {count} بار" + (f" | ❌ {errors}" if errors else "") + "\n"
+    text += "\n🗄 **کندترین کوئری‌ها** (p95 / میانگین، ms):\n"
+    for name, count, avg_ms, p95_ms, errors in metrics.top("query"):
+        text += f"- `{name}`: {p95_ms:g} / {avg_ms:.1f} | {count} بار" + (f" | ❌ {errors}" if errors else "") + "\n"
+    text += "\n⏳ **انتظار در صف ترد پایگاه داده** (p95 / میانگین، ms):\n"
+    for name, count, avg_ms, p95_ms, errors in metrics.top("db_queue", limit=5):
+        text += f"- `{name}`: {p95_ms:g} / {avg_ms:.1f} | {count} بار\n"
+    text += "\n🌐 **Bot API** (p95 / میانگین، ms):\n"
+    for name, count, avg_ms, p95_ms, errors in metrics.top("api", limit=5):
+        text += f"- `{name}`: {p95_ms:g} / {avg_ms:.1f} | {count} بار" + (f" | ❌ {errors}" if errors else "") + "\n"
+    stats = outbox.stats()
+    text += f"\n📤 صف خروجی: {stats['queue_size']} در صف | {stats.get('sent', 0)} ارسال | {stats.get('failed', 0)} خطا"
+    await _reply(update, context, text, parse_mode='Markdown')
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        days = int(context.args[0]) if context.args else None
+        if days is not None and not 1 <= days <= 366: raise ValueError()
+    except ValueError:
+        await _reply(update, context, "فرمت دستور اشتباه است.\nمثال: `/stats 30`", parse_mode='Markdown')
+        return
+    text, chart = await analytics.build_report(days)
+    await _reply(update, context, text, parse_mode='Markdown')
+    await outbox.send(context.bot.send_photo, chat_id=update.effective_chat.id, photo=chart, priority=outbox.ADMIN)
 
 async def cancel_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.chat_data.clear()
-    await update.message.reply_text("عملیات ادمین لغو شد.")
+    await _reply(update, context, "عملیات ادمین لغو شد.")
     return ConversationHandler.END
\ No newline at end of file
@@ -1,36 +1,85 @@
 import logging
+import secrets
+from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
-    CallbackQueryHandler,
     ConversationHandler,
     MessageHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
+import config
+from callback_router import CallbackRouteHandler
 from config import TOKEN, ADMIN_TELEGRAM_ID, ADMIN_CHANNEL_ID
 import database as db
+import analytics
+import backup
+import catalog
+import expiry
 import handlers as h
+import maintenance
+import metrics
+import outbox
+import profiles
+import receipts
+from persistence import SQLitePersistence
+from update_processor import PerUserUpdateProcessor
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def main() -> None:
-    db.setup_database()
-    application = Application.builder().token(TOKEN).build()
+async def on_startup(application: Application) -> None:
+    await metrics.start_server()
+
+async def on_stop(application: Application) -> None:
+    # post_stop قبل از Application.shutdown اجرا می‌شود و bot هنوز مقداردهی‌شده است، پس پیام‌های صف
+    # (از جمله تحویل لینک خریداران) هنوز ارسال می‌شوند
+    await profiles.flush()
+    await outbox.stop()
+
+async def on_shutdown(application: Application) -> None:
+    await metrics.stop_server()
+    analytics.shutdown()
+    receipts.shutdown()
+
+def build_application(token=TOKEN, request=None, primary=True) -> Application:
+    """Application را با تمام هندلرها می‌سازد؛ request برای اجرای آفلاین (مثلا tools/fakebot.py) است.
+
+    در حالت چند پروسه‌ای فقط پروسه primary کارهای زمان‌بندی‌شده سراسری (بکاپ، انقضا و نگهداری تراکنش‌ها) را اجرا می‌کند.
+    """
+    # هندلرها و توابع پایگاه داده باید قبل از ثبت هندلرها پوشانده شوند
+    metrics.install(h, db)
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(config.CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence(update_interval=config.PERSISTENCE_UPDATE_INTERVAL))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    # getUpdates جداگانه می‌ماند تا long polling در زمان فراخوانی‌های Bot API حساب نشود
+    builder = builder.request(metrics.InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+    application = builder.build()
 
     # --- مکالمه ۱: فرآیند خرید کاربر ---
     purchase_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(h.start_purchase_flow, pattern="^go_to_purchase$")],
+        entry_points=[CallbackRouteHandler({"go_to_purchase": h.start_purchase_flow})],
         states={
-            h.State.SELECTING_PRODUCT: [CallbackQueryHandler(h.select_product, pattern=r"^product_\d+$")],
+            h.State.SELECTING_PRODUCT: [CallbackRouteHandler({"product_{product_id:int}": h.select_product})],
             h.State.CONFIRMING_PURCHASE: [
-                CallbackQueryHandler(h.show_payment_info, pattern="^confirm_payment_info$"),
-                CallbackQueryHandler(h.prompt_for_discount_code, pattern="^apply_discount_code$"),
-                CallbackQueryHandler(h.start_purchase_flow, pattern="^back_to_products$")
+                CallbackRouteHandler({
+                    "confirm_payment_info": h.show_payment_info,
+                    "apply_discount_code": h.prompt_for_discount_code,
+                    "back_to_products": h.start_purchase_flow,
+                })
             ],
             h.State.AWAITING_DISCOUNT_CODE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, h.process_discount_code),
-                CallbackQueryHandler(h.select_product, pattern=r"^product_\d+$")
+                CallbackRouteHandler({"product_{product_id:int}": h.select_product})
             ],
             h.State.AWAITING_RECEIPT: [
                 MessageHandler(filters.PHOTO, h.handle_receipt),
@@ -38,44 +87,55 @@ def main() -> None:
             ],
         },
         fallbacks=[
-            CallbackQueryHandler(h.universal_cancel_and_go_home, pattern="^cancel_purchase$"),
+            CallbackRouteHandler({"cancel_purchase": h.universal_cancel_and_go_home}),
             CommandHandler("start", h.start)
         ],
-        conversation_timeout=1800
+        conversation_timeout=1800,
+        name="purchase",
+        persistent=True
     )
 
     # --- مکالمه ۲: فرآیند افزودن لینک توسط ادمین ---
     add_link_conv = ConversationHandler(
         entry_points=[CommandHandler("addlinks", h.add_links_start, filters=filters.User(ADMIN_TELEGRAM_ID))],
         states={
-            h.State.AWAITING_LINK_PRODUCT_CHOICE: [CallbackQueryHandler(h.add_links_product_chosen, pattern=r"^linkprod_\d+$")],
-            h.State.AWAITING_LINKS_TO_ADD: [MessageHandler(filters.TEXT & ~filters.COMMAND, h.add_links_received)],
+            h.State.AWAITING_LINK_PRODUCT_CHOICE: [CallbackRouteHandler({"linkprod_{product_id:int}": h.add_links_product_chosen})],
+            h.State.AWAITING_LINKS_TO_ADD: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, h.add_links_received),
+                MessageHandler(filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"), h.add_links_document_received)
+            ],
         },
         fallbacks=[
             CommandHandler("cancel", h.cancel_admin_action),
-            CallbackQueryHandler(h.cancel_addlink_action, pattern="^cancel_addlink$")
+            CallbackRouteHandler({"cancel_addlink": h.cancel_addlink_action})
         ],
-        conversation_timeout=600
+        conversation_timeout=600,
+        name="add_links",
+        persistent=True
     )
 
     # --- مکالمه ۳: فرآیند رد کردن پرداخت توسط ادمین ---
     reject_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(h.admin_reject_start, pattern=r"^admin_reject_\d+$")],
+        entry_points=[CallbackRouteHandler({"admin_reject_{transaction_id:int}": h.admin_reject_start})],
         states={
             h.State.AWAITING_REJECTION_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, h.receive_rejection_reason)]
         },
         fallbacks=[CommandHandler("cancel", h.cancel_admin_action)],
-        conversation_timeout=300
+        conversation_timeout=300,
+        name="reject",
+        persistent=True
     )
 
     # --- مکالمه ۴: فرآیند ارسال تیکت پشتیبانی توسط کاربر ---
     support_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(h.start_support_conversation, pattern="^support$")],
+        entry_points=[CallbackRouteHandler({"support": h.start_support_conversation})],
         states={
             h.State.AWAITING_SUPPORT_MESSAGE: [MessageHandler(filters.TEXT | filters.PHOTO, h.forward_support_message)]
         },
-        fallbacks=[CallbackQueryHandler(h.cancel_support, pattern="^cancel_support$")],
-        conversation_timeout=600
+        fallbacks=[CallbackRouteHandler({"cancel_support": h.cancel_support})],
+        conversation_timeout=600,
+        name="support",
+        persistent=True
     )
 
     # --- هندلر پاسخگویی ادمین در کانال ---
@@ -89,19 +149,72 @@ def main() -> None:
 
     application.add_handler(CommandHandler("linkstatus", h.link_status_handler, filters=filters.User(ADMIN_TELEGRAM_ID)))
     application.add_handler(CommandHandler("backup", h.backup_database_handler, filters=filters.User(ADMIN_TELEGRAM_ID)))
+    application.add_handler(CommandHandler("reloadproducts", h.reload_catalog_command, filters=filters.User(ADMIN_TELEGRAM_ID)))
+    application.add_handler(CommandHandler("checkreferrals", h.check_referrals_command, filters=filters.User(ADMIN_TELEGRAM_ID)))
     application.add_handler(CommandHandler("addcode", h.add_code_command, filters=filters.User(ADMIN_TELEGRAM_ID)))
     application.add_handler(CommandHandler("listcodes", h.list_codes_command, filters=filters.User(ADMIN_TELEGRAM_ID)))
+    application.add_handler(CommandHandler("perf", h.perf_command, filters=filters.User(ADMIN_TELEGRAM_ID)))
+    application.add_handler(CommandHandler("stats", h.stats_command, filters=filters.User(ADMIN_TELEGRAM_ID)))
+    application.add_handler(CommandHandler("approveall", h.bulk_approve_command, filters=filters.User(ADMIN_TELEGRAM_ID)))
 
-    application.add_handler(CallbackQueryHandler(h.admin_approve_handler, pattern=r"^admin_approve_\d+$"))
     application.add_handler(admin_reply_handler)
 
     application.add_handler(CommandHandler("start", h.start))
-    application.add_handler(CallbackQueryHandler(h.my_purchases_handler, pattern="^my_purchases$"))
-    application.add_handler(CallbackQueryHandler(h.universal_cancel_and_go_home, pattern="^back_to_home$"))
-    application.add_handler(CallbackQueryHandler(h.referral_handler, pattern="^referral$"))
+    # همه دکمه‌های خارج از مکالمه‌ها در یک router؛ پیدا کردن هندلر به تعداد مسیرها بستگی ندارد
+    application.add_handler(CallbackRouteHandler({
+        "admin_approve_{transaction_id:int}": h.admin_approve_handler,
+        "my_purchases": h.my_purchases_handler,
+        "my_purchases_{direction}_{cursor:int}": h.my_purchases_handler,
+        "back_to_home": h.universal_cancel_and_go_home,
+        "referral": h.referral_handler,
+    }))
+
+    application.job_queue.run_repeating(profiles.flush, interval=config.PROFILE_FLUSH_INTERVAL, first=config.PROFILE_FLUSH_INTERVAL)
+    if primary:
+        application.job_queue.run_repeating(backup.backup_job, interval=config.BACKUP_INTERVAL, first=config.BACKUP_INTERVAL)
+        application.job_queue.run_repeating(expiry.expiry_job, interval=config.EXPIRY_CHECK_INTERVAL, first=60)
+        application.job_queue.run_repeating(maintenance.maintenance_job, interval=config.MAINTENANCE_INTERVAL, first=120)
+
+    return application
+
+def webhook_options() -> dict:
+    if not config.WEBHOOK_URL:
+        raise SystemExit("در حالت webhook مقدار BOT_WEBHOOK_URL باید تنظیم شود.")
+    # تلگرام این توکن را در هدر X-Telegram-Bot-Api-Secret-Token هر درخواست می‌فرستد و سرور PTB
+    # درخواست‌های بدون آن را با 403 رد می‌کند
+    secret_token = config.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+    return dict(
+        listen=config.WEBHOOK_LISTEN,
+        port=config.WEBHOOK_PORT,
+        url_path=config.WEBHOOK_URL_PATH,
+        webhook_url=config.WEBHOOK_URL,
+        secret_token=secret_token,
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+        bootstrap_retries=3,
+    )
+
+def run_webhook(application: Application) -> None:
+    # run_webhook هنگام شروع، setWebhook را با همین آدرس و تنظیمات صدا می‌زند
+    application.run_webhook(**webhook_options())
+
+def main() -> None:
+    db.setup_database()
+    if config.WORKERS > 1:
+        import cluster
+        print(f"ربات آلبالو در حالت چند پروسه‌ای با {config.WORKERS} worker اجرا شد...")
+        cluster.run(config.WORKERS)
+        db.shutdown()
+        return
+    catalog.load()
+    application = build_application()
 
     print("ربات آلبالو با تمام قابلیت‌ها با موفقیت اجرا شد...")
-    application.run_polling()
+    if config.RUN_MODE == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
+    db.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
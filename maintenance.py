@@ -0,0 +1,48 @@
+"""نگهداری دوره‌ای جداول پرحجم transactions و link_bank.
+
+هر MAINTENANCE_INTERVAL ثانیه تراکنش‌های pending که بیش از PENDING_TRANSACTION_TTL_HOURS ساعت رسیدی
+نگرفته‌اند expired می‌شوند و تراکنش‌های تمام‌شده قدیمی‌تر از TRANSACTION_ARCHIVE_DAYS روز دسته‌دسته به
+transactions_archive منتقل می‌شوند. لینک‌های واگذارشده هم به link_bank_used منتقل می‌شوند تا link_bank
+فقط موجودی آزاد را نگه دارد، و در پایان صفحه‌های آزادشده با incremental_vacuum از فایل حذف می‌شوند.
+هر دسته یک تراکنش کوتاه جداگانه است تا نوشتن‌های ربات پشت آن معطل نمانند. آمار فروش در sales_daily
+است و با بایگانی تغییری نمی‌کند.
+"""
+import logging
+from datetime import datetime, timedelta
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+async def _in_batches(func, *args):
+    total = 0
+    for _ in range(config.MAINTENANCE_MAX_BATCHES_PER_RUN):
+        count = await db.run(func, *args, config.MAINTENANCE_BATCH_SIZE)
+        total += count
+        if count < config.MAINTENANCE_BATCH_SIZE:
+            break
+    return total
+
+async def expire_pending():
+    before = (datetime.now() - timedelta(hours=config.PENDING_TRANSACTION_TTL_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+    return await _in_batches(db.expire_pending_transactions, before)
+
+async def archive_completed():
+    before = (datetime.now() - timedelta(days=config.TRANSACTION_ARCHIVE_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    return await _in_batches(db.archive_transactions, before)
+
+async def compact_links():
+    return await _in_batches(db.compact_link_bank)
+
+async def maintenance_job(context):
+    try:
+        expired = await expire_pending()
+        archived = await archive_completed()
+        compacted = await compact_links()
+        if archived or compacted:
+            await db.run(db.incremental_vacuum)
+        if expired or archived or compacted:
+            logger.info("Maintenance: %d pending expired, %d transactions archived, %d used links compacted", expired, archived, compacted)
+    except Exception:
+        logger.exception("Maintenance run failed")
@@ -0,0 +1,262 @@
+"""اندازه‌گیری مسیرهای داغ ربات و endpoint متریک به سبک Prometheus.
+
+install() هندلرهای handlers.py، توابع database.py، انتظار در صف ترد پایگاه داده و زمان
+فراخوانی‌های Bot API را با هیستوگرام‌های ساده (شمارش در bucket ها، بدون نگه داشتن نمونه‌ها)
+اندازه می‌گیرد. خروجی روی http://METRICS_HOST:METRICS_PORT/metrics و با دستور /perf در دسترس است.
+"""
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import time
+
+from telegram.request import BaseRequest
+
+import config
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# نوع هر سری -> (نام متریک، توضیح)
+KINDS = {
+    "handler": ("bot_handler_seconds", "Latency of update handlers in handlers.py"),
+    "query": ("bot_db_query_seconds", "Execution time of database.py functions on the db thread"),
+    "db_queue": ("bot_db_executor_queue_seconds", "Time a database call waited in the db executor queue before running (not SQLite lock time)"),
+    "writer": ("bot_db_writer_seconds", "Round trip of writes sent to the db writer process (cluster mode)"),
+    "api": ("bot_api_request_seconds", "Latency of outbound Bot API requests"),
+}
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, fraction):
+        """تخمین quantile با حد بالای bucket مربوط."""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return BUCKETS[index] if index < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+_series = {kind: {} for kind in KINDS}
+_installed = False
+
+
+def _histogram(kind, name):
+    series = _series[kind]
+    histogram = series.get(name)
+    if histogram is None:
+        histogram = series[name] = Histogram()
+    return histogram
+
+
+def observe(kind, name, seconds, error=False):
+    histogram = _histogram(kind, name)
+    histogram.observe(seconds)
+    if error:
+        histogram.errors += 1
+
+
+# ==================================
+# === پوشاندن توابع ===
+# ==================================
+def _wrap_async(kind, name, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        try:
+            return await func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            observe(kind, name, time.perf_counter() - start, error)
+    return wrapper
+
+
+def _wrap_sync(kind, name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            observe(kind, name, time.perf_counter() - start, error)
+    return wrapper
+
+
+def _wrap_db_run(database_module):
+    original_run = database_module.run
+
+    @functools.wraps(original_run)
+    async def run(func, *args, **kwargs):
+        if database_module._writer is not None and getattr(func, "writes", False):
+            # اجرای خود تابع در پروسه نویسنده است؛ اینجا فقط رفت‌وبرگشت اندازه گرفته می‌شود
+            start = time.perf_counter()
+            error = False
+            try:
+                return await original_run(func, *args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                observe("writer", func.__name__, time.perf_counter() - start, error)
+        queued = time.perf_counter()
+
+        def call():
+            observe("db_queue", getattr(func, "__name__", "call"), time.perf_counter() - queued)
+            return func(*args, **kwargs)
+
+        return await original_run(call)
+    return run
+
+
+def install(handlers_module, database_module):
+    """هندلرها و توابع پایگاه داده را در جای خود می‌پوشاند؛ باید پیش از ثبت هندلرها صدا زده شود."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    for name, func in list(vars(handlers_module).items()):
+        if inspect.iscoroutinefunction(func) and func.__module__ == handlers_module.__name__ and not name.startswith("_"):
+            setattr(handlers_module, name, _wrap_async("handler", name, func))
+
+    skip = {"run", "shutdown", "get_connection", "close_connection", "setup_database"}
+    for name, func in list(vars(database_module).items()):
+        if inspect.isfunction(func) and func.__module__ == database_module.__name__ and not name.startswith("_") and name not in skip:
+            setattr(database_module, name, _wrap_sync("query", name, func))
+    database_module.run = _wrap_db_run(database_module)
+
+
+class InstrumentedRequest(BaseRequest):
+    """یک BaseRequest دیگر را می‌پوشاند و زمان هر متد Bot API را ثبت می‌کند."""
+
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    @property
+    def read_timeout(self):
+        return self._wrapped.read_timeout
+
+    async def initialize(self):
+        await self._wrapped.initialize()
+
+    async def shutdown(self):
+        await self._wrapped.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        name = "file_download" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        error = True
+        try:
+            status, payload = await self._wrapped.do_request(url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout)
+            error = status >= 400
+            return status, payload
+        finally:
+            observe("api", name, time.perf_counter() - start, error)
+
+
+# ==================================
+# === خروجی ===
+# ==================================
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_prometheus(extra_gauges=None):
+    lines = []
+    for kind, (metric, help_text) in KINDS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        errors = []
+        for name, histogram in sorted(_series[kind].items()):
+            label = f'name="{_label(name)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum{{{label}}} {histogram.total:.6f}")
+            lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+            errors.append(f"{metric.removesuffix('_seconds')}_errors_total{{{label}}} {histogram.errors}")
+        if errors:
+            lines.append(f"# TYPE {metric.removesuffix('_seconds')}_errors_total counter")
+            lines.extend(errors)
+    for name, value in (extra_gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def top(kind, limit=10):
+    """کندترین سری‌ها بر اساس p95: لیست (name, count, avg_ms, p95_ms, errors)."""
+    rows = [(name, h.count, h.total / h.count * 1000, h.quantile(0.95) * 1000, h.errors) for name, h in _series[kind].items() if h.count]
+    rows.sort(key=lambda row: (row[3], row[2]), reverse=True)
+    return rows[:limit]
+
+
+def _outbox_gauges():
+    import outbox
+    return {f"bot_outbox_{key}": value for key, value in outbox.stats().items()}
+
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = render_prometheus(_outbox_gauges()).encode()
+            status = "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+_server = None
+
+
+async def start_server():
+    global _server
+    if config.METRICS_PORT and _server is None:
+        _server = await asyncio.start_server(_handle_http, config.METRICS_HOST, config.METRICS_PORT)
+        logger.info("Metrics endpoint listening on http://%s:%s/metrics", config.METRICS_HOST, config.METRICS_PORT)
+
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
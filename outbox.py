@@ -0,0 +1,240 @@
+"""صف مرکزی پیام‌های خروجی با رعایت محدودیت‌های نرخ ارسال تلگرام.
+
+همه پیام‌هایی که ربات می‌فرستد از این صف عبور می‌کنند:
+- یک token bucket سراسری (حدود ۳۰ پیام در ثانیه برای کل ربات) و یک token bucket برای هر چت
+  (حدود ۱ پیام در ثانیه در چت خصوصی و ۲۰ پیام در دقیقه در گروه و کانال)؛
+- اولویت‌ها: تحویل سرویس به خریدار جلوتر از پاسخ‌های معمولی، و آن‌ها جلوتر از اعلان‌های ادمین؛
+- در صورت RetryAfter ارسال‌ها به اندازه زمان خواسته‌شده متوقف و پیام دوباره صف می‌شود؛
+- شمارنده‌های ساده در stats() برای مانیتورینگ.
+
+ارسال پیام‌های یک چت با اولویت یکسان به ترتیب ثبت انجام می‌شود.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# اولویت‌ها؛ عدد کمتر زودتر ارسال می‌شود
+DELIVERY = 0    # تحویل لینک سرویس به خریدار
+USER = 1        # پاسخ‌ها و اعلان‌های کاربران
+ADMIN = 2       # اعلان‌ها و پاسخ‌های ادمین و کانال مدیریت
+BULK = 3        # ارسال‌های انبوه و پس‌زمینه (یادآوری‌ها، بکاپ)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """چند ثانیه تا آزاد شدن یک توکن مانده است (بدون مصرف آن)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "method", "chat_id", "kwargs", "future", "attempts", "queued_at")
+
+    def __init__(self, priority, seq, method, chat_id, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _seconds(retry_after):
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class Outbox:
+    def __init__(self, global_rate, private_chat_rate, group_chat_rate, max_retries):
+        self.global_rate = global_rate
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.max_retries = max_retries
+        self.metrics = Counter()
+        self._seq = itertools.count()
+        self._queue = None
+        self._worker = None
+        self._in_flight = set()
+        self._deferred = 0   # پیام‌هایی که با call_later برای ارسال بعدی کنار گذاشته شده‌اند
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._chat_rates = {}   # سقف اختصاصی برخی چت‌ها به جای private_chat_rate / group_chat_rate
+        self._paused_until = 0.0
+        self._latency_total = 0.0
+
+    def set_rates(self, global_rate, private_chat_rate, group_chat_rate, chat_rates=None):
+        """سقف‌ها را عوض می‌کند، مثلا برای تقسیم سهمیه ربات بین پروسه‌های worker.
+
+        chat_rates سقف جداگانه برای چت‌هایی است که همه worker ها به آن‌ها پیام می‌دهند (مثل چت خصوصی ادمین)؛
+        bucket این چت‌ها ظرفیت ۱ دارد تا جمع انفجار ارسال worker ها هم از سقف تلگرام بیشتر نشود."""
+        self.global_rate = global_rate
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self._chat_rates = dict(chat_rates or {})
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.PriorityQueue()
+            self._worker = asyncio.get_running_loop().create_task(self._run(), name="outbox")
+
+    def submit(self, method, *, chat_id, priority=USER, **kwargs):
+        """method (مثلا bot.send_message) را با chat_id و kwargs در صف می‌گذارد و یک Future برمی‌گرداند."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Job(priority, next(self._seq), method, chat_id, kwargs, future))
+        self.metrics["queued"] += 1
+        self.metrics[f"queued_priority_{priority}"] += 1
+        return future
+
+    async def send(self, method, *, chat_id, priority=USER, **kwargs):
+        return await self.submit(method, chat_id=chat_id, priority=priority, **kwargs)
+
+    def post(self, method, *, chat_id, priority=USER, **kwargs):
+        """مثل submit ولی بدون انتظار برای نتیجه؛ خطا فقط لاگ می‌شود."""
+        future = self.submit(method, chat_id=chat_id, priority=priority, **kwargs)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._prune_chat_buckets()
+            if chat_id in self._chat_rates:
+                bucket = TokenBucket(self._chat_rates[chat_id], 1)
+            elif int(chat_id) < 0:
+                bucket = TokenBucket(self.group_chat_rate, 3)
+            else:
+                bucket = TokenBucket(self.private_chat_rate, 3)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.wait_time(now) == 0 and bucket.tokens >= bucket.capacity]:
+            del self._chats[chat_id]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            now = time.monotonic()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                now = time.monotonic()
+
+            chat_bucket = self._chat_bucket(job.chat_id)
+            chat_wait = chat_bucket.wait_time(now)
+            if chat_wait > 0:
+                # این چت به سقف رسیده؛ پیام کنار گذاشته می‌شود تا پیام‌های چت‌های دیگر معطل نمانند
+                self.metrics["deferred"] += 1
+                self._defer(chat_wait, job)
+                continue
+
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                self.metrics["global_throttled"] += 1
+                await asyncio.sleep(global_wait)
+                self._global.wait_time(time.monotonic())
+            self._global.take()
+            chat_bucket.take()
+
+            task = loop.create_task(self._deliver(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    def _defer(self, delay, job):
+        self._deferred += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue, job)
+
+    def _requeue(self, job):
+        self._deferred -= 1
+        self._queue.put_nowait(job)
+
+    async def _deliver(self, job):
+        try:
+            result = await job.method(chat_id=job.chat_id, **job.kwargs)
+        except RetryAfter as error:
+            delay = _seconds(error.retry_after)
+            self.metrics["retry_after"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            if job.attempts < self.max_retries:
+                job.attempts += 1
+                self._defer(delay, job)
+                return
+            self.metrics["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        except Exception as error:
+            self.metrics["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            self.metrics["sent"] += 1
+            self._latency_total += time.monotonic() - job.queued_at
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats["queue_size"] = self._queue.qsize() if self._queue else 0
+        stats["in_flight"] = len(self._in_flight)
+        stats["deferred_pending"] = self._deferred
+        stats["avg_latency_ms"] = round(self._latency_total / self.metrics["sent"] * 1000, 1) if self.metrics["sent"] else 0.0
+        return stats
+
+    async def stop(self, timeout=10):
+        """تا timeout ثانیه برای ارسال همه پیام‌ها (در صف، در حال ارسال یا کنار گذاشته‌شده برای محدودیت نرخ
+        و RetryAfter) صبر می‌کند و سپس worker را متوقف می‌کند؛ پیام‌های باقی‌مانده لاگ می‌شوند."""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (not self._queue.empty() or self._in_flight or self._deferred) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        remaining = self._queue.qsize() + len(self._in_flight) + self._deferred
+        if remaining:
+            logger.warning("Outbox stopped after %ss with %d messages not sent", timeout, remaining)
+        self._worker.cancel()
+        self._worker = None
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Outbound message failed: %s", future.exception())
+
+
+_outbox = Outbox(config.OUTBOX_GLOBAL_RATE, config.OUTBOX_PRIVATE_CHAT_RATE, config.OUTBOX_GROUP_CHAT_RATE, config.OUTBOX_MAX_RETRIES)
+
+submit = _outbox.submit
+send = _outbox.send
+post = _outbox.post
+stats = _outbox.stats
+stop = _outbox.stop
+set_rates = _outbox.set_rates
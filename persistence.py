@@ -0,0 +1,143 @@
+"""ذخیره‌سازی وضعیت مکالمه‌ها و user_data/chat_data/bot_data در store.db.
+
+- بارگذاری تنبل: user_data و chat_data هر کاربر/چت در اولین آپدیت او (refresh_*) خوانده می‌شود
+  و در استارت‌آپ چیزی جز bot_data و مکالمه‌های در جریان بارگذاری نمی‌شود.
+- ردیابی تغییرات: هر داده pickle می‌شود و فقط اگر با آخرین نسخه نوشته‌شده فرق داشته باشد
+  کثیف (dirty) علامت می‌خورد.
+- نوشتن دسته‌ای: تغییرات جمع می‌شوند و چند لحظه پس از هر دور update_persistence در
+  Application (هر PERSISTENCE_UPDATE_INTERVAL ثانیه) و در خاموش شدن در یک تراکنش نوشته می‌شوند.
+"""
+import asyncio
+import json
+import logging
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+USER, CHAT, BOT = "user", "chat", "bot"
+
+# مکث کوتاه برای جمع کردن همه update_* های یک دور در یک تراکنش
+_COALESCE_DELAY = 1.0
+
+
+def _dumps(data):
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=60):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._loaded = set()              # (kind, key) هایی که از پایگاه داده خوانده شده‌اند
+        self._written = {}                # (kind, key) یا (name, key) -> hash آخرین نسخه نوشته‌شده
+        self._dirty_data = {}             # (kind, key) -> bytes یا None برای حذف
+        self._dirty_conversations = {}    # (name, key) -> bytes یا None برای حذف
+        self._flush_task = None
+
+    # --- بارگذاری ---
+    async def _load(self, kind, key):
+        blob = await db.run(db.get_persisted_data, kind, key)
+        self._loaded.add((kind, key))
+        if blob is None:
+            return None
+        self._written[(kind, key)] = hash(blob)
+        return pickle.loads(blob)
+
+    async def get_bot_data(self):
+        return await self._load(BOT, "") or {}
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        conversations = {}
+        for key, state in await db.run(db.get_persisted_conversations, name):
+            conversations[tuple(json.loads(key))] = pickle.loads(state)
+            self._written[(name, key)] = hash(state)
+        return conversations
+
+    async def refresh_user_data(self, user_id, user_data):
+        if (USER, str(user_id)) not in self._loaded:
+            stored = await self._load(USER, str(user_id))
+            if stored:
+                user_data.update(stored)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        if (CHAT, str(chat_id)) not in self._loaded:
+            stored = await self._load(CHAT, str(chat_id))
+            if stored:
+                chat_data.update(stored)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- ثبت تغییرات ---
+    def _mark(self, dirty, slot, blob):
+        digest = hash(blob) if blob is not None else None
+        if self._written.get(slot) == digest and slot not in dirty:
+            return
+        dirty[slot] = blob
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def update_user_data(self, user_id, data):
+        self._mark(self._dirty_data, (USER, str(user_id)), _dumps(data) if data else None)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark(self._dirty_data, (CHAT, str(chat_id)), _dumps(data) if data else None)
+
+    async def update_bot_data(self, data):
+        self._mark(self._dirty_data, (BOT, ""), _dumps(data) if data else None)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(self._dirty_conversations, (name, json.dumps(list(key))), _dumps(new_state) if new_state is not None else None)
+
+    async def drop_user_data(self, user_id):
+        self._mark(self._dirty_data, (USER, str(user_id)), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark(self._dirty_data, (CHAT, str(chat_id)), None)
+
+    # --- نوشتن ---
+    async def _flush_soon(self):
+        await asyncio.sleep(_COALESCE_DELAY)
+        try:
+            await self._write_dirty()
+        except Exception:
+            logger.exception("Failed to write persistence batch")
+
+    async def _write_dirty(self):
+        if not self._dirty_data and not self._dirty_conversations:
+            return
+        data, self._dirty_data = self._dirty_data, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        try:
+            await db.run(db.save_persistence_batch,
+                         [(kind, key, blob) for (kind, key), blob in data.items()],
+                         [(name, key, blob) for (name, key), blob in conversations.items()])
+        except Exception:
+            # تغییرات جدیدتر همین فاصله نباید بازنویسی شوند
+            for slot, blob in data.items():
+                self._dirty_data.setdefault(slot, blob)
+            for slot, blob in conversations.items():
+                self._dirty_conversations.setdefault(slot, blob)
+            raise
+        for slot, blob in {**data, **conversations}.items():
+            self._written[slot] = hash(blob) if blob is not None else None
+
+    async def flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._write_dirty()
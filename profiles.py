@@ -0,0 +1,59 @@
+"""کش write-behind پروفایل کاربران (نام و یوزرنیم).
+
+نام و یوزرنیم کاربران تقریبا هیچ‌وقت عوض نمی‌شوند؛ به‌جای نوشتن در هر /start و هر بار باز شدن منو،
+فقط تغییرات واقعی در حافظه جمع می‌شوند و به‌صورت دوره‌ای (JobQueue) و در زمان خاموش شدن ربات
+در یک تراکنش executemany نوشته می‌شوند. پروفایل ذخیره‌شده فقط برای PROFILE_CACHE_USERS کاربر اخیر
+در حافظه می‌ماند.
+"""
+import logging
+from collections import OrderedDict
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+_stored = OrderedDict()   # user_id -> (first_name, username) همان‌طور که در پایگاه داده است، به ترتیب استفاده
+_pending = {}             # user_id -> (first_name, username) در انتظار نوشتن
+
+def _remember(user_id, profile):
+    _stored[user_id] = profile
+    _stored.move_to_end(user_id)
+    while len(_stored) > config.PROFILE_CACHE_USERS:
+        _stored.popitem(last=False)
+
+async def touch(user):
+    """پروفایل کاربر را ثبت می‌کند؛ فقط کاربر جدید بلافاصله نوشته می‌شود."""
+    profile = (user.first_name, user.username)
+    if user.id in _stored:
+        _stored.move_to_end(user.id)
+    if _pending.get(user.id, _stored.get(user.id)) == profile:
+        return
+    if user.id not in _stored and user.id not in _pending:
+        stored = await db.run(db.get_user_profile, user.id)
+        if stored is None:
+            # ردیف کاربر جدید باید همین حالا وجود داشته باشد (مثلا برای ثبت معرف در /start)
+            await db.run(db.add_or_update_user, user.id, *profile)
+            _remember(user.id, profile)
+            return
+        _remember(user.id, stored)
+        if stored == profile:
+            return
+    _pending[user.id] = profile
+
+async def flush(context=None):
+    """تغییرات در انتظار را یکجا می‌نویسد؛ هم به‌عنوان job دوره‌ای و هم در خاموش شدن استفاده می‌شود."""
+    global _pending
+    if not _pending:
+        return
+    batch, _pending = _pending, {}
+    try:
+        await db.run(db.upsert_user_profiles, [(user_id, first_name, username) for user_id, (first_name, username) in batch.items()])
+    except Exception:
+        logger.exception("Failed to flush %d user profiles", len(batch))
+        # تغییرات جدیدتری که در این فاصله رسیده‌اند نباید بازنویسی شوند
+        for user_id, profile in batch.items():
+            _pending.setdefault(user_id, profile)
+        return
+    for user_id, profile in batch.items():
+        _remember(user_id, profile)
@@ -0,0 +1,91 @@
+"""صفحه‌بندی و کش صفحه‌های «خریدهای من».
+
+لینک‌های فعال هر کاربر با صفحه‌بندی keyset (id > آخرین id صفحه قبل) خوانده می‌شوند، پس هزینه هر
+صفحه به تعداد کل خریدها بستگی ندارد و متن هیچ صفحه‌ای از سقف طول پیام تلگرام بیشتر نمی‌شود.
+صفحه‌های رندرشده برای PURCHASES_CACHE_USERS کاربر اخیر نگه داشته می‌شوند و با اضافه یا غیرفعال شدن
+لینک‌های کاربر (save_user_link و موتور انقضا) با invalidate پاک می‌شوند.
+"""
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import MessageLimit
+
+import config
+import database as db
+
+_HEADER = "📄 **لیست سرویس‌های فعال شما:**\n\n"
+_EMPTY = "شما تاکنون هیچ خرید فعالی نداشته‌اید."
+
+_pages = OrderedDict()   # user_id -> {(direction, cursor): (text, reply_markup)}
+_generation = 0          # با هر invalidate زیاد می‌شود تا صفحه‌ای که هم‌زمان خوانده شده کش نشود
+
+def _entry(product_name, link, purchase_date):
+    return f"🔹 **{product_name}** (خرید: {purchase_date})\n`{link}`\n\n"
+
+def _fit(rows):
+    """تا جایی که طول پیام اجازه می‌دهد (حداکثر PURCHASES_PAGE_SIZE) ردیف‌ها را به همان ترتیب برمی‌گرداند."""
+    length = len(_HEADER)
+    shown = []
+    for row in rows[:config.PURCHASES_PAGE_SIZE]:
+        length += len(_entry(*row[1:]))
+        if shown and length > MessageLimit.MAX_TEXT_LENGTH:
+            break
+        shown.append(row)
+    return shown
+
+async def _render(user_id, direction, cursor):
+    fetch = config.PURCHASES_PAGE_SIZE + 1
+    rows = []
+    if direction == "prev":
+        rows = await db.run(db.get_user_links_page, user_id, before_id=cursor, limit=fetch)
+        shown = _fit(rows)
+        has_prev, has_next = len(rows) > len(shown), True
+        shown.reverse()
+    elif direction == "next":
+        rows = await db.run(db.get_user_links_page, user_id, after_id=cursor, limit=fetch)
+        shown = _fit(rows)
+        has_prev, has_next = True, len(rows) > len(shown)
+    if not rows:
+        # صفحه اول، یا لینک‌های آن سمت در این فاصله غیرفعال شده‌اند
+        rows = await db.run(db.get_user_links_page, user_id, limit=fetch)
+        shown = _fit(rows)
+        has_prev, has_next = False, len(rows) > len(shown)
+
+    keyboard = []
+    if shown:
+        text = _HEADER + "".join(_entry(*row[1:]) for row in shown)
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"my_purchases_prev_{shown[0][0]}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"my_purchases_next_{shown[-1][0]}"))
+        if navigation:
+            keyboard.append(navigation)
+    else:
+        text = _EMPTY
+    keyboard.append([InlineKeyboardButton("⬅️ بازگشت به داشبورد", callback_data="back_to_home")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def page(user_id, direction=None, cursor=None):
+    """(text, reply_markup) صفحه اول، یا صفحه بعد ("next") یا قبل ("prev") از لینک با id برابر cursor."""
+    if direction not in ("next", "prev") or cursor is None:
+        direction = cursor = None
+    key = (direction, cursor)
+    user_pages = _pages.get(user_id)
+    if user_pages is not None and key in user_pages:
+        _pages.move_to_end(user_id)
+        return user_pages[key]
+    generation = _generation
+    view = await _render(user_id, direction, cursor)
+    if generation == _generation:
+        _pages.setdefault(user_id, {})[key] = view
+        _pages.move_to_end(user_id)
+        while len(_pages) > config.PURCHASES_CACHE_USERS:
+            _pages.popitem(last=False)
+    return view
+
+def invalidate(*user_ids):
+    global _generation
+    _generation += 1
+    for user_id in user_ids:
+        _pages.pop(user_id, None)
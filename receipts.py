@@ -0,0 +1,171 @@
+"""تشخیص رسیدهای تکراری با hash ادراکی.
+
+برای هر عکس رسید دو hash ۶۴ بیتی (dHash و pHash) در یک ProcessPoolExecutor جداگانه حساب
+می‌شود و در ReceiptIndex، که hash ها را در آرایه‌های NumPy نگه می‌دارد، با همه رسیدهای قبلی
+مقایسه می‌شود؛ فاصله همینگ برای کل آرایه یکجا (xor و bitwise_count) محاسبه می‌شود، پس جستجو در
+صدها هزار رسید چند میلی‌ثانیه طول می‌کشد. رسیدهایی که هر دو hash آن‌ها نزدیک باشند در کپشن
+ادمین علامت می‌خورند. hash ها در جدول receipt_hashes هم ذخیره می‌شوند و در حالت چند پروسه‌ای با
+events.py به index بقیه worker ها اضافه می‌شوند.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import config
+import database as db
+import events
+
+logger = logging.getLogger(__name__)
+
+# کوچک‌ترین اندازه عکس که برای hash دانلود می‌شود؛ hash ها روی تصویر ۳۲×۳۲ حساب می‌شوند
+HASH_SOURCE_SIZE = 256
+
+_pool = None
+_index = None
+_loading = None
+
+# ==================================
+# === محاسبه hash (در پروسه جداگانه) ===
+# ==================================
+def _dct_matrix(size):
+    k = np.arange(size).reshape(-1, 1)
+    n = np.arange(size).reshape(1, -1)
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+_DCT_32 = _dct_matrix(32)
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.reshape(-1)).tobytes(), "big")
+
+def compute_hashes(data):
+    """(dhash, phash) تصویر را به‌صورت دو عدد صحیح بدون علامت ۶۴ بیتی برمی‌گرداند."""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data)).convert("L")
+    small = np.asarray(image.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    dhash = _bits_to_int(small[:, 1:] > small[:, :-1])
+
+    pixels = np.asarray(image.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8].reshape(-1)
+    # مولفه DC فقط روشنایی کلی است و در میانه حساب نمی‌شود
+    phash = _bits_to_int(low > np.median(low[1:]))
+    return dhash, phash
+
+def _to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+# ==================================
+# === index ===
+# ==================================
+class ReceiptIndex:
+    """hash های همه رسیدها در آرایه‌های پیوسته NumPy که با دو برابر شدن ظرفیت رشد می‌کنند."""
+
+    def __init__(self, capacity=1024):
+        self._size = 0
+        self._dhash = np.empty(capacity, dtype=np.uint64)
+        self._phash = np.empty(capacity, dtype=np.uint64)
+        self._owners = np.empty((capacity, 2), dtype=np.int64)   # (transaction_id, user_id)
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def from_rows(cls, rows):
+        """rows: (transaction_id, user_id, dhash, phash) همان‌طور که در پایگاه داده ذخیره شده‌اند."""
+        index = cls(max(1024, len(rows)))
+        if rows:
+            table = np.array(rows, dtype=np.int64)
+            index._owners[:len(rows)] = table[:, :2]
+            index._dhash[:len(rows)] = table[:, 2].view(np.uint64)
+            index._phash[:len(rows)] = table[:, 3].view(np.uint64)
+            index._size = len(rows)
+        return index
+
+    def add(self, transaction_id, user_id, dhash, phash):
+        if self._size == len(self._dhash):
+            capacity = 2 * len(self._dhash)
+            self._dhash = np.resize(self._dhash, capacity)
+            self._phash = np.resize(self._phash, capacity)
+            self._owners = np.resize(self._owners, (capacity, 2))
+        self._dhash[self._size] = dhash
+        self._phash[self._size] = phash
+        self._owners[self._size] = (transaction_id, user_id)
+        self._size += 1
+
+    def search(self, dhash, phash, dhash_threshold, phash_threshold, limit=5):
+        """رسیدهایی که فاصله هر دو hash آن‌ها در آستانه است: لیست (transaction_id, user_id, فاصله dhash, فاصله phash)."""
+        if not self._size:
+            return []
+        d_distance = np.bitwise_count(self._dhash[:self._size] ^ np.uint64(dhash))
+        p_distance = np.bitwise_count(self._phash[:self._size] ^ np.uint64(phash))
+        matches = np.flatnonzero((d_distance <= dhash_threshold) & (p_distance <= phash_threshold))
+        if not len(matches):
+            return []
+        matches = matches[np.argsort(d_distance[matches].astype(np.int32) + p_distance[matches], kind="stable")[:limit]]
+        return [(int(self._owners[i, 0]), int(self._owners[i, 1]), int(d_distance[i]), int(p_distance[i])) for i in matches]
+
+# ==================================
+# === API ربات ===
+# ==================================
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=config.RECEIPT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+async def _ensure_loaded():
+    global _index, _loading
+    if _index is not None:
+        return
+    if _loading is None:
+        _loading = asyncio.ensure_future(db.run(db.get_receipt_hashes))
+    try:
+        rows = await _loading
+    except Exception:
+        _loading = None
+        raise
+    if _index is None:
+        _index = ReceiptIndex.from_rows(rows)
+
+def _pick_photo(photo_sizes):
+    """کوچک‌ترین اندازه‌ای که برای hash کافی است (یا بزرگ‌ترین اگر هیچ‌کدام نبود)."""
+    for size in photo_sizes:
+        if min(size.width, size.height) >= HASH_SOURCE_SIZE:
+            return size
+    return photo_sizes[-1]
+
+async def check_and_record(bot, photo_sizes, transaction_id, user_id):
+    """hash رسید را ثبت می‌کند و رسیدهای مشابه قبلی را برمی‌گرداند؛ خطاها فقط لاگ می‌شوند و خروجی [] است."""
+    try:
+        telegram_file = await bot.get_file(_pick_photo(photo_sizes).file_id)
+        data = bytes(await telegram_file.download_as_bytearray())
+        loop = asyncio.get_running_loop()
+        dhash, phash = await loop.run_in_executor(_get_pool(), compute_hashes, data)
+        await _ensure_loaded()
+    except Exception as exc:
+        logger.warning("Could not hash receipt of transaction %s: %r", transaction_id, exc)
+        return []
+    # جستجو و افزودن بدون await بینشان، تا دو رسید هم‌زمان یکسان هم همدیگر را ببینند
+    matches = [match for match in _index.search(dhash, phash, config.RECEIPT_DHASH_THRESHOLD, config.RECEIPT_PHASH_THRESHOLD) if match[0] != int(transaction_id)]
+    _index.add(int(transaction_id), user_id, dhash, phash)
+    try:
+        await db.run(db.save_receipt_hash, transaction_id, user_id, _to_signed(dhash), _to_signed(phash))
+        events.publish("receipt", (int(transaction_id), user_id, dhash, phash))
+    except Exception:
+        logger.exception("Failed to store receipt hash of transaction %s", transaction_id)
+    return matches
+
+def add_remote(payload):
+    """رسیدی که worker دیگری ثبت کرده است (events.py)."""
+    if _index is not None:
+        _index.add(*payload)
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """یک پایگاه داده تازه با همه مهاجرت‌ها؛ اتصال ترد اصلی در پایان بسته می‌شود."""
+    monkeypatch.setattr(db, "DATABASE_NAME", str(tmp_path / "test.db"))
+    db._link_reserves.clear()
+    db.setup_database()
+    yield db
+    db.close_connection()
+    db._link_reserves.clear()
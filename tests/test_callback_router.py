@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telegram import Update
+
+from callback_router import CallbackRouteHandler, CallbackRouter
+from tools.fakebot import make_callback
+
+
+async def _select_product(update, context, product_id):
+    pass
+
+
+async def _my_purchases(update, context, direction=None, cursor=None):
+    pass
+
+
+ROUTES = {
+    "product_{product_id:int}": _select_product,
+    "my_purchases": _my_purchases,
+    "my_purchases_{direction}_{cursor:int}": _my_purchases,
+}
+
+
+def test_resolves_static_and_parameter_routes():
+    router = CallbackRouter(ROUTES)
+    assert router.resolve("product_12") == (_select_product, {"product_id": 12})
+    assert router.resolve("my_purchases") == (_my_purchases, {})
+    assert router.resolve("my_purchases_next_40") == (_my_purchases, {"direction": "next", "cursor": 40})
+
+
+def test_unknown_or_malformed_data_does_not_match():
+    router = CallbackRouter(ROUTES)
+    for data in ("product", "product_", "product_x", "product_12_3", "my", "support", "my_purchases_next"):
+        assert router.resolve(data) is None, data
+
+
+def test_forged_non_ascii_digits_do_not_match():
+    handler = CallbackRouteHandler(ROUTES)
+    for data in ("product_²", "product_١٢", "my_purchases_next_³"):
+        assert handler.check_update(Update.de_json(make_callback(1, data), None)) is None, data
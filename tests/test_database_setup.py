@@ -0,0 +1,50 @@
+import database as db
+
+
+def _scalar(database, sql):
+    return database.get_connection().execute(sql).fetchone()[0]
+
+
+def test_fresh_database_runs_every_migration_once(database, capsys):
+    assert _scalar(database, "PRAGMA user_version") == len(db.MIGRATIONS)
+    assert _scalar(database, "PRAGMA auto_vacuum") == 2
+    capsys.readouterr()
+
+    database.setup_database()
+
+    assert capsys.readouterr().out == ""
+    assert _scalar(database, "PRAGMA user_version") == len(db.MIGRATIONS)
+
+
+def test_upgrade_moves_pending_rows_with_receipts_to_submitted(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_NAME", str(tmp_path / "old.db"))
+    version = db.MIGRATIONS.index(db._migration_submitted_receipts)
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS[:version])
+    db.setup_database()
+    conn = db.get_connection()
+    conn.executemany("INSERT INTO transactions (user_id, product_id, product_name, price, status, timestamp) VALUES (?, 1, 'plan', 100, 'pending', '2026-01-01 00:00:00')", [(1,), (2,)])
+    conn.execute("INSERT INTO receipt_hashes (transaction_id, user_id, dhash, phash) VALUES (1, 1, 0, 0)")
+    conn.commit()
+
+    monkeypatch.undo()
+    monkeypatch.setattr(db, "DATABASE_NAME", str(tmp_path / "old.db"))
+    try:
+        db.setup_database()
+        assert conn.execute("SELECT id, status FROM transactions ORDER BY id").fetchall() == [(1, 'submitted'), (2, 'pending')]
+        assert _scalar(db, "PRAGMA user_version") == len(db.MIGRATIONS)
+    finally:
+        db.close_connection()
+
+
+def test_compacted_links_cannot_be_added_again(database):
+    assert database.add_links_to_bank(1, ["https://x/1", "https://x/2"]) == (2, 0)
+    assert database.fetch_and_assign_link(1, 10, 0) == "https://x/1"
+
+    assert database.compact_link_bank(100) == 1
+    assert _scalar(database, "SELECT COUNT(*) FROM link_bank_used") == 1
+    assert _scalar(database, "SELECT COUNT(*) FROM link_bank") == 1
+
+    # trigger پایگاه داده لینکی را که قبلا واگذار و منتقل شده دوباره به بانک راه نمی‌دهد
+    assert database.add_links_to_bank(1, ["https://x/1", "https://x/3"]) == (1, 1)
+    assert database.fetch_and_assign_link(1, 11, 0) == "https://x/2"
+    assert database.incremental_vacuum() == 0
@@ -0,0 +1,34 @@
+import threading
+
+import database as db
+
+
+def test_concurrent_redemptions_never_exceed_max_uses(database):
+    assert database.create_discount_code("race", "percent", 10, max_uses=3)
+    barrier = threading.Barrier(12)
+    results = []
+
+    def redeem():
+        barrier.wait()
+        try:
+            results.append(db.validate_and_apply_code("RACE"))
+        finally:
+            db.close_connection()
+
+    threads = [threading.Thread(target=redeem) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    redeemed = [result for result in results if result is not None]
+    assert len(redeemed) == 3
+    assert sorted(result["current_uses"] for result in redeemed) == [1, 2, 3]
+    assert database.validate_and_apply_code("race") is None
+    assert database.get_connection().execute("SELECT current_uses FROM discount_codes WHERE code_text = 'RACE'").fetchone()[0] == 3
+
+
+def test_expired_or_unknown_codes_are_not_redeemed(database):
+    assert database.create_discount_code("OLD", "fixed", 5000, max_uses=10, expiry_date="2000-01-01")
+    assert database.validate_and_apply_code("OLD") is None
+    assert database.validate_and_apply_code("MISSING") is None
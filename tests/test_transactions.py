@@ -0,0 +1,138 @@
+import threading
+
+import database as db
+
+PRODUCT_ID = 1
+
+
+def _submitted(database, user_id, price=100):
+    transaction_id = database.create_pending_transaction(user_id, PRODUCT_ID, "plan", price)
+    assert database.update_transaction_status(transaction_id, 'submitted', ('pending',))
+    return transaction_id
+
+
+def _count(database, sql, *params):
+    return database.get_connection().execute(sql, params).fetchone()[0]
+
+
+def _in_threads(*calls):
+    """هر فراخوانی روی ترد (و اتصال) خودش، همه با هم شروع می‌شوند."""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(index, func, args):
+        barrier.wait()
+        try:
+            results[index] = func(*args)
+        finally:
+            db.close_connection()
+
+    threads = [threading.Thread(target=run, args=(i, func, args)) for i, (func, *args) in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_double_approve_assigns_one_link(database):
+    database.add_links_to_bank(PRODUCT_ID, ["https://x/1", "https://x/2"])
+    transaction_id = _submitted(database, 1)
+
+    first, second = database.approve_transaction(transaction_id), database.approve_transaction(transaction_id)
+
+    assert first == (1, "plan", PRODUCT_ID, "https://x/1")
+    assert second is None
+    assert _count(database, "SELECT COUNT(*) FROM user_links WHERE transaction_id = ?", transaction_id) == 1
+    assert _count(database, "SELECT approved_count FROM sales_daily") == 1
+
+
+def test_concurrent_approves_assign_one_link(database):
+    database.add_links_to_bank(PRODUCT_ID, [f"https://x/{i}" for i in range(10)])
+    transaction_id = _submitted(database, 1)
+
+    results = _in_threads(*[(database.approve_transaction, transaction_id)] * 4)
+
+    assert sum(result is not None for result in results) == 1
+    assert _count(database, "SELECT COUNT(*) FROM user_links") == 1
+    assert _count(database, "SELECT COUNT(*) FROM link_bank WHERE is_used = 1") == 1
+
+
+def test_reject_after_approve_keeps_approval(database):
+    database.add_links_to_bank(PRODUCT_ID, ["https://x/1"])
+    transaction_id = _submitted(database, 1)
+
+    assert database.approve_transaction(transaction_id) is not None
+    assert not database.update_transaction_status(transaction_id, 'rejected', database.REVIEWABLE_STATUSES)
+
+    assert database.get_transaction_status(transaction_id) == 'approved'
+    assert database.get_sales_daily("2000-01-01")[0][2:] == (1, 100, 0)
+
+
+def test_approve_after_reject_is_refused(database):
+    database.add_links_to_bank(PRODUCT_ID, ["https://x/1"])
+    transaction_id = _submitted(database, 1)
+
+    assert database.update_transaction_status(transaction_id, 'rejected', database.REVIEWABLE_STATUSES)
+    assert database.approve_transaction(transaction_id) is None
+
+    assert database.get_transaction_status(transaction_id) == 'rejected'
+    assert _count(database, "SELECT COUNT(*) FROM link_bank WHERE is_used = 1") == 0
+    assert database.get_sales_daily("2000-01-01")[0][2:] == (0, 0, 1)
+
+
+def test_approve_without_stock_leaves_transaction_reviewable(database):
+    transaction_id = _submitted(database, 1)
+
+    assert database.approve_transaction(transaction_id) == (1, "plan", PRODUCT_ID, None)
+    assert database.get_transaction_status(transaction_id) == 'submitted'
+    assert database.get_sales_daily("2000-01-01") == []
+
+
+def test_expired_transaction_can_still_be_approved(database):
+    database.add_links_to_bank(PRODUCT_ID, ["https://x/1"])
+    transaction_id = database.create_pending_transaction(1, PRODUCT_ID, "plan", 100)
+    assert database.expire_pending_transactions("9999-01-01", 10) == 1
+
+    assert database.approve_transaction(transaction_id)[3] == "https://x/1"
+
+
+def test_bulk_and_single_approval_race_assigns_each_transaction_once(database):
+    database.add_links_to_bank(PRODUCT_ID, [f"https://x/{i}" for i in range(100)])
+    transaction_ids = [_submitted(database, user_id) for user_id in range(1, 21)]
+
+    _in_threads((database.approve_transactions_bulk,), *[(database.approve_transaction, transaction_id) for transaction_id in transaction_ids[::2]])
+
+    assert _count(database, "SELECT COUNT(*) FROM transactions WHERE status = 'approved'") == 20
+    assert _count(database, "SELECT COUNT(*) FROM user_links") == 20
+    assert _count(database, "SELECT COUNT(DISTINCT transaction_id) FROM user_links") == 20
+    assert _count(database, "SELECT COUNT(*) FROM link_bank WHERE is_used = 1") == 20
+    assert _count(database, "SELECT approved_count FROM sales_daily") == 20
+
+
+def test_bulk_approval_only_marks_referred_buyers(database):
+    database.add_links_to_bank(PRODUCT_ID, [f"https://x/{i}" for i in range(10)])
+    for user_id in (1, 2, 3):
+        database.add_or_update_user(user_id, "u", None)
+    database.update_user_referrer(2, 3)
+    _submitted(database, 1)
+    _submitted(database, 2)
+
+    database.approve_transactions_bulk()
+
+    assert database.get_user_info(1)[1] == 0
+    assert database.get_user_info(2)[1] == 1
+    # ثبت معرف بعد از خرید، خرید قبلی را به حساب معرف نمی‌گذارد
+    database.update_user_referrer(1, 3)
+    assert _count(database, "SELECT successful_referrals FROM users WHERE user_id = 3") == 1
+
+
+def test_bulk_approval_without_enough_links_keeps_the_rest_submitted(database):
+    database.add_links_to_bank(PRODUCT_ID, ["https://x/1", "https://x/2"])
+    transaction_ids = [_submitted(database, user_id) for user_id in (1, 2, 3)]
+
+    result = database.approve_transactions_bulk()
+
+    assert [row[0] for row in result["approved"]] == transaction_ids[:2]
+    assert result["missing_links"] == {"plan": 1}
+    assert database.get_transaction_status(transaction_ids[2]) == 'submitted'
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telegram import Update
+
+from tools.fakebot import make_callback
+from update_processor import PerUserUpdateProcessor
+
+
+def _update(user_id):
+    return Update.de_json(make_callback(user_id, "go_to_purchase"), None)
+
+
+def test_queued_updates_of_one_user_do_not_block_other_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(4)
+        finished = {}
+
+        async def work(name, seconds):
+            await asyncio.sleep(seconds)
+            finished[name] = time.perf_counter()
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(processor.process_update(_update(1), work(f"a{i}", 0.1))) for i in range(4)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(processor.process_update(_update(2), work("b", 0.01))))
+        await asyncio.gather(*tasks)
+        return start, finished
+
+    start, finished = asyncio.run(scenario())
+    assert finished["b"] - start < 0.08
+    # آپدیت‌های یک کاربر به ترتیب و پشت سر هم اجرا می‌شوند
+    assert finished["a0"] < finished["a1"] < finished["a2"] < finished["a3"]
+    assert finished["a3"] - start >= 0.4
+
+
+def test_concurrency_cap_applies_across_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        running = peak = 0
+
+        async def work():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(_update(user_id), work()) for user_id in range(6)))
+        return peak, processor.current_concurrent_updates
+
+    peak, current = asyncio.run(scenario())
+    assert peak == 2
+    assert current == 0
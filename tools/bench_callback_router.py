@@ -0,0 +1,107 @@
+"""مقایسه یافتن هندلر دکمه‌ها با زنجیره CallbackQueryHandler های regex و با CallbackRouteHandler.
+
+همه الگوهای callback_data ربات یک بار به روش قبلی (یک CallbackQueryHandler برای هر الگو، به ترتیب
+ثبت در main.py، و خواندن id با split داخل هندلر) و یک بار در یک CallbackRouteHandler ثبت می‌شوند.
+برای ترکیبی از callback_data های واقعی، زمان check_update تا پیدا شدن هندلر منطبق و استخراج
+پارامترها اندازه گرفته می‌شود؛ ارسال به تلگرام و پایگاه داده در این زمان نیست.
+
+اجرا از ریشه پروژه:
+    python tools/bench_callback_router.py --updates 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telegram import Update
+from telegram.ext import CallbackQueryHandler
+
+from callback_router import CallbackRouteHandler
+from tools.fakebot import make_callback
+
+
+async def _noop(update, context, **kwargs):
+    pass
+
+# (الگوی regex قبلی، الگوی router) به ترتیب ثبت در main.py
+ROUTES = [
+    (r"^go_to_purchase$", "go_to_purchase"),
+    (r"^product_\d+$", "product_{product_id:int}"),
+    (r"^confirm_payment_info$", "confirm_payment_info"),
+    (r"^apply_discount_code$", "apply_discount_code"),
+    (r"^back_to_products$", "back_to_products"),
+    (r"^cancel_purchase$", "cancel_purchase"),
+    (r"^linkprod_\d+$", "linkprod_{product_id:int}"),
+    (r"^cancel_addlink$", "cancel_addlink"),
+    (r"^admin_reject_\d+$", "admin_reject_{transaction_id:int}"),
+    (r"^support$", "support"),
+    (r"^cancel_support$", "cancel_support"),
+    (r"^admin_approve_\d+$", "admin_approve_{transaction_id:int}"),
+    (r"^my_purchases$", "my_purchases"),
+    (r"^my_purchases_(next|prev)_\d+$", "my_purchases_{direction}_{cursor:int}"),
+    (r"^back_to_home$", "back_to_home"),
+    (r"^referral$", "referral"),
+]
+
+# callback_data با وزن تقریبی تکرارشان در ترافیک ربات
+MIX = [
+    ("go_to_purchase", 10), ("product_{n}", 20), ("confirm_payment_info", 8), ("apply_discount_code", 4),
+    ("back_to_products", 2), ("cancel_purchase", 2), ("admin_approve_{n}", 8), ("admin_reject_{n}", 1),
+    ("support", 2), ("cancel_support", 1), ("my_purchases", 10), ("my_purchases_next_{n}", 4),
+    ("my_purchases_prev_{n}", 2), ("back_to_home", 15), ("referral", 5), ("unknown_button", 1),
+]
+
+
+def _parse_id(data):
+    # همان کاری که هندلرها پیش از router با query.data می‌کردند
+    return int(data.split("_")[-1])
+
+
+def regex_chain(updates):
+    handlers = [CallbackQueryHandler(_noop, pattern=pattern) for pattern, _ in ROUTES]
+    start = time.perf_counter()
+    matched = 0
+    for update in updates:
+        for handler in handlers:
+            if handler.check_update(update):
+                data = update.callback_query.data
+                if data[-1].isdigit():
+                    _parse_id(data)
+                matched += 1
+                break
+    return time.perf_counter() - start, matched
+
+
+def router(updates):
+    handler = CallbackRouteHandler({pattern: _noop for _, pattern in ROUTES})
+    start = time.perf_counter()
+    matched = 0
+    for update in updates:
+        if handler.check_update(update):
+            matched += 1
+    return time.perf_counter() - start, matched
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    templates, weights = zip(*MIX)
+    updates = [Update.de_json(make_callback(10_000_000 + i % 5000, template.format(n=rng.randint(1, 500_000))), None)
+               for i, template in enumerate(rng.choices(templates, weights, k=args.updates))]
+
+    print(f"{'handler':>14}{'total s':>10}{'us/update':>12}{'matched':>10}")
+    baseline = None
+    for name, bench in (("regex chain", regex_chain), ("router", router)):
+        elapsed, matched = bench(updates)
+        baseline = baseline or elapsed
+        print(f"{name:>14}{elapsed:>10.3f}{elapsed / len(updates) * 1e6:>12.2f}{matched:>10}   x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""مقایسه تأخیر هر فراخوانی پایگاه داده: اتصال تازه در هر فراخوانی در برابر اتصال ماندگار.
+
+اجرا از ریشه پروژه:
+    python tools/bench_db_connections.py --calls 5000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db
+
+
+def connect_per_call_user_info(user_id):
+    # همان الگوی قدیمی: اتصال، کوئری و بستن در هر فراخوانی
+    conn = sqlite3.connect(db.DATABASE_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT referred_by_user_id, first_purchase_completed, referral_rewards_claimed FROM users WHERE user_id = ?", (user_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+
+def connect_per_call_upsert(user_id, first_name, username):
+    conn = sqlite3.connect(db.DATABASE_NAME)
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO users (user_id, first_name, username) VALUES (?, ?, ?)", (user_id, first_name, username))
+    cursor.execute("UPDATE users SET first_name = ?, username = ? WHERE user_id = ?", (first_name, username, user_id))
+    conn.commit()
+    conn.close()
+
+
+def measure(label, func, calls, users):
+    start = time.perf_counter()
+    for i in range(calls):
+        uid = i % users
+        func(uid)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / calls * 1e6:9.1f} µs/call")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATABASE_NAME = os.path.join(tmp, "bench.db")
+        db.setup_database()
+        for uid in range(args.users):
+            db.add_or_update_user(uid, f"user{uid}", None)
+
+        old_read = measure("get_user_info (connect per call)", connect_per_call_user_info, args.calls, args.users)
+        new_read = measure("get_user_info (persistent)", db.get_user_info, args.calls, args.users)
+        old_write = measure("add_or_update_user (connect per call)", lambda u: connect_per_call_upsert(u, f"user{u}", None), args.calls, args.users)
+        new_write = measure("add_or_update_user (persistent)", lambda u: db.add_or_update_user(u, f"user{u}", None), args.calls, args.users)
+        db.close_connection()
+
+    print(f"\nread speedup:  {old_read / new_read:.1f}x")
+    print(f"write speedup: {old_write / new_write:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
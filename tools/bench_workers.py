@@ -0,0 +1,100 @@
+"""مقایسه توان عملیاتی حالت چند پروسه‌ای (cluster.py) با ۱ و N worker در برابر Bot API جعلی.
+
+برای هر تعداد worker یک کپی تازه از پایگاه داده آماده‌شده ساخته می‌شود، پروسه‌ها بالا می‌آیند و
+سپس آپدیت‌های فرآیند خرید کاربران مصنوعی (مثل tools/loadtest.py) از پروسه اصلی پخش می‌شوند. زمان
+از ارسال اولین آپدیت تا پردازش همه آن‌ها و خروج worker ها (شامل نوشتن نهایی وضعیت‌ها) اندازه
+گرفته می‌شود.
+
+اجرا از ریشه پروژه:
+    python tools/bench_workers.py --users 2000 --workers 1 4
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import catalog
+import database as db
+from cluster import Cluster
+from telegram import Update
+from tools.fakebot import FakeTelegramRequest, make_callback, make_command, make_photo, make_text
+
+DISCOUNT_CODE = "BENCH"
+
+# سقف نرخ تلگرام و endpoint متریک در این بنچمارک معنی ندارند
+SETTINGS = {"OUTBOX_GLOBAL_RATE": 1_000_000, "OUTBOX_PRIVATE_CHAT_RATE": 1_000_000, "OUTBOX_GROUP_CHAT_RATE": 1_000_000,
+            "METRICS_PORT": 0}
+
+
+def prepare_database(path, users):
+    db.DATABASE_NAME = path
+    db.setup_database()
+    catalog.load()
+    for product_id, _, _ in catalog.get_products():
+        db.add_links_to_bank(product_id, (f"https://example.com/{product_id}/{i}" for i in range(users)))
+    db.create_discount_code(DISCOUNT_CODE, "percent", 10, max_uses=users * 2)
+    db.close_connection()
+
+
+def buyer_updates(users, products):
+    updates = []
+    for i in range(users):
+        user_id = 10_000_000 + i
+        for data in (make_command(user_id, "/start"),
+                     make_callback(user_id, "go_to_purchase"),
+                     make_callback(user_id, f"product_{products[i % len(products)]}"),
+                     make_callback(user_id, "apply_discount_code"),
+                     make_text(user_id, DISCOUNT_CODE),
+                     make_callback(user_id, "confirm_payment_info"),
+                     make_photo(user_id, f"receipt{user_id}")):
+            updates.append(Update.de_json(data, None))
+    return updates
+
+
+def bench(workers, seed_path, tmp, updates, api_latency):
+    path = os.path.join(tmp, f"bench_{workers}.db")
+    shutil.copy(seed_path, path)
+    db.DATABASE_NAME = path
+    cluster = Cluster(workers, token="123456:BENCH", request=(FakeTelegramRequest, {"latency": api_latency}), settings=SETTINGS)
+    started = time.perf_counter()
+    cluster.start()
+    boot = time.perf_counter() - started
+
+    start = time.perf_counter()
+    for update in updates:
+        cluster.dispatch(update)
+    cluster.stop()
+    elapsed = time.perf_counter() - start
+
+    with sqlite3.connect(path) as conn:
+        transactions = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    return boot, elapsed, transactions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 2])
+    parser.add_argument("--api-latency", type=float, default=0.0, help="تأخیر مصنوعی هر فراخوانی Bot API (ثانیه)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_path = os.path.join(tmp, "seed.db")
+        prepare_database(seed_path, args.users)
+        updates = buyer_updates(args.users, [product_id for product_id, _, _ in catalog.get_products()])
+
+        print(f"{'workers':>8}{'boot s':>10}{'run s':>10}{'updates/s':>12}{'transactions':>14}")
+        baseline = None
+        for workers in args.workers:
+            boot, elapsed, transactions = bench(workers, seed_path, tmp, updates, args.api_latency)
+            rate = len(updates) / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>8}{boot:>10.2f}{elapsed:>10.2f}{rate:>12.0f}{transactions:>14}   x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
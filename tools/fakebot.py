@@ -0,0 +1,128 @@
+"""یک جایگزین محلی برای Bot API تلگرام، برای اجرای ربات واقعی بدون شبکه.
+
+FakeTelegramRequest به‌جای HTTPXRequest به Application داده می‌شود و به متدهایی که ربات
+صدا می‌زند پاسخ‌های معتبر می‌دهد؛ همه فراخوانی‌ها در calls ثبت می‌شوند. make_* هم
+آپدیت‌های مصنوعی (JSON) برای تزریق به ربات می‌سازند.
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from telegram.request import BaseRequest
+
+BOT_ID = 7000000001
+BOT_USERNAME = "fake_store_bot"
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _chat(chat_id):
+    chat_id = int(chat_id)
+    if chat_id < 0:
+        return {"id": chat_id, "type": "channel", "title": "admin channel"}
+    return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+
+
+def _message(chat_id, **extra):
+    message = {"message_id": next(_message_ids), "date": int(time.time()), "chat": _chat(chat_id)}
+    message.update(extra)
+    return message
+
+
+class FakeTelegramRequest(BaseRequest):
+    """به درخواست‌های Bot API به‌صورت محلی پاسخ می‌دهد.
+
+    latency: تأخیر مصنوعی هر فراخوانی (ثانیه) برای شبیه‌سازی رفت‌وبرگشت شبکه.
+    """
+
+    def __init__(self, latency=0.0, files=None):
+        self.latency = latency
+        self.files = files if files is not None else {}   # file_id -> bytes
+        self.calls = []                                   # [(method, parameters)]
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "/file/bot" in url:
+            file_id = url.rsplit("/", 1)[-1]
+            return 200, self.files.get(file_id, b"")
+
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params))
+        result = self._result(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _result(self, api_method, params):
+        if api_method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Fake", "username": BOT_USERNAME,
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if api_method in ("sendMessage", "sendDocument", "copyMessage", "forwardMessage"):
+            if api_method == "copyMessage":
+                return {"message_id": next(_message_ids)}
+            return _message(params.get("chat_id"), text=params.get("text", ""))
+        if api_method == "sendPhoto":
+            return _message(params.get("chat_id"), caption=params.get("caption", ""),
+                            photo=[{"file_id": "p", "file_unique_id": "p", "width": 1, "height": 1}])
+        if api_method in ("editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            return _message(params.get("chat_id") or BOT_ID, text=params.get("text", ""))
+        if api_method == "getFile":
+            file_id = params.get("file_id")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_path": f"files/{file_id}",
+                    "file_size": len(self.files.get(file_id, b""))}
+        if api_method == "getUpdates":
+            return []
+        return True
+
+    def count(self, api_method):
+        return sum(1 for method, _ in self.calls if method == api_method)
+
+
+# ==================================
+# === سازنده‌های آپدیت مصنوعی ===
+# ==================================
+def make_user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def make_command(user_id, text):
+    command = text.split()[0]
+    return {"update_id": next(_update_ids),
+            "message": _message(user_id, text=text, **{"from": make_user(user_id)},
+                                entities=[{"type": "bot_command", "offset": 0, "length": len(command)}])}
+
+
+def make_text(user_id, text, chat_id=None):
+    return {"update_id": next(_update_ids),
+            "message": _message(chat_id or user_id, text=text, **{"from": make_user(user_id)})}
+
+
+def make_photo(user_id, file_id="receipt"):
+    photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+    return {"update_id": next(_update_ids),
+            "message": _message(user_id, photo=photo, **{"from": make_user(user_id)})}
+
+
+def make_document(user_id, file_id, file_name, size=0):
+    document = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name, "file_size": size}
+    return {"update_id": next(_update_ids),
+            "message": _message(user_id, document=document, **{"from": make_user(user_id)})}
+
+
+def make_callback(user_id, data, chat_id=None):
+    message = _message(chat_id or user_id, text="menu", **{"from": {"id": BOT_ID, "is_bot": True, "first_name": "Fake"}})
+    return {"update_id": next(_update_ids),
+            "callback_query": {"id": str(next(_update_ids)), "from": make_user(user_id), "chat_instance": str(user_id),
+                               "message": message, "data": data}}
@@ -0,0 +1,176 @@
+"""بنچمارک آفلاین فرآیند خرید: ربات واقعی main.py در برابر Bot API جعلی (tools/fakebot.py).
+
+هزاران کاربر مصنوعی به‌صورت هم‌زمان /start، انتخاب محصول، وارد کردن کد تخفیف، تایید پرداخت و
+ارسال رسید را اجرا می‌کنند و سپس ادمین همه تراکنش‌ها را تایید می‌کند (یکی‌یکی، یا با --bulk-approve
+با یک /approveall). برای هر هندلر p50/p95/p99 تأخیر، تعداد فراخوانی و میانگین زمان پایگاه داده و در پایان توان عملیاتی گزارش می‌شود.
+
+اجرا از ریشه پروژه:
+    python tools/loadtest.py --users 2000 --api-latency 0.02
+"""
+import argparse
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+# سقف نرخ تلگرام در اینجا معنی ندارد مگر اینکه صریحا خواسته شود؛ باید قبل از import صف خروجی تنظیم شود
+if "--respect-rate-limits" not in sys.argv:
+    config.OUTBOX_GLOBAL_RATE = config.OUTBOX_PRIVATE_CHAT_RATE = config.OUTBOX_GROUP_CHAT_RATE = 1_000_000
+
+import catalog
+import database as db
+import handlers as h
+import main as bot_main
+from telegram import Update
+from tools.fakebot import FakeTelegramRequest, make_callback, make_command, make_photo, make_text
+
+DISCOUNT_CODE = "LOADTEST"
+
+_db_time = contextvars.ContextVar("db_time", default=None)
+handler_latency = defaultdict(list)
+handler_db_time = defaultdict(float)
+
+
+def instrument():
+    """هندلرهای handlers.py و db.run را برای اندازه‌گیری می‌پوشاند (باید قبل از build_application اجرا شود)."""
+    original_run = db.run
+
+    async def timed_run(func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original_run(func, *args, **kwargs)
+        finally:
+            spent = _db_time.get()
+            if spent is not None:
+                spent[0] += time.perf_counter() - start
+
+    db.run = timed_run
+
+    for name, func in list(vars(h).items()):
+        if inspect.iscoroutinefunction(func) and func.__module__ == h.__name__ and not name.startswith("_"):
+            setattr(h, name, _wrap_handler(name, func))
+
+
+def _wrap_handler(name, func):
+    @functools.wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        # هندلرهایی که هندلر دیگری را صدا می‌زنند (مثلا start -> show_home_menu) فقط یک بار شمرده می‌شوند
+        if _db_time.get() is not None:
+            return await func(update, context, *args, **kwargs)
+        spent = [0.0]
+        token = _db_time.set(spent)
+        start = time.perf_counter()
+        try:
+            return await func(update, context, *args, **kwargs)
+        finally:
+            handler_latency[name].append(time.perf_counter() - start)
+            handler_db_time[name] += spent[0]
+            _db_time.reset(token)
+    return wrapper
+
+
+async def feed(application, update_json):
+    update = Update.de_json(update_json, application.bot)
+    await application.update_processor.process_update(update, application.process_update(update))
+
+
+async def buyer_flow(application, user_id, product_id):
+    for update in (make_command(user_id, "/start"),
+                   make_callback(user_id, "go_to_purchase"),
+                   make_callback(user_id, f"product_{product_id}"),
+                   make_callback(user_id, "apply_discount_code"),
+                   make_text(user_id, DISCOUNT_CODE),
+                   make_callback(user_id, "confirm_payment_info"),
+                   make_photo(user_id, f"receipt{user_id}")):
+        await feed(application, update)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(total_updates, elapsed, request):
+    print(f"\n{'handler':<32}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'db ms/call':>12}")
+    for name, values in sorted(handler_latency.items(), key=lambda item: -percentile(item[1], 0.99)):
+        print(f"{name:<32}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}{percentile(values, 0.95) * 1000:>10.2f}"
+              f"{percentile(values, 0.99) * 1000:>10.2f}{handler_db_time[name] / len(values) * 1000:>12.2f}")
+    all_values = [value for values in handler_latency.values() for value in values]
+    print(f"\nupdates: {total_updates}  wall: {elapsed:.2f}s  throughput: {total_updates / elapsed:.0f} updates/s")
+    print(f"overall handler latency p50/p95/p99: {percentile(all_values, 0.5) * 1000:.2f} / "
+          f"{percentile(all_values, 0.95) * 1000:.2f} / {percentile(all_values, 0.99) * 1000:.2f} ms  "
+          f"(mean {statistics.mean(all_values) * 1000:.2f} ms)")
+    print(f"fake Bot API calls: {len(request.calls)}")
+
+
+async def run(args):
+    request = FakeTelegramRequest(latency=args.api_latency)
+    application = bot_main.build_application(token="123456:LOADTEST", request=request)
+    products = [product_id for product_id, _, _ in catalog.get_products()]
+    user_ids = [10_000_000 + i for i in range(args.users)]
+
+    async with application:
+        await application.start()
+        start = time.perf_counter()
+        updates = 0
+
+        # کاربران در موج‌هایی به اندازه concurrency وارد می‌شوند
+        for offset in range(0, len(user_ids), args.concurrency):
+            wave = user_ids[offset:offset + args.concurrency]
+            await asyncio.gather(*(buyer_flow(application, user_id, products[user_id % len(products)]) for user_id in wave))
+            updates += len(wave) * 7
+
+        admin_chat = config.ADMIN_CHANNEL_ID
+        if args.bulk_approve:
+            config.BULK_APPROVE_LIMIT = max(config.BULK_APPROVE_LIMIT, len(user_ids))
+            await feed(application, make_command(config.ADMIN_TELEGRAM_ID, "/approveall all"))
+            updates += 1
+        else:
+            for user_id in user_ids:
+                transaction_id = application.user_data[user_id].get("transaction_id")
+                if transaction_id:
+                    await feed(application, make_callback(config.ADMIN_TELEGRAM_ID, f"admin_approve_{transaction_id}", chat_id=admin_chat))
+                    updates += 1
+
+        elapsed = time.perf_counter() - start
+        await application.stop()
+
+    report(updates, elapsed, request)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200, help="تعداد کاربرانی که هم‌زمان فرآیند خرید را اجرا می‌کنند")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="تأخیر مصنوعی هر فراخوانی Bot API (ثانیه)")
+    parser.add_argument("--bulk-approve", action="store_true", help="تایید همه تراکنش‌ها با یک /approveall به‌جای دکمه تایید هر کدام")
+    parser.add_argument("--respect-rate-limits", action="store_true", help="محدودیت‌های نرخ صف خروجی را اعمال کن")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATABASE_NAME = os.path.join(tmp, "loadtest.db")
+        db.setup_database()
+        catalog.load()
+        for product_id, _, _ in catalog.get_products():
+            db.add_links_to_bank(product_id, (f"https://example.com/{product_id}/{i}" for i in range(args.users)))
+        db.create_discount_code(DISCOUNT_CODE, "percent", 10, max_uses=args.users * 2)
+        db.close_connection()
+
+        instrument()
+        asyncio.run(run(args))
+        db.shutdown()
+
+
+if __name__ == "__main__":
+    main()
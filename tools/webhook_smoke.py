@@ -0,0 +1,102 @@
+"""آزمون محلی حالت webhook: سرور وب‌هوک واقعی PTB را با Bot API جعلی بالا می‌آورد و آپدیت مصنوعی می‌فرستد.
+
+اجرا از ریشه پروژه (به شبکه و توکن واقعی نیازی ندارد):
+    python tools/webhook_smoke.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import catalog
+import config
+import database as db
+import main as bot_main
+from tools.fakebot import FakeTelegramRequest, make_callback, make_command
+
+PORT = 18443
+URL_PATH = "smoke-bot"
+
+
+def configure():
+    config.WEBHOOK_LISTEN = "127.0.0.1"
+    config.WEBHOOK_PORT = PORT
+    config.WEBHOOK_URL_PATH = URL_PATH
+    config.WEBHOOK_URL = f"http://127.0.0.1:{PORT}/{URL_PATH}"
+    config.WEBHOOK_MAX_CONNECTIONS = 10
+
+
+def check_options(failures):
+    config.WEBHOOK_SECRET_TOKEN = "configured-secret"
+    if bot_main.webhook_options()["secret_token"] != "configured-secret":
+        failures.append("BOT_WEBHOOK_SECRET_TOKEN در webhook_options استفاده نشد")
+    # بدون توکن تنظیم‌شده، هر اجرا یک توکن تصادفی می‌سازد
+    config.WEBHOOK_SECRET_TOKEN = ""
+    first, second = bot_main.webhook_options()["secret_token"], bot_main.webhook_options()["secret_token"]
+    if not first or first == second:
+        failures.append("webhook_options توکن تصادفی نساخت")
+
+
+async def smoke():
+    configure()
+    failures = []
+    check_options(failures)
+    options = bot_main.webhook_options()
+    secret = options["secret_token"]
+    url = options["webhook_url"]
+
+    request = FakeTelegramRequest()
+    application = bot_main.build_application(token="123456:SMOKE", request=request)
+    async with application:
+        await application.start()
+        await application.updater.start_webhook(**options)
+        set_webhook = [params for method, params in request.calls if method == "setWebhook"]
+        if not set_webhook or set_webhook[0].get("secret_token") != secret or set_webhook[0].get("url") != url:
+            failures.append("setWebhook با آدرس و secret_token تولیدشده ثبت نشد")
+
+        updates = [make_command(1001, "/start"), make_callback(1001, "go_to_purchase"), make_callback(1001, "product_1")]
+        async with httpx.AsyncClient() as client:
+            bad = await client.post(url, content=json.dumps(updates[0]), headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            if bad.status_code != 403:
+                failures.append(f"توکن اشتباه باید 403 بدهد، نتیجه: {bad.status_code}")
+            for update in updates:
+                response = await client.post(url, content=json.dumps(update), headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret})
+                if response.status_code != 200:
+                    failures.append(f"آپدیت {update['update_id']} با کد {response.status_code} رد شد")
+
+        # منتظر می‌مانیم تا هر سه آپدیت پردازش شوند
+        for _ in range(50):
+            if request.count("sendMessage") >= 1 and request.count("editMessageText") >= 2:
+                break
+            await asyncio.sleep(0.1)
+        else:
+            failures.append(f"پاسخ‌های ربات دریافت نشد: {[method for method, _ in request.calls]}")
+
+        await application.updater.stop()
+        await application.stop()
+
+    return failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATABASE_NAME = os.path.join(tmp, "smoke.db")
+        db.setup_database()
+        catalog.load()
+        failures = asyncio.run(smoke())
+        db.shutdown()
+
+    if failures:
+        print("FAILED")
+        for failure in failures:
+            print(" -", failure)
+        sys.exit(1)
+    print("OK: webhook ثبت شد، توکن محرمانه بررسی شد و آپدیت‌ها پردازش شدند.")
+
+
+if __name__ == "__main__":
+    main()
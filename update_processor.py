@@ -0,0 +1,57 @@
+"""پردازش هم‌زمان آپدیت‌ها با حفظ ترتیب آپدیت‌های هر کاربر."""
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def ordering_key(update):
+    """کلیدی که آپدیت‌های هم‌کلید باید پشت سر هم پردازش شوند؛ اول کاربر، بعد چت."""
+    if isinstance(update, Update):
+        if update.effective_user:
+            return ("user", update.effective_user.id)
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """آپدیت‌های کاربران مختلف را موازی اجرا می‌کند و آپدیت‌های هر کاربر یا چت را دقیقا به ترتیب رسیدن.
+
+    ConversationHandler ها و منطق تراکنش فرض می‌کنند آپدیت‌های یک کاربر هم‌زمان اجرا نمی‌شوند،
+    پس برای هر کلید یک قفل FIFO نگه می‌داریم. قفل کلید قبل از گرفتن جای اجرا گرفته می‌شود تا
+    کاربری که پشت سر هم پیام می‌فرستد جای اجرای بقیه را اشغال نکند.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        # semaphore کلاس پایه همان سقف آپدیت‌های در حال اجراست
+        super().__init__(max_concurrent_updates)
+        self._locks = {}   # key -> [asyncio.Lock, تعداد آپدیت‌های منتظر یا در حال اجرا]
+
+    async def process_update(self, update, coroutine):
+        key = ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # اول نوبت کاربر، بعد جای اجرا؛ آپدیت‌های منتظر یک کاربر هیچ جای اجرایی نگه نمی‌دارند
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass